@@ -0,0 +1,460 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from blob_cache import BlobCache
+from broadcast import Broadcaster
+from consensus import encode_payload, is_round_number, proposal_message, round_message
+from key_cache import VerifyingKeyCache
+from log_shipper import LogShipper
+from metrics import round_id
+from node_protocol import (NodeProtocol, PROPOSE_RETRY_DELAY, REGISTRY_POLL_WAIT, REGISTRY_RETRY_DELAY,
+                           BLOB_CACHE_BYTES)
+from verify_pool import BatchVerifier
+import wire
+
+# asyncio node runtime: the IoTNode protocol on aiohttp instead of the
+# threaded Flask dev server.
+#
+# Serves the same /receive_proposal, /receive_prepare, /propose_block and
+# /status contract (plus /metrics, /traces and /blobs) from one event loop. Outbound
+# messages share an aiohttp connection pool, handlers hand follow-up messages
+# to tasks instead of blocking on them, and ECDSA work runs off the loop:
+# signing on a small thread pool, verification on the BatchVerifier. A slow
+# peer only holds a coroutine, so thousands of messages can be in flight on a
+# small device without a thread each. The protocol itself (round state,
+# quorums, registry merge) is node_protocol.NodeProtocol, shared with IoTNode.
+#
+#   python async_node.py <node_id> [central_server_url] [port]
+
+REQUEST_TIMEOUT = 5.0       # Total seconds for one outbound message
+CONNECTIONS_PER_PEER = 64   # Keep-alive connections pooled per peer
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        response = web.Response()
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = request.headers.get('Access-Control-Request-Headers', '*')
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+class AsyncIoTNode(NodeProtocol):
+    def __init__(self, node_id, central_server_url, verify_workers=None,
+                 pipeline_window=8, max_block_transactions=100, mempool_size=10000, quorum_f=None,
+                 public_url=None, key_dir='.', sign_workers=2, wire_format='json', group=None):
+        self.node_id = node_id
+        self.central_server_url = central_server_url
+        # Device fleet this node serves; the server maps it to a consensus
+        # group (shard) and the node only exchanges messages with that shard
+        self.group = group
+        self.shard = 0
+        # Log shipping stays on its own sender thread; ship() never blocks the loop
+        self.log_shipper = LogShipper(node_id, central_server_url, Broadcaster(max_workers=1))
+        # Without an explicit URL, the local ngrok agent is asked in start()
+        self.public_url = public_url
+        self.key_file = os.path.join(key_dir, f"node_{self.node_id}_key.pem")
+        self.load_or_generate_keys()
+        self.public_keys = {}  # Store public keys of other nodes
+        self.public_urls = {}  # Store public URLs of other nodes
+        self.registry_version = None  # Registry version public_keys/public_urls reflect
+        self.key_cache = VerifyingKeyCache()  # Parsed public keys of other nodes
+        self.blob_cache = BlobCache(BLOB_CACHE_BYTES)  # Payloads proposed or fetched, by digest
+        self.verifier = BatchVerifier(workers=verify_workers, key_cache=self.key_cache)
+        self.sign_executor = ThreadPoolExecutor(max_workers=sign_workers, thread_name_prefix='sign')
+        self.quorum_f = quorum_f  # Tolerated faulty nodes; None derives it from the cluster size
+        self.rounds = {}  # seq: {"view", "primary_id", "prepare_messages", "consensus_sent", "opened"}
+        # Round state is only touched from the event loop, so no lock is needed
+        self.rounds_lock = contextlib.nullcontext()
+        self.mempool = deque()
+        self.mempool_size = mempool_size
+        self.max_block_transactions = max_block_transactions
+        self.pipeline_window = pipeline_window
+        self.tasks = set()  # Background tasks, referenced until they finish
+        self.binary = wire_format == 'binary'  # Send protocol messages in the binary wire format
+        self.json_only = set()  # Base URLs that rejected the binary format
+        # Bound to the event loop, so created in start()
+        self.session = None
+        self.runner = None
+        self.mempool_ready = None
+        self.setup_metrics()
+        self.app = web.Application(middlewares=[cors_middleware])
+        self.setup_routes()
+
+    def setup_metrics(self):
+        super().setup_metrics()
+        self.telemetry.gauge('in_flight_tasks', 'Outbound messages and rounds in progress.', lambda: len(self.tasks))
+
+    def setup_routes(self):
+        self.app.router.add_post('/receive_proposal', self.receive_proposal)
+        self.app.router.add_post('/receive_prepare', self.receive_prepare)
+        self.app.router.add_post('/propose_block', self.propose_block)
+        self.app.router.add_get('/status', self.check_status)
+        self.app.router.add_get('/metrics', self.get_metrics)
+        self.app.router.add_get('/traces', self.get_traces)
+        self.app.router.add_get('/blobs/{digest}', self.get_blob)
+
+    # Messages arrive as JSON or in the binary wire format; None if malformed.
+    # Another wire version or kind is answered with 415 so the sender falls
+    # back to JSON.
+    async def read_message(self, request):
+        try:
+            return wire.read_body(request.content_type, await request.read())
+        except wire.UnsupportedMessage as e:
+            raise web.HTTPUnsupportedMediaType(text=json.dumps({"status": "failed", "message": str(e)}),
+                                               content_type='application/json')
+        except ValueError:
+            return None
+
+    async def receive_proposal(self, request):
+        proposal = await self.read_message(request)
+        if proposal is None:
+            return web.json_response({"status": "failed", "message": "Malformed message."}, status=400)
+        primary_node_id = str(proposal["node_id"])
+        view, seq = proposal["view"], proposal["seq"]
+        if not is_round_number(view) or not is_round_number(seq):
+            return web.json_response({"status": "failed", "message": "View and sequence number must be integers."}, status=400)
+        message = proposal_message(primary_node_id, view, seq, proposal["digest"])
+        with self.telemetry.span('verify', round_id(view, seq)):
+            valid = await self.verify_signature(message, proposal["signature"], self.public_keys.get(primary_node_id))
+        self.messages_received.inc(1, 'proposal', 'valid' if valid else 'invalid')
+        if valid:
+            self.log_message(f"Verified primary's proposal for round {view}/{seq}.", log_type='node')
+            self.open_round(view, seq, primary_node_id, proposal["digest"])
+            # Answer the primary now; the payload fetch and prepare go on their own task
+            self.spawn(self.accept_proposal(view, seq, primary_node_id, proposal["digest"]))
+        else:
+            self.log_message("Failed to verify primary's proposal.", log_type='node')
+        return web.json_response({"status": "received"})
+
+    # Only prepare once the payload the digest names is at hand
+    async def accept_proposal(self, view, seq, primary_id, digest):
+        with self.telemetry.span('fetch', round_id(view, seq)):
+            block_data = await self.fetch_payload(digest, primary_id)
+        if block_data is None:
+            self.log_message(f"Payload {digest} for round {view}/{seq} is unavailable.", log_type='node')
+            return
+        await self.send_prepare(view, seq)
+
+    # Block data for a proposal's digest; None if no source has it
+    async def fetch_payload(self, digest, primary_id):
+        block_data = self.cached_payload(digest)
+        if block_data is not None:
+            return block_data
+        for source, base_url in self.payload_sources(primary_id):
+            try:
+                async with self.session.get(f"{base_url}/blobs/{digest}",
+                                            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
+                    if response.status != 200:
+                        continue
+                    payload = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            block_data = self.accept_payload(digest, source, payload)
+            if block_data is not None:
+                return block_data
+        self.payload_fetches.inc(1, 'unavailable')
+        return None
+
+    # Payloads this node proposed or fetched, so replicas can get them
+    # peer-to-peer when the server no longer has one
+    async def get_blob(self, request):
+        payload = self.blob_cache.get(request.match_info['digest'])
+        if payload is None:
+            return web.json_response({"status": "failed", "message": "Unknown payload."}, status=404)
+        return web.Response(body=payload, content_type='application/json')
+
+    async def receive_prepare(self, request):
+        prepare_message = await self.read_message(request)
+        if prepare_message is None:
+            return web.json_response({"status": "failed", "message": "Malformed message."}, status=400)
+        node_id = str(prepare_message['node_id'])
+        view, seq = prepare_message['view'], prepare_message['seq']
+        if not is_round_number(view) or not is_round_number(seq):
+            return web.json_response({"status": "failed", "message": "View and sequence number must be integers."}, status=400)
+        with self.telemetry.span('verify', round_id(view, seq)):
+            valid = await self.verify_signature(round_message("prepared", view, seq, prepare_message['digest']),
+                                                prepare_message['signature'], self.public_keys.get(node_id))
+        self.messages_received.inc(1, 'prepare', 'valid' if valid else 'invalid')
+        if not valid:
+            print(f"Node {self.node_id}: Invalid prepare message from Node {node_id}.")
+            return web.json_response({"status": "received"})
+        if self.record_prepare(view, seq, node_id, prepare_message):
+            self.spawn(self.send_consensus(view, seq))
+        return web.json_response({"status": "received"})
+
+    async def propose_block(self, request):
+        message = await self.read_message(request)
+        block_data = message.get('block_data') if message else None
+        if not block_data:
+            self.log_message("Block data is missing.", log_type='node')
+            return web.json_response({"status": "failed", "message": "Block data is missing."}, status=400)
+        if len(self.mempool) >= self.mempool_size:
+            return web.json_response({"status": "failed", "message": "Mempool is full."}, status=503)
+        self.mempool.append(block_data)
+        self.mempool_ready.set()
+        self.log_message("Block proposal initiated.", log_type='node')
+        return web.json_response({"status": "success", "message": "Block proposal initiated."})
+
+    async def check_status(self, request):
+        self.log_message("Status: Running", log_type='node')
+        return web.json_response({"Status:": "Running", "runtime": "asyncio", "in_flight": len(self.tasks),
+                                  "key_cache": self.verifier.key_cache_stats(), "blob_cache": self.blob_cache.stats(),
+                                  "log_shipper": self.log_shipper.stats()})
+
+    async def get_metrics(self, request):
+        return web.Response(text=self.telemetry.expose(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+    async def get_traces(self, request):
+        limit = request.query.get('limit')
+        return web.json_response(self.telemetry.dump_traces(int(limit) if limit else None))
+
+    # Run a coroutine in the background, keeping a reference until it finishes
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # POST to a peer; never raises. Same outcome dict as Broadcaster.post, with
+    # the decoded JSON body under "body" instead of the response object.
+    # `encoded` is the payload already in binary form, if it has one.
+    async def post(self, base_url, path, payload, timeout=REQUEST_TIMEOUT, encoded=None):
+        start = time.perf_counter()
+        if encoded is None and self.binary:
+            encoded = wire.encode_message(path, payload)
+        try:
+            if encoded is not None and base_url not in self.json_only:
+                status, body = await self.send(base_url, path, timeout, data=encoded,
+                                               headers={'Content-Type': wire.CONTENT_TYPE})
+                if status == 415:
+                    self.json_only.add(base_url)
+                    status, body = await self.send(base_url, path, timeout, json=payload)
+            else:
+                status, body = await self.send(base_url, path, timeout, json=payload)
+            return {
+                "ok": status < 400,
+                "status_code": status,
+                "latency": time.perf_counter() - start,
+                "body": body,
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {
+                "ok": False,
+                "status_code": None,
+                "latency": time.perf_counter() - start,
+                "error": str(e) or type(e).__name__,
+            }
+
+    async def send(self, base_url, path, timeout, **body):
+        async with self.session.post(f"{base_url}{path}", timeout=aiohttp.ClientTimeout(total=timeout),
+                                     **body) as response:
+            try:
+                return response.status, await response.json(content_type=None)
+            except ValueError:
+                return response.status, None
+
+    # POST to every peer in {peer_id: base_url} at once; {peer_id: outcome}
+    async def broadcast(self, peers, path, payload, timeout=REQUEST_TIMEOUT):
+        encoded = wire.encode_message(path, payload) if self.binary else None
+        outcomes = await asyncio.gather(*(self.post(base_url, path, payload, timeout, encoded)
+                                          for base_url in peers.values()))
+        return dict(zip(peers, outcomes))
+
+    # Signing is CPU-bound, so it runs on sign_executor
+    def sign_blocking(self, message):
+        return self.private_key.sign(message.encode(), hashfunc=hashlib.sha256).hex()
+
+    async def sign_message(self, message, trace=None):
+        with self.telemetry.span('sign', trace):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.sign_executor, functools.partial(self.sign_blocking, message))
+
+    # Verification is batched on the BatchVerifier; the loop only awaits it
+    async def verify_signature(self, message, signature_hex, public_key_hex):
+        return await asyncio.wrap_future(self.verifier.submit(message, signature_hex, public_key_hex))
+
+    async def send_consensus(self, view, seq):
+        round_state = self.claim_consensus(seq)
+        if round_state is None:
+            return
+        digest = round_state["digest"]
+        with self.telemetry.span('commit', round_id(view, seq)):
+            consensus_message = self.round_vote(
+                "commit", view, seq, digest,
+                await self.sign_message(round_message("commit", view, seq, digest), round_id(view, seq)))
+            result = await self.post(self.central_server_url, "/commit_message", consensus_message)
+        if result["status_code"] == 200:
+            self.log_message("Sent consensus message to server.", log_type='node')
+        else:
+            self.log_message("Failed to send consensus message to server. "
+                             f"Status code: {result['status_code']}", log_type='node')
+
+    async def send_prepare(self, view, seq):
+        with self.telemetry.span('prepare', round_id(view, seq)):
+            round_state = self.rounds[seq]
+            digest = round_state["digest"]
+            prepare_message = self.round_vote(
+                "prepared", view, seq, digest,
+                await self.sign_message(round_message("prepared", view, seq, digest), round_id(view, seq)))
+            primary_url = self.public_urls[round_state["primary_id"]]
+            result = await self.post(primary_url, "/receive_prepare", prepare_message)
+        if result["status_code"] == 200:
+            await self.send_consensus(view, seq)
+        elif result["status_code"] is not None:
+            print(f"Node {self.node_id}: Failed to send prepare message to primary.")
+        else:
+            print(f"Node {self.node_id}: Error sending prepare message to primary: {result['error']}")
+
+    # Pack queued readings into blocks and start a round for each, with up to
+    # pipeline_window rounds being disseminated at once
+    async def propose_pending_blocks(self):
+        window = asyncio.Semaphore(self.pipeline_window)
+        while True:
+            await window.acquire()
+            while not self.mempool:
+                self.mempool_ready.clear()
+                await self.mempool_ready.wait()
+            count = min(len(self.mempool), self.max_block_transactions)
+            transactions = [self.mempool.popleft() for _ in range(count)]
+            # Always a list, so a reading that is itself a JSON array stays one transaction
+            block_data = transactions
+            round_info = await self.request_round(block_data)
+            if round_info is None:
+                # Window full or server unreachable: put the readings back and retry
+                self.mempool.extendleft(reversed(transactions))
+                window.release()
+                await asyncio.sleep(PROPOSE_RETRY_DELAY)
+                continue
+            task = self.spawn(self.disseminate_proposal(round_info["view"], round_info["seq"], block_data))
+            task.add_done_callback(lambda _: window.release())
+
+    # Ask the central server to open a round; it assigns (view, seq)
+    async def request_round(self, block_data):
+        result = await self.post(self.central_server_url, "/propose_block",
+                                 {"node_id": self.node_id, "block_data": block_data})
+        if result["status_code"] != 200:
+            print(f"Node {self.node_id}: Server did not open a round: {result.get('error', result['status_code'])}")
+            return None
+        round_info = result["body"]
+        self.rounds_proposed.inc()
+        self.telemetry.record('request_round', result["latency"], round_id(round_info["view"], round_info["seq"]))
+        return round_info
+
+    async def disseminate_proposal(self, view, seq, block_data):
+        with self.telemetry.span('pre_prepare', round_id(view, seq)):
+            # Replicas get the digest and fetch the payload once, not a copy each
+            digest = self.blob_cache.put(encode_payload(block_data))
+            proposal = {
+                "node_id": self.node_id,
+                "digest": digest,
+                "view": view,
+                "seq": seq,
+                "signature": await self.sign_message(proposal_message(self.node_id, view, seq, digest),
+                                                     round_id(view, seq)),
+            }
+            self.open_round(view, seq, str(self.node_id), digest)
+            if self.prepare_threshold() <= 0:
+                # Quorum without any other node (e.g. a single-node cluster)
+                self.spawn(self.send_consensus(view, seq))
+            with self.telemetry.span('fanout', round_id(view, seq)):
+                results = await self.broadcast(self.replicas(), "/receive_proposal", proposal)
+        for node_id, result in results.items():
+            if result["status_code"] is None:
+                print(f"Node {self.node_id}: Error sending proposal to Node {node_id}: {result['error']}")
+            elif result["status_code"] != 200:
+                print(f"Node {self.node_id}: Failed to send proposal to Node {node_id}.")
+        return results
+
+    async def register_node(self):
+        result = await self.post(self.central_server_url, "/register_node", self.registration())
+        if result["status_code"] == 201:
+            if isinstance(result["body"], dict):
+                self.shard = result["body"].get("shard", 0)
+            print(f"Node {self.node_id}: Registered with server (shard {self.shard}).")
+        else:
+            print(f"Node {self.node_id}: Registration failed: {result.get('error', result.get('body'))}")
+
+    # Fetch the registry: in full the first time, afterwards only the nodes
+    # that changed since self.registry_version. Returns False on failure.
+    async def get_public_keys(self, wait=0):
+        if self.registry_version is None:
+            params, timeout = None, 10
+        else:
+            params, timeout = {"since": self.registry_version, "wait": wait}, wait + 10
+        try:
+            async with self.session.get(f"{self.central_server_url}/public_keys", params=params,
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status != 200:
+                    print(f"Node {self.node_id}: Failed to get public keys.")
+                    return False
+                data = await response.json()
+                header_version = int(response.headers.get('X-Registry-Version', 0))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"Node {self.node_id}: Failed to get public keys: {e}")
+            return False
+        self.merge_registry(data, header_version)
+        return True
+
+    async def update_public_keys_periodically(self):
+        while True:
+            if not await self.get_public_keys(wait=REGISTRY_POLL_WAIT):
+                await asyncio.sleep(REGISTRY_RETRY_DELAY)
+
+    async def get_ngrok_url(self):
+        async with self.session.get('http://localhost:4040/api/tunnels') as response:
+            data = await response.json()
+        return data['tunnels'][0]['public_url']
+
+    # Serve on (host, port), register with the server and start the registry
+    # long-poll and the proposer. Must be awaited on the loop that runs the node.
+    async def start(self, host='0.0.0.0', port=5000):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=CONNECTIONS_PER_PEER))
+        self.mempool_ready = asyncio.Event()
+        if self.public_url is None:
+            self.public_url = await self.get_ngrok_url()
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        await self.register_node()
+        await self.get_public_keys()
+        self.spawn(self.update_public_keys_periodically())
+        self.spawn(self.propose_pending_blocks())
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.runner.cleanup()
+        await self.session.close()
+        self.sign_executor.shutdown(wait=False)
+        self.verifier.shutdown()
+
+    def run(self, port=5000):
+        async def serve():
+            await self.start(port=port)
+            await asyncio.Event().wait()  # Serve until interrupted
+        asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    # Usage: python async_node.py <node_id> [central_server_url] [port]
+    node_id = int(sys.argv[1])
+    central_server_url = sys.argv[2] if len(sys.argv) > 2 else os.environ.get(
+        'CENTRAL_SERVER_URL', "https://4795-2409-40f2-2010-4ce8-94a6-4cea-cd7f-cc3c.ngrok-free.app")
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    AsyncIoTNode(node_id, central_server_url, wire_format=os.environ.get('WIRE_FORMAT', 'json'),
+                 group=os.environ.get('NODE_GROUP')).run(port=port)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Consensus benchmark suite on top of the local cluster harness.
+#
+# For each cluster size a fresh process starts a LocalCluster and drives
+# readings into it like propose.py does, either closed-loop (C clients, each
+# waiting for its reading to commit before sending the next) or open-loop
+# (readings sent at a fixed rate regardless of progress). It reports commit
+# latency percentiles, throughput and CPU seconds per protocol phase, and
+# writes everything to a JSON file so runs can be compared for regressions.
+#
+#   python bench_cluster.py --sizes 4 8 16 32 64 --mode closed --clients 8
+#   python bench_cluster.py --sizes 4 16 --mode open --rate 50 --output results.json
+#   python bench_cluster.py --sizes 4 16 --runtime async
+
+# Functions whose thread CPU time is charged to each phase
+PHASES = {
+    "sign": [("iot_node", "IoTNode", "sign_message"), ("async_node", "AsyncIoTNode", "sign_blocking")],
+    "verify": [("verify_pool", None, "verify_one"), ("iot_node", "IoTNode", "verify_signature")],
+    "http": [("broadcast", "Broadcaster", "post")],
+    "persist": [("block_store", "BlockStore", "append")],
+}
+
+
+class PhaseCPU:
+    def __init__(self):
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def install(self):
+        import importlib
+        for phase, targets in PHASES.items():
+            for module_name, class_name, function_name in targets:
+                try:
+                    owner = importlib.import_module(module_name)
+                except ImportError:
+                    continue  # Optional runtime (e.g. async_node without aiohttp)
+                if class_name:
+                    owner = getattr(owner, class_name)
+                setattr(owner, function_name, self.wrap(phase, getattr(owner, function_name)))
+
+    def wrap(self, phase, function):
+        def timed(*args, **kwargs):
+            # Only the outermost timed call on a thread counts, so nested phases
+            # (e.g. verify inside a handler) aren't charged twice
+            if getattr(self.local, 'active', False):
+                return function(*args, **kwargs)
+            self.local.active = True
+            start = time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.thread_time() - start
+                self.local.active = False
+                with self.lock:
+                    self.seconds[phase] += elapsed
+        return timed
+
+
+class CommitWatcher:
+    # Polls the in-memory chain and records when each reading committed
+    def __init__(self, chain):
+        self.chain = chain
+        self.height = len(chain)
+        self.committed = {}  # reading: commit time
+        self.events = {}     # reading: threading.Event
+        self.lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def expect(self, reading):
+        event = threading.Event()
+        with self.lock:
+            self.events[reading] = event
+        return event
+
+    def _watch(self):
+        while self.running:
+            while self.height < len(self.chain):
+                block = self.chain[self.height]
+                self.height += 1
+                readings = block["block_data"] if isinstance(block["block_data"], list) else [block["block_data"]]
+                now = time.perf_counter()
+                with self.lock:
+                    for reading in readings:
+                        self.committed[reading] = now
+                        event = self.events.pop(reading, None)
+                        if event:
+                            event.set()
+            time.sleep(0.001)
+
+    def stop(self):
+        self.running = False
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_single(args):
+    from cluster import LocalCluster
+    phase_cpu = PhaseCPU()
+    phase_cpu.install()
+    cluster = LocalCluster(args.size, base_port=args.base_port,
+                           pipeline_window=args.window, max_block_transactions=args.batch,
+                           runtime=args.runtime, wire_format=args.wire).start()
+    watcher = CommitWatcher(cluster.chain)
+    submitted = {}  # reading: submit time
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def submit(node_index):
+        with counter_lock:
+            reading = f"bench-{args.size}-{next(counter)}"
+        event = watcher.expect(reading)
+        submitted[reading] = time.perf_counter()
+        cluster.propose(reading, node_index)
+        return event
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    deadline = wall_start + args.duration
+    if args.mode == 'closed':
+        def client(index):
+            while time.perf_counter() < deadline:
+                submit(index % args.proposers).wait(args.timeout)
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        interval = 1.0 / args.rate
+        with ThreadPoolExecutor(max_workers=64) as executor:
+            next_send, sent = wall_start, 0
+            while next_send < deadline:
+                executor.submit(submit, sent % args.proposers)
+                sent += 1
+                next_send += interval
+                time.sleep(max(0.0, next_send - time.perf_counter()))
+    # Give in-flight readings a chance to commit
+    drain_deadline = time.perf_counter() + args.timeout
+    while len(watcher.committed) < len(submitted) and time.perf_counter() < drain_deadline:
+        time.sleep(0.01)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    watcher.stop()
+
+    latencies = [watcher.committed[r] - t for r, t in submitted.items() if r in watcher.committed]
+    result = {
+        "cluster_size": args.size,
+        "mode": args.mode,
+        "runtime": args.runtime,
+        "wire": args.wire,
+        "clients": args.clients if args.mode == 'closed' else None,
+        "target_rate": args.rate if args.mode == 'open' else None,
+        "window": args.window,
+        "batch": args.batch,
+        "submitted": len(submitted),
+        "committed": len(latencies),
+        "blocks": len(cluster.chain),
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        "cpu_seconds": cpu,
+        "cpu_per_phase": phase_cpu.seconds,
+    }
+    cluster.stop()
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local cluster consensus benchmark.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)  # Set for the per-size child process
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--runtime', choices=['threaded', 'async'], default='threaded', help="node runtime")
+    parser.add_argument('--wire', choices=['json', 'binary'], default='json', help="protocol message encoding")
+    parser.add_argument('--clients', type=int, default=4, help="closed-loop concurrent clients")
+    parser.add_argument('--rate', type=float, default=20.0, help="open-loop readings per second")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of load per cluster size")
+    parser.add_argument('--timeout', type=float, default=30.0, help="max seconds to wait for a commit")
+    parser.add_argument('--proposers', type=int, default=1, help="number of nodes readings are spread over")
+    parser.add_argument('--window', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--base-port', type=int, default=7000)
+    parser.add_argument('--output', default=None, help="JSON results file (default bench_results/cluster-<time>.json)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.size is not None:
+        # Child process: one cluster size, result as JSON on stdout's last line
+        result = run_single(args)
+        sys.stdout.write("\n" + json.dumps(result) + "\n")
+        sys.stdout.flush()
+        os._exit(0)  # Don't wait for the cluster's daemon threads and keep-alive sockets
+
+    results = []
+    for size in args.sizes:
+        child_args = [sys.executable, os.path.abspath(__file__), '--size', str(size)]
+        for name in ('mode', 'runtime', 'wire', 'clients', 'rate', 'duration', 'timeout', 'proposers', 'window', 'batch', 'base_port'):
+            child_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        completed = subprocess.run(child_args, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"Cluster size {size} failed:\n{completed.stderr[-2000:]}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        latency = result["latency"]
+        print(f"n={size:<3} {result['throughput']:8.1f} readings/s  "
+              f"p50={latency['p50'] or 0:.3f}s p99={latency['p99'] or 0:.3f}s  "
+              f"cpu={result['cpu_seconds']:.1f}s  committed {result['committed']}/{result['submitted']}")
+
+    output = args.output or os.path.join('bench_results', f"cluster-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"args": vars(args), "results": results}, f, indent=4)
+    print(f"Results written to {output}")
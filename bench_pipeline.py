@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmark: pipelined, batched consensus rounds vs one block at a time.
+#
+# Runs the central server in-process (Flask test client) with simulated
+# replicas. Every protocol hop sleeps for `hop_delay` seconds to stand in for
+# the network, so the numbers show how much pipelining and mempool batching
+# hide round-trip latency.
+# Usage: python bench_pipeline.py [readings] [replicas] [hop_delay] [window] [batch]
+
+os.environ.setdefault('BLOCK_STORE_DIR', tempfile.mkdtemp(prefix='bench_pipeline_'))
+
+import logging
+import server
+from consensus import round_message
+from ecdsa import SigningKey, NIST256p
+
+server.logger.setLevel(logging.WARNING)
+
+
+def register_replicas(count):
+    client = server.app.test_client()
+    keys = {}
+    for i in range(count):
+        node_id = f"bench-{i}"
+        key = SigningKey.generate(curve=NIST256p)
+        client.post('/register_node', json={
+            "node_id": node_id,
+            "public_key": key.verifying_key.to_string().hex(),
+            "public_url": f"http://127.0.0.1:{6000 + i}",
+        })
+        keys[node_id] = key
+    return keys
+
+
+def run_round(keys, block_data, hop_delay):
+    client = server.app.test_client()
+    proposer = next(iter(keys))
+    while True:
+        response = client.post('/propose_block', json={"node_id": proposer, "block_data": block_data})
+        if response.status_code == 200:
+            break
+        time.sleep(hop_delay / 10)  # Pipeline window full
+    view, seq, digest = response.json["view"], response.json["seq"], response.json["digest"]
+    time.sleep(hop_delay * 2)  # pre-prepare to replicas, prepare back to the primary
+    time.sleep(hop_delay)      # commit messages to the server
+    for node_id, key in keys.items():
+        signature = key.sign(round_message("commit", view, seq, digest).encode(), hashfunc=hashlib.sha256).hex()
+        client.post('/commit_message', json={
+            "node_id": node_id, "status": "commit", "view": view, "seq": seq, "digest": digest,
+            "signature": signature,
+        })
+
+
+def run(keys, readings, hop_delay, window, batch):
+    server.PIPELINE_WINDOW = window
+    blocks = [readings[i:i + batch] for i in range(0, len(readings), batch)]
+    start_height = len(server.chain_cache)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        list(executor.map(lambda block: run_round(keys, block, hop_delay), blocks))
+    elapsed = time.perf_counter() - start
+    assert len(server.chain_cache) - start_height == len(blocks), "not every round committed"
+    return len(readings) / elapsed, len(blocks) / elapsed
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    replicas = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    hop_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    window = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    batch = int(sys.argv[5]) if len(sys.argv) > 5 else 20
+    keys = register_replicas(replicas)
+    readings = [f"reading-{i}" for i in range(count)]
+    print(f"{'mode':<28} {'readings/sec':>12} {'blocks/sec':>10}")
+    for label, mode_window, mode_batch in [
+        ("one block at a time", 1, 1),
+        (f"pipelined (window={window})", window, 1),
+        (f"pipelined + batch={batch}", window, batch),
+    ]:
+        reading_rate, block_rate = run(keys, readings, hop_delay, mode_window, mode_batch)
+        print(f"{label:<28} {reading_rate:>12.1f} {block_rate:>10.1f}")
+    server.batch_verifier.shutdown()
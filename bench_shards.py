@@ -0,0 +1,255 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+from werkzeug.serving import make_server
+from bench_cluster import percentile
+
+# Benchmark: aggregate commit throughput as the cluster is split into shards.
+#
+# For each shard count k a fresh process starts the central server with
+# SHARD_COUNT=k and one fleet process per shard, each running
+# --nodes-per-shard IoTNodes on loopback ports (node i is in shard i % k).
+# Every shard is a fleet of the same size, so adding shards adds fleets, and
+# fleets only share the server, as they would on separate machines. In each
+# fleet --clients closed-loop clients submit readings to the fleet's first
+# node and wait until the server's chain for that shard holds them. With
+# --batch 1 every reading is its own block, so one shard is bound by its
+# pipeline window and round latency; independent shards add their throughput
+# until the server (or the host's cores) saturate.
+#
+#   python bench_shards.py --shards 1 2 4 8 --nodes-per-shard 4 --duration 10
+
+
+def serve(app, port):
+    http_server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+# Child processes end their output with the result as one JSON line; node
+# threads may still print around it
+def last_result(output):
+    return json.loads(next(line for line in reversed(output.splitlines()) if line.startswith('{')))
+
+
+# Records when readings reach the server's chain for one shard
+class RemoteCommitWatcher:
+    def __init__(self, server_url, shard, interval=0.005):
+        self.url = f"{server_url}/blockchain"
+        self.shard = shard
+        self.interval = interval
+        self.session = requests.Session()
+        self.height = int(self.session.get(self.url, params={"shard": shard, "limit": 0},
+                                           timeout=10).headers['X-Chain-Height'])
+        self.committed = {}  # reading: commit time
+        self.events = {}     # reading: threading.Event
+        self.lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def expect(self, reading):
+        event = threading.Event()
+        with self.lock:
+            self.events[reading] = event
+        return event
+
+    def _watch(self):
+        while self.running:
+            try:
+                blocks = self.session.get(self.url, params={"shard": self.shard, "cursor": self.height},
+                                          timeout=10).json()
+            except (requests.RequestException, ValueError):
+                blocks = []
+            now = time.perf_counter()
+            for block in blocks:
+                self.height += 1
+                readings = block["block_data"] if isinstance(block["block_data"], list) else [block["block_data"]]
+                with self.lock:
+                    for reading in readings:
+                        self.committed[reading] = now
+                        event = self.events.pop(reading, None)
+                        if event:
+                            event.set()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+
+# Fleet process: the nodes of one shard plus the clients driving them
+def run_fleet(args):
+    from iot_node import IoTNode
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    shard, shards = args.fleet, args.shard_count
+    server_url = f"http://127.0.0.1:{args.base_port}"
+    key_dir = tempfile.mkdtemp(prefix='iot_fleet_')
+    nodes = []
+    for j in range(args.nodes_per_shard):
+        node_id = shard + j * shards
+        port = args.base_port + 1 + node_id
+        node = IoTNode(node_id, server_url, verify_workers=0, pipeline_window=args.window,
+                       max_block_transactions=args.batch, public_url=f"http://127.0.0.1:{port}",
+                       key_dir=key_dir, wire_format=args.wire)
+        serve(node.app, port)
+        nodes.append(node)
+    for node in nodes:
+        node.register_node()
+    deadline = time.monotonic() + 30
+    while not all(len(node.public_keys) == len(nodes) for node in nodes):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Shard {shard} registry incomplete.")
+        for node in nodes:
+            node.get_public_keys()
+        time.sleep(0.05)
+    watcher = RemoteCommitWatcher(server_url, shard)
+    proposer_url = nodes[0].public_url
+    print("ready", flush=True)
+    sys.stdin.readline()  # Start together with the other fleets
+
+    submitted = {}  # reading: submit time
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def run_client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with counter_lock:
+                reading = f"bench-{shards}-{shard}-{next(counter)}"
+            event = watcher.expect(reading)
+            submitted[reading] = time.perf_counter()
+            session.post(f"{proposer_url}/propose_block", json={"block_data": reading}, timeout=10)
+            event.wait(args.timeout)
+
+    cpu_start = time.process_time()
+    threads = [threading.Thread(target=run_client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    watcher.stop()
+    latencies = [watcher.committed[r] - t for r, t in submitted.items() if r in watcher.committed]
+    return {"shard": shard, "submitted": len(submitted), "latencies": latencies,
+            "cpu_seconds": time.process_time() - cpu_start}
+
+
+# One shard count: the server in this process, a fleet process per shard
+def run_shard_count(args):
+    shards = args.shard_count
+    data_dir = tempfile.mkdtemp(prefix='iot_shards_')
+    os.environ['BLOCK_STORE_DIR'] = os.path.join(data_dir, 'blockchain_data')
+    os.environ['VERIFY_WORKERS'] = str(args.verify_workers)
+    os.environ['PIPELINE_WINDOW'] = str(args.window)
+    os.environ['SHARD_COUNT'] = str(shards)
+    import server
+    server.logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    serve(server.app, args.base_port)
+
+    fleets = []
+    for shard in range(shards):
+        fleet_args = [sys.executable, os.path.abspath(__file__), '--fleet', str(shard), '--shard-count', str(shards)]
+        for name in ('nodes_per_shard', 'wire', 'clients', 'duration', 'timeout', 'window', 'batch', 'base_port'):
+            fleet_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        fleets.append(subprocess.Popen(fleet_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+    for fleet in fleets:
+        for line in fleet.stdout:
+            if line.strip() == "ready":
+                break
+        else:
+            raise RuntimeError("Fleet exited before it was ready.")
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for fleet in fleets:
+        fleet.stdin.write("go\n")
+        fleet.stdin.flush()
+    fleet_results = []
+    for fleet in fleets:
+        output, _ = fleet.communicate()
+        fleet_results.append(last_result(output))
+    wall = time.perf_counter() - wall_start
+    server_cpu = time.process_time() - cpu_start
+
+    latencies = [latency for result in fleet_results for latency in result["latencies"]]
+    return {
+        "shards": shards,
+        "cluster_size": shards * args.nodes_per_shard,
+        "nodes_per_shard": args.nodes_per_shard,
+        "wire": args.wire,
+        "clients_per_shard": args.clients,
+        "window": args.window,
+        "batch": args.batch,
+        "submitted": sum(result["submitted"] for result in fleet_results),
+        "committed": len(latencies),
+        "blocks": [len(shard.chain_cache) for shard in server.shards],
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "throughput_per_shard": [len(result["latencies"]) / wall if wall else 0.0 for result in fleet_results],
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        "server_cpu_seconds": server_cpu,
+        "fleet_cpu_seconds": [result["cpu_seconds"] for result in fleet_results],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput scaling with the number of shards.")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shard-count', type=int, help=argparse.SUPPRESS)  # Set for the per-count child process
+    parser.add_argument('--fleet', type=int, help=argparse.SUPPRESS)        # Set for the per-shard fleet process
+    parser.add_argument('--nodes-per-shard', type=int, default=4)
+    parser.add_argument('--wire', choices=['json', 'binary'], default='json', help="protocol message encoding")
+    parser.add_argument('--clients', type=int, default=16, help="closed-loop clients per shard")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of load per shard count")
+    parser.add_argument('--timeout', type=float, default=30.0, help="max seconds to wait for a commit")
+    parser.add_argument('--window', type=int, default=8, help="pipeline window per shard")
+    parser.add_argument('--batch', type=int, default=1, help="max readings per block")
+    parser.add_argument('--verify-workers', type=int, default=0, help="server signature verification processes")
+    parser.add_argument('--base-port', type=int, default=7000)
+    parser.add_argument('--output', default=None, help="JSON results file (default bench_results/shards-<time>.json)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.fleet is not None or args.shard_count is not None:
+        # Child process: a fleet, or one shard count; result as JSON on stdout's last line
+        result = run_fleet(args) if args.fleet is not None else run_shard_count(args)
+        sys.stdout.write("\n" + json.dumps(result) + "\n")
+        sys.stdout.flush()
+        os._exit(0)  # Don't wait for the cluster's daemon threads and keep-alive sockets
+
+    results = []
+    for shards in args.shards:
+        child_args = [sys.executable, os.path.abspath(__file__), '--shard-count', str(shards)]
+        for name in ('nodes_per_shard', 'wire', 'clients', 'duration', 'timeout', 'window', 'batch',
+                     'verify_workers', 'base_port'):
+            child_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        completed = subprocess.run(child_args, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{shards} shards failed:\n{completed.stderr[-2000:]}")
+            continue
+        result = last_result(completed.stdout)
+        results.append(result)
+        speedup = result["throughput"] / results[0]["throughput"] if results[0]["throughput"] else 0.0
+        latency = result["latency"]
+        print(f"shards={shards:<3} nodes={result['cluster_size']:<4} {result['throughput']:8.1f} readings/s "
+              f"(x{speedup:.2f})  p50={latency['p50'] or 0:.3f}s p99={latency['p99'] or 0:.3f}s  "
+              f"server cpu={result['server_cpu_seconds']:.1f}s  committed {result['committed']}/{result['submitted']}")
+
+    output = args.output or os.path.join('bench_results', f"shards-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"args": vars(args), "results": results}, f, indent=4)
+    print(f"Results written to {output}")
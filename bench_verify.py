@@ -0,0 +1,44 @@
+from ecdsa import SigningKey, NIST256p
+from verify_pool import BatchVerifier
+import hashlib
+import os
+import sys
+import time
+
+# Benchmark: signature verifications/sec against the number of worker processes.
+# Usage: python bench_verify.py [messages] [signers]
+
+def make_messages(count, signers):
+    keys = [SigningKey.generate(curve=NIST256p) for _ in range(signers)]
+    messages = []
+    for i in range(count):
+        key = keys[i % signers]
+        status = "prepared" if i % 2 else "commit"
+        signature = key.sign(status.encode(), hashfunc=hashlib.sha256).hex()
+        messages.append((status, signature, key.verifying_key.to_string().hex()))
+    return messages
+
+def run(messages, workers):
+    verifier = BatchVerifier(workers=workers)
+    # Warm up the pool and the per-worker key caches
+    for future in [verifier.submit(*message) for message in messages[:max(1, workers) * 8]]:
+        future.result()
+    start = time.perf_counter()
+    futures = [verifier.submit(*message) for message in messages]
+    valid = sum(1 for future in futures if future.result())
+    elapsed = time.perf_counter() - start
+    verifier.shutdown()
+    assert valid == len(messages), "benchmark signatures failed to verify"
+    return len(messages) / elapsed
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    signers = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    messages = make_messages(count, signers)
+    print(f"{'workers':>8} {'verifs/sec':>12} {'speedup':>8}")
+    baseline = None
+    worker_counts = sorted({0, 1, 2, 4, os.cpu_count() or 1})
+    for workers in worker_counts:
+        rate = run(messages, workers)
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>12.1f} {rate / baseline:>7.2f}x")
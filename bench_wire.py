@@ -0,0 +1,80 @@
+import hashlib
+import json
+import sys
+import time
+from ecdsa import SigningKey, NIST256p
+import wire
+from consensus import encode_payload, payload_digest, proposal_message, round_message
+
+# Benchmark: JSON vs the binary wire format for each protocol message.
+#
+# Reports body bytes and encode/decode microseconds per message. Decoding
+# JSON includes turning the hex signature into bytes, since verification
+# needs it either way. HTTP headers are not counted.
+# Usage: python bench_wire.py [iterations] [batch_size]
+
+
+def sample_messages(batch_size):
+    key = SigningKey.generate(curve=NIST256p)
+    node_id = 3
+
+    def sign(message):
+        return key.sign(message.encode(), hashfunc=hashlib.sha256).hex()
+
+    reading = {"device": "sensor-17", "temperature": 21.4, "humidity": 48}
+    batch = [dict(reading, n=i) for i in range(batch_size)]
+    digest = payload_digest(encode_payload(batch))
+    return [
+        ("register", '/register_node', {
+            "node_id": node_id,
+            "public_key": key.verifying_key.to_string().hex(),
+            "public_url": "https://4795-2409-40f2-2010-4ce8-94a6-4cea-cd7f-cc3c.ngrok-free.app",
+        }),
+        ("round request", '/propose_block', {"node_id": node_id, "block_data": "Sample block data"}),
+        ("round request (batch)", '/propose_block', {"node_id": node_id, "block_data": batch}),
+        ("proposal (digest)", '/receive_proposal', {
+            "node_id": node_id, "digest": digest, "view": 0, "seq": 1235,
+            "signature": sign(proposal_message(node_id, 0, 1235, digest)),
+        }),
+        ("prepare", '/receive_prepare', {
+            "node_id": node_id, "status": "prepared", "view": 0, "seq": 1234, "digest": digest,
+            "signature": sign(round_message("prepared", 0, 1234, digest)),
+        }),
+        ("commit", '/commit_message', {
+            "node_id": node_id, "status": "commit", "view": 0, "seq": 1234, "digest": digest,
+            "signature": sign(round_message("commit", 0, 1234, digest)),
+        }),
+    ]
+
+
+def per_call(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def json_decode(body):
+    message = json.loads(body)
+    for field in ("signature", "public_key"):
+        if field in message:
+            message[field] = bytes.fromhex(message[field])
+    return message
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"{'message':<24} {'json B':>7} {'binary B':>8} {'saved':>6} "
+          f"{'json enc/dec us':>16} {'binary enc/dec us':>18}")
+    for label, path, message in sample_messages(batch_size):
+        json_body = json.dumps(message).encode()
+        binary_body = wire.encode_message(path, message)
+        assert wire.decode(binary_body)[1]["node_id"] == str(message["node_id"])
+        json_encode = per_call(lambda: json.dumps(message).encode(), iterations)
+        json_decode_us = per_call(lambda: json_decode(json_body), iterations)
+        binary_encode = per_call(lambda: wire.encode_message(path, message), iterations)
+        binary_decode = per_call(lambda: wire.decode(binary_body), iterations)
+        saved = 1 - len(binary_body) / len(json_body)
+        print(f"{label:<24} {len(json_body):>7} {len(binary_body):>8} {saved:>6.0%} "
+              f"{json_encode:>7.2f} / {json_decode_us:<6.2f} {binary_encode:>8.2f} / {binary_decode:<6.2f}")
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from consensus import payload_digest
+
+# Content-addressed store of encoded block payloads, keyed by SHA-256 digest.
+#
+# Proposals only carry a payload's digest. The server keeps the payloads it
+# opened rounds for and nodes keep the ones they proposed or fetched, so a
+# replica downloads each payload at most once and identical payloads are
+# stored once. The least recently used payloads are evicted beyond max_bytes.
+class BlobCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.blobs = OrderedDict()  # digest: payload bytes, least recently used first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0  # Payloads stored again while already held
+        self.evictions = 0
+
+    def _store(self, digest, payload):
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs.move_to_end(digest)
+                self.duplicates += 1
+                return
+            self.blobs[digest] = payload
+            self.bytes += len(payload)
+            while self.bytes > self.max_bytes and len(self.blobs) > 1:
+                _, evicted = self.blobs.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    # Store a payload and return its digest
+    def put(self, payload):
+        digest = payload_digest(payload)
+        self._store(digest, payload)
+        return digest
+
+    # Store a payload fetched from elsewhere, only if it hashes to `digest`
+    def put_verified(self, digest, payload):
+        if payload_digest(payload) != digest:
+            return False
+        self._store(digest, payload)
+        return True
+
+    def get(self, digest):
+        with self.lock:
+            payload = self.blobs.get(digest)
+            if payload is None:
+                self.misses += 1
+                return None
+            self.blobs.move_to_end(digest)
+            self.hits += 1
+            return payload
+
+    def stats(self):
+        return {
+            "size": len(self.blobs),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "duplicates": self.duplicates,
+            "evictions": self.evictions,
+        }
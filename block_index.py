@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import sys
+import threading
+from merkle import block_transactions, hash_leaf
+
+# Persistent secondary indexes over the block store.
+#
+# An SQLite file next to the block segments maps proposer and commit time to
+# heights, and the Merkle leaf hash of every reading to (height, position), so
+# "blocks node 17 committed between 02:00 and 03:00" or "was this reading
+# committed" are B-tree range lookups instead of a chain scan. A batched block
+# gets one content entry per reading. The index is derived data: catch_up()
+# indexes whatever the block store holds beyond it (e.g. after a crash
+# between the two writes), and rebuild() recreates it from scratch.
+#
+#   python block_index.py rebuild <block_store_dir> [index_file]   (server stopped)
+
+INDEX_FILE = 'block_index.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    committed_by TEXT NOT NULL,
+    commit_time TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_by_proposer ON blocks (committed_by, commit_time);
+CREATE INDEX IF NOT EXISTS blocks_by_time ON blocks (commit_time);
+CREATE TABLE IF NOT EXISTS transactions (
+    hash TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (hash, height, position)
+) WITHOUT ROWID;
+"""
+
+
+class BlockIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # One connection shared by request threads, serialized by self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # Rebuildable from the block store
+        self.db.executescript(SCHEMA)
+
+    def __len__(self):
+        with self.lock:
+            row = self.db.execute("SELECT MAX(height) FROM blocks").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def _insert(self, height, block):
+        self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)",
+                        (height, str(block.get("committed_by", "unknown")), block.get("commit_time")))
+        self.db.executemany("INSERT OR IGNORE INTO transactions VALUES (?, ?, ?)",
+                            [(hash_leaf(tx), height, position)
+                             for position, tx in enumerate(block_transactions(block))])
+
+    def add(self, height, block):
+        with self.lock, self.db:
+            self._insert(height, block)
+
+    # Index blocks the store has beyond the index, in one transaction per batch
+    def catch_up(self, store, batch_size=1000):
+        start = len(self)
+        height = start
+        batch = []
+        for block in store.iter_blocks(start):
+            batch.append((height, block))
+            height += 1
+            if len(batch) >= batch_size:
+                self._add_many(batch)
+                batch = []
+        if batch:
+            self._add_many(batch)
+        return height - start
+
+    def _add_many(self, batch):
+        with self.lock, self.db:
+            for height, block in batch:
+                self._insert(height, block)
+
+    def rebuild(self, store):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM blocks")
+            self.db.execute("DELETE FROM transactions")
+        return self.catch_up(store)
+
+    # Heights in ascending order after `after`, optionally filtered by
+    # proposer and an inclusive ISO commit_time range
+    def heights(self, committed_by=None, time_from=None, time_to=None, after=-1, limit=100):
+        clauses, params = ["height > ?"], [after]
+        if committed_by is not None:
+            clauses.append("committed_by = ?")
+            params.append(str(committed_by))
+        if time_from is not None:
+            clauses.append("commit_time >= ?")
+            params.append(time_from)
+        if time_to is not None:
+            clauses.append("commit_time <= ?")
+            params.append(time_to)
+        query = f"SELECT height FROM blocks WHERE {' AND '.join(clauses)} ORDER BY height LIMIT ?"
+        with self.lock:
+            return [row[0] for row in self.db.execute(query, params + [limit])]
+
+    # [(height, position)] of every committed copy of a reading, by leaf hash
+    def find_transaction(self, leaf_hash, after=-1, limit=100):
+        with self.lock:
+            return self.db.execute("SELECT height, position FROM transactions WHERE hash = ? AND height > ? "
+                                   "ORDER BY height, position LIMIT ?", (leaf_hash, after, limit)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'rebuild':
+        print("Usage: python block_index.py rebuild <block_store_dir> [index_file]")
+        sys.exit(1)
+    from block_store import BlockStore
+    store_dir = sys.argv[2]
+    index = BlockIndex(sys.argv[3] if len(sys.argv) > 3 else os.path.join(store_dir, INDEX_FILE))
+    store = BlockStore(store_dir)
+    print(f"Indexed {index.rebuild(store)} blocks into {index.path}.")
+    store.close()
+    index.close()
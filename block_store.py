@@ -0,0 +1,321 @@
+import bisect
+import itertools
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+# Append-only segmented block store.
+#
+# Blocks are written as one compact JSON object per line into segment files
+# named after the height of their first block (e.g. 00000000000000000000.log).
+# Every segment has a sidecar .idx file holding one 8-byte big-endian offset
+# per block, so any height can be read with a single seek. Segments roll over
+# after `segment_size` blocks and are never rewritten.
+
+INDEX_ENTRY = struct.Struct('>Q')
+LOG_SUFFIX = '.log'
+INDEX_SUFFIX = '.idx'
+
+
+class BlockStore:
+    def __init__(self, directory, segment_size=10000, sync_every=1, sync_interval=0.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_every = max(1, sync_every)      # fsync after this many appends (group commit)
+        self.sync_interval = sync_interval        # ...or once this many seconds have passed
+        self.lock = threading.RLock()
+        self.segment_bases = []                   # Sorted first heights of every segment
+        self.segment_offsets = {}                 # base height: [byte offset of each block]
+        self.height = 0                           # Number of blocks in the store
+        self.log_file = None
+        self.index_file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._open_segments()
+        self._flusher = None
+        if self.sync_interval > 0:
+            # Background flusher so trailing appends don't stay unsynced forever
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def _segment_path(self, base, suffix):
+        return os.path.join(self.directory, f"{base:020d}{suffix}")
+
+    def _open_segments(self):
+        bases = []
+        for name in os.listdir(self.directory):
+            if name.endswith(LOG_SUFFIX) and name[:-len(LOG_SUFFIX)].isdigit():
+                bases.append(int(name[:-len(LOG_SUFFIX)]))
+        bases.sort()
+        for base in bases[:-1]:
+            offsets = self._read_index(base)
+            self.segment_bases.append(base)
+            self.segment_offsets[base] = offsets
+        if bases:
+            tail = bases[-1]
+            self.segment_bases.append(tail)
+            self.segment_offsets[tail] = self._recover_tail(tail)
+            self.height = tail + len(self.segment_offsets[tail])
+        else:
+            self.segment_bases.append(0)
+            self.segment_offsets[0] = []
+        self._open_tail_for_append()
+
+    def _read_index(self, base):
+        path = self._segment_path(base, INDEX_SUFFIX)
+        if not os.path.exists(path):
+            return self._scan_offsets(base, 0)[0]
+        with open(path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i)[0] for i in range(0, usable, INDEX_ENTRY.size)]
+
+    # Walk a segment log from `start` and return the offsets of every complete
+    # record plus the byte position where the valid data ends.
+    def _scan_offsets(self, base, start):
+        offsets = []
+        end = start
+        with open(self._segment_path(base, LOG_SUFFIX), 'rb') as f:
+            f.seek(start)
+            position = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                offsets.append(position)
+                position += len(line)
+                end = position
+        return offsets, end
+
+    # Crash-safe tail recovery: the index may be ahead of or behind the log,
+    # and the log may end in a partially written record. Keep only index
+    # entries that point inside the log, rescan anything after them and
+    # truncate both files to the last complete block.
+    def _recover_tail(self, base):
+        log_path = self._segment_path(base, LOG_SUFFIX)
+        log_size = os.path.getsize(log_path)
+        offsets = []
+        for offset in self._read_index(base):
+            # Index entries are written in order; stop at the first one that isn't
+            if offset >= log_size or (offsets and offset <= offsets[-1]):
+                break
+            offsets.append(offset)
+        # The last indexed record itself may be torn, so always rescan from it
+        start = offsets.pop() if offsets else 0
+        scanned, end = self._scan_offsets(base, start)
+        offsets.extend(scanned)
+        if end != log_size:
+            with open(log_path, 'r+b') as f:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        with open(self._segment_path(base, INDEX_SUFFIX), 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(offset) for offset in offsets))
+            f.flush()
+            os.fsync(f.fileno())
+        return offsets
+
+    def _open_tail_for_append(self):
+        base = self.segment_bases[-1]
+        self.log_file = open(self._segment_path(base, LOG_SUFFIX), 'ab')
+        self.index_file = open(self._segment_path(base, INDEX_SUFFIX), 'ab')
+
+    def _roll_segment(self):
+        self._sync()
+        self.log_file.close()
+        self.index_file.close()
+        base = self.height
+        self.segment_bases.append(base)
+        self.segment_offsets[base] = []
+        self._open_tail_for_append()
+        self._fsync_directory()
+
+    def _fsync_directory(self):
+        # Make new segment files durable on POSIX; not supported on Windows
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _sync(self):
+        self.log_file.flush()
+        self.index_file.flush()
+        os.fsync(self.log_file.fileno())
+        os.fsync(self.index_file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _flush_periodically(self):
+        while not self.closed:
+            time.sleep(self.sync_interval)
+            with self.lock:
+                if self.closed:
+                    return
+                if self.unsynced:
+                    self._sync()
+
+    # Append a block and return its height
+    def append(self, block):
+        record = json.dumps(block, separators=(',', ':')).encode() + b'\n'
+        with self.lock:
+            base = self.segment_bases[-1]
+            if self.height - base >= self.segment_size:
+                self._roll_segment()
+                base = self.segment_bases[-1]
+            offset = self.log_file.tell()
+            self.log_file.write(record)
+            self.index_file.write(INDEX_ENTRY.pack(offset))
+            self.segment_offsets[base].append(offset)
+            height = self.height
+            self.height += 1
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+            else:
+                # Hand the bytes to the OS so readers see them immediately
+                self.log_file.flush()
+                self.index_file.flush()
+            return height
+
+    def flush(self):
+        with self.lock:
+            if self.unsynced:
+                self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self._sync()
+            self.closed = True
+            self.log_file.close()
+            self.index_file.close()
+
+    def __len__(self):
+        return self.height
+
+    def _locate(self, height):
+        index = bisect.bisect_right(self.segment_bases, height) - 1
+        base = self.segment_bases[index]
+        return base, self.segment_offsets[base][height - base]
+
+    def get(self, height):
+        if height < 0:
+            height += self.height
+        if not 0 <= height < self.height:
+            raise IndexError(f"Block height {height} out of range.")
+        with self.lock:
+            base, offset = self._locate(height)
+            with open(self._segment_path(base, LOG_SUFFIX), 'rb') as f:
+                f.seek(offset)
+                return json.loads(f.readline())
+
+    # Yield blocks in [start, end) with one sequential read per segment
+    def iter_blocks(self, start=0, end=None):
+        with self.lock:
+            end = self.height if end is None else min(end, self.height)
+            start = max(0, start)
+            if start >= end:
+                return
+            first = bisect.bisect_right(self.segment_bases, start) - 1
+            segments = [(base, self.segment_offsets[base]) for base in self.segment_bases[first:]]
+        height = start
+        for base, offsets in segments:
+            if height >= end:
+                break
+            with open(self._segment_path(base, LOG_SUFFIX), 'rb') as f:
+                f.seek(offsets[height - base])
+                while height < end and height - base < len(offsets):
+                    yield json.loads(f.readline())
+                    height += 1
+
+    def read_range(self, start=0, end=None):
+        return list(self.iter_blocks(start, end))
+
+    def read_all(self):
+        return self.read_range(0)
+
+
+# List-like view of the chain for the server: the newest `capacity` blocks
+# stay in memory and older heights are read from the store on demand, so
+# opening it costs the same however long the chain is. Blocks are appended
+# to the store first, then to the cache.
+class ChainCache:
+    def __init__(self, store, capacity=10000):
+        self.store = store
+        self.lock = threading.Lock()
+        self.height = len(store)
+        self.recent = deque(store.iter_blocks(max(0, self.height - capacity)), maxlen=capacity)
+
+    def __len__(self):
+        return self.height
+
+    def append(self, block):
+        with self.lock:
+            self.recent.append(block)
+            self.height += 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.height)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.read_range(start, stop)
+        with self.lock:
+            height = key + self.height if key < 0 else key
+            if not 0 <= height < self.height:
+                raise IndexError(f"Block height {key} out of range.")
+            first_cached = self.height - len(self.recent)
+            if height >= first_cached:
+                return self.recent[height - first_cached]
+        return self.store.get(height)
+
+    def read_range(self, start, end):
+        with self.lock:
+            end = min(end, self.height)
+            first_cached = self.height - len(self.recent)
+            cached = list(itertools.islice(self.recent, max(0, start - first_cached),
+                                           max(0, end - first_cached)))
+        blocks = self.store.read_range(start, min(end, first_cached)) if start < first_cached else []
+        return blocks + cached
+
+    def __iter__(self):
+        return iter(self.read_range(0, self.height))
+
+
+# One-shot import of a legacy blockchain.json into an empty block store
+def migrate_from_json(json_path, store):
+    if len(store):
+        raise ValueError("Refusing to migrate into a non-empty block store.")
+    with open(json_path, 'r') as f:
+        blockchain = json.load(f)
+    for block in blockchain:
+        store.append(block)
+    store.flush()
+    return len(blockchain)
+
+
+if __name__ == '__main__':
+    # Usage: python block_store.py migrate blockchain.json blockchain_data
+    if len(sys.argv) != 4 or sys.argv[1] != 'migrate':
+        print("Usage: python block_store.py migrate <blockchain.json> <store directory>")
+        sys.exit(1)
+    store = BlockStore(sys.argv[3], sync_every=1000)
+    count = migrate_from_json(sys.argv[2], store)
+    store.close()
+    print(f"Migrated {count} blocks into {sys.argv[3]}.")
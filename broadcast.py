@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+import wire
+
+# Concurrent fan-out over persistent keep-alive sessions.
+#
+# Each peer base URL gets its own requests.Session, so repeated messages reuse
+# the same TCP/TLS connection. broadcast() posts to every peer at once and
+# waits at most `timeout` seconds, so one dead replica can't stall a round.
+#
+# With wire_format='binary', protocol messages (wire.MESSAGE_KINDS) are sent in
+# the compact binary encoding. A peer that answers 415 gets JSON from then on.
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class Broadcaster:
+    def __init__(self, max_workers=32, timeout=DEFAULT_TIMEOUT, wire_format='json'):
+        self.timeout = timeout
+        self.binary = wire_format == 'binary'
+        self.json_only = set()  # Base URLs that rejected the binary format
+        self.sessions = {}  # base_url: requests.Session
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='broadcast')
+
+    def session_for(self, base_url):
+        session = self.sessions.get(base_url)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(base_url)
+                if session is None:
+                    session = requests.Session()
+                    self.sessions[base_url] = session
+        return session
+
+    # Close sessions for peers that are no longer registered
+    def retain(self, base_urls):
+        keep = set(base_urls)
+        with self.lock:
+            for base_url in [url for url in self.sessions if url not in keep]:
+                self.sessions.pop(base_url).close()
+
+    # Binary body for a protocol message, or None to send JSON
+    def encode(self, path, payload):
+        return wire.encode_message(path, payload) if self.binary else None
+
+    # POST to a single peer; never raises, returns an outcome dict. `encoded`
+    # is the payload already in binary form, so a broadcast encodes it once.
+    def post(self, base_url, path, payload, timeout=None, encoded=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        try:
+            session = self.session_for(base_url)
+            body = None
+            if base_url not in self.json_only:
+                body = encoded if encoded is not None else self.encode(path, payload)
+            if body is not None:
+                response = session.post(f"{base_url}{path}", data=body, timeout=timeout,
+                                        headers={'Content-Type': wire.CONTENT_TYPE})
+                if response.status_code == 415:
+                    self.json_only.add(base_url)
+                    response = session.post(f"{base_url}{path}", json=payload, timeout=timeout)
+            else:
+                response = session.post(f"{base_url}{path}", json=payload, timeout=timeout)
+            return {
+                "ok": response.ok,
+                "status_code": response.status_code,
+                "latency": time.perf_counter() - start,
+                "response": response,
+            }
+        except requests.RequestException as e:
+            return {
+                "ok": False,
+                "status_code": None,
+                "latency": time.perf_counter() - start,
+                "error": str(e),
+            }
+
+    # POST `payload` to every peer in {peer_id: base_url} concurrently.
+    # Returns {peer_id: outcome}; peers that miss the deadline are reported
+    # as timed out while their request finishes in the background.
+    def broadcast(self, peers, path, payload, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        encoded = self.encode(path, payload)
+        futures = {peer_id: self.executor.submit(self.post, base_url, path, payload, timeout, encoded)
+                   for peer_id, base_url in peers.items()}
+        # Connect and read timeouts each get `timeout`, so allow for both
+        wait(futures.values(), timeout=timeout * 2)
+        results = {}
+        for peer_id, future in futures.items():
+            if future.done():
+                results[peer_id] = future.result()
+            else:
+                results[peer_id] = {
+                    "ok": False,
+                    "status_code": None,
+                    "latency": timeout * 2,
+                    "error": "deadline exceeded",
+                }
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
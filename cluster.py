@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+import requests
+from werkzeug.serving import make_server
+
+# Local multi-node cluster on loopback ports, all in one process.
+#
+# Starts the central server app and N IoTNode instances, each on its own
+# 127.0.0.1 port, with the loopback URL standing in for the ngrok lookup. The
+# server module holds its state in globals, so there can be one cluster per
+# process; run separate processes to compare cluster sizes. With
+# runtime='async' the nodes are AsyncIoTNodes sharing one event loop thread.
+# With shards=k node i joins shard i % k (its node id is its group).
+#
+#   cluster = LocalCluster(4)
+#   cluster.start()
+#   cluster.propose("reading")
+#   cluster.stop()
+
+
+class LocalCluster:
+    def __init__(self, size, base_port=7000, data_dir=None, verify_workers=0,
+                 pipeline_window=8, max_block_transactions=100, quiet=True, runtime='threaded',
+                 wire_format='json', shards=1):
+        self.size = size
+        self.base_port = base_port
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix='iot_cluster_')
+        self.verify_workers = verify_workers
+        self.pipeline_window = pipeline_window
+        self.max_block_transactions = max_block_transactions
+        self.quiet = quiet
+        self.runtime = runtime
+        self.wire_format = wire_format  # 'binary' for the compact protocol encoding
+        self.shards = shards
+        self.loop = None      # Event loop the asyncio nodes run on
+        self.server = None    # The imported server module
+        self.nodes = []
+        self.http_servers = []
+        self.client = requests.Session()  # Plays the device submitting readings
+
+    @property
+    def server_url(self):
+        return f"http://127.0.0.1:{self.base_port}"
+
+    def node_url(self, index):
+        return f"http://127.0.0.1:{self.base_port + 1 + index}"
+
+    def _serve(self, app, port):
+        http_server = make_server('127.0.0.1', port, app, threaded=True)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        self.http_servers.append(http_server)
+
+    def start(self):
+        # The server reads its configuration from the environment at import time
+        os.environ.setdefault('BLOCK_STORE_DIR', os.path.join(self.data_dir, 'blockchain_data'))
+        os.environ.setdefault('VERIFY_WORKERS', str(self.verify_workers))
+        os.environ.setdefault('PIPELINE_WINDOW', str(self.pipeline_window))
+        os.environ.setdefault('SHARD_COUNT', str(self.shards))
+        import server
+        from iot_node import IoTNode
+        self.server = server
+        if self.quiet:
+            server.logger.setLevel(logging.WARNING)
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self._serve(server.app, self.base_port)
+
+        key_dir = os.path.join(self.data_dir, 'keys')
+        os.makedirs(key_dir, exist_ok=True)
+        if self.runtime == 'async':
+            self._start_async_nodes(key_dir)
+            return self
+        for i in range(self.size):
+            node = IoTNode(i, self.server_url,
+                           verify_workers=self.verify_workers,
+                           pipeline_window=self.pipeline_window,
+                           max_block_transactions=self.max_block_transactions,
+                           public_url=self.node_url(i),
+                           key_dir=key_dir,
+                           wire_format=self.wire_format)
+            self._serve(node.app, self.base_port + 1 + i)
+            self.nodes.append(node)
+        for node in self.nodes:
+            node.register_node()
+        for node in self.nodes:
+            node.get_public_keys()
+        self.wait_until(self.registry_complete)
+        return self
+
+    # Every node knows all the peers of its shard
+    def registry_complete(self):
+        return all(len(node.public_keys) == len(range(i % self.shards, self.size, self.shards))
+                   for i, node in enumerate(self.nodes))
+
+    # Async nodes register and fetch the registry themselves in start(), then
+    # pick up later registrations through their long-poll
+    def _start_async_nodes(self, key_dir):
+        from async_node import AsyncIoTNode
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        for i in range(self.size):
+            node = AsyncIoTNode(i, self.server_url,
+                                verify_workers=self.verify_workers,
+                                pipeline_window=self.pipeline_window,
+                                max_block_transactions=self.max_block_transactions,
+                                public_url=self.node_url(i),
+                                key_dir=key_dir,
+                                wire_format=self.wire_format)
+            asyncio.run_coroutine_threadsafe(node.start('127.0.0.1', self.base_port + 1 + i), self.loop).result()
+            self.nodes.append(node)
+        self.wait_until(self.registry_complete)
+
+    def wait_until(self, condition, timeout=30.0, interval=0.01):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError("Cluster did not reach the expected state in time.")
+            time.sleep(interval)
+
+    # Submit a reading to a node the same way propose.py does
+    def propose(self, block_data, node_index=0):
+        response = self.client.post(f"{self.node_url(node_index)}/propose_block",
+                                    json={"block_data": block_data}, timeout=10)
+        return response.status_code == 200
+
+    @property
+    def chain(self):
+        return self.server.chain_cache
+
+    # One chain per shard, indexed by shard id
+    @property
+    def chains(self):
+        return [shard.chain_cache for shard in self.server.shards]
+
+    def stop(self):
+        if self.loop is not None:
+            for node in self.nodes:
+                asyncio.run_coroutine_threadsafe(node.stop(), self.loop).result(timeout=10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+        for http_server in self.http_servers:
+            http_server.shutdown()
+        self.http_servers = []
+        if self.server is not None:
+            for shard in self.server.shards:
+                shard.block_store.close()
+            self.server.log_archive.close()
@@ -0,0 +1,50 @@
+import hashlib
+import json
+
+# Signed message formats shared by the server and the nodes.
+#
+# Consensus rounds are identified by (view, seq). Every signed message names
+# its round, so a prepare or commit from one round can't be replayed into
+# another while several rounds are in flight.
+#
+# Payloads are content-addressed: a proposal signs the SHA-256 digest of the
+# block data's canonical JSON encoding instead of embedding the data, and
+# replicas fetch the payload by digest. Prepares and commits sign the digest
+# too, so a vote only counts for the payload its sender actually saw.
+
+
+def encode_payload(block_data):
+    # A block holds one reading or a batch of readings packed from the mempool
+    return json.dumps(block_data, separators=(',', ':'), sort_keys=True).encode()
+
+
+def payload_digest(payload):
+    return hashlib.sha256(payload).hexdigest()
+
+
+def proposal_message(node_id, view, seq, digest):
+    return f"{node_id}:{view}:{seq}:{digest}"
+
+
+def round_message(status, view, seq, digest):
+    return f"{status}:{view}:{seq}:{digest}"
+
+
+# Views and sequence numbers are plain integers; anything else (a string
+# "3", a float, a bool) is a malformed message
+def is_round_number(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# PBFT tolerates f faulty nodes out of n >= 3f + 1. Without an explicit f the
+# largest f the cluster size allows is used.
+def max_faulty(cluster_size, f=None):
+    if f is not None:
+        return f
+    return max(0, (cluster_size - 1) // 3)
+
+
+# Votes needed to decide: 2f + 1 when n = 3f + 1, and in general
+# ceil((n + f + 1) / 2) so two quorums always share an honest node
+def quorum_size(cluster_size, f=None):
+    return min(cluster_size, (cluster_size + max_faulty(cluster_size, f)) // 2 + 1)
@@ -1,16 +1,23 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import './Blockchain.css'; // Import the CSS file for styling
 
 const Blockchain = () => {
     const [blocks, setBlocks] = useState([]);
+    const blocksRef = useRef([]);
     const centralServerUrl = 'http://127.0.0.1:5000'; // URL of the central server
 
-    // Function to fetch blockchain data
+    // Function to fetch blockchain data. Only blocks we don't have yet are
+    // requested, the chain is append-only.
     const fetchBlockchain = async () => {
         try {
-            const response = await axios.get(`${centralServerUrl}/blockchain`);
-            setBlocks(response.data);
+            const response = await axios.get(`${centralServerUrl}/blockchain`, {
+                params: { start: blocksRef.current.length },
+            });
+            if (response.data.length > 0) {
+                blocksRef.current = [...blocksRef.current, ...response.data];
+                setBlocks(blocksRef.current);
+            }
         } catch (error) {
             console.error('Error fetching blockchain:', error);
         }
@@ -39,7 +46,7 @@ const Blockchain = () => {
                 {blocks.map((block, index) => (
                     <div className="block" key={index}>
                         <div className="block-data">
-                            <strong>Data: </strong> {block.block_data}
+                            <strong>Data: </strong> {Array.isArray(block.block_data) ? block.block_data.join(', ') : block.block_data}
                         </div>
                         <br></br>
                         <div className="block-info">
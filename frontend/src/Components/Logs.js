@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import io from 'socket.io-client';
 
@@ -7,42 +7,74 @@ const Logs = () => {
     const [logs, setLogs] = useState({});
     const [loadingCentral, setLoadingCentral] = useState(false); // To track loading state for central logs
     const [loadingNodes, setLoadingNodes] = useState(false); // To track loading state for node logs
+    const cursorRef = useRef(null); // Sequence number of the newest log we have
+    const epochRef = useRef(null); // Server run the cursor belongs to
 
     const centralServerPort = 5000; // Port of the central server
 
+    const recentLogLimit = 100; // Most recent logs shown for the server and per node
+
+    // Log archive search
+    const [searchQuery, setSearchQuery] = useState('');
+    const [searchLevel, setSearchLevel] = useState('');
+    const [searchResults, setSearchResults] = useState(null);
+    const [searchCursor, setSearchCursor] = useState(null); // Next (older) page, if any
+
     // Function to fetch registered nodes from the central server
     const fetchNodes = async () => {
         try {
             const response = await axios.get(`http://127.0.0.1:${centralServerPort}/public_keys`);
-            setNodes(response.data); // Convert to array of [node_id, public_key]
+            setNodes(response.data); // Object of node_id: {public_key, public_url}
+            return response.data;
         } catch (error) {
             console.log('Error fetching nodes:', error);
+            return {};
         }
     };
 
-    // Function to fetch logs for a specific node
+    // Function to fetch the most recent logs of a specific node from the archive
     const fetchLogs = async (nodeId) => {
         try {
-            const response = await axios.get(`http://127.0.0.1:${centralServerPort}/node_logs/${nodeId}`);
+            const response = await axios.get(`http://127.0.0.1:${centralServerPort}/logs/search`, {
+                params: { node_id: nodeId, log_type: 'node', limit: recentLogLimit },
+            });
             setLogs((prevLogs) => ({
                 ...prevLogs,
-                [nodeId]: response.data,
+                [nodeId]: response.data.reverse(), // Newest first from the archive; show oldest first
             }));
         } catch (error) {
             console.error(`Error fetching logs for node ${nodeId}:`, error);
         }
     };
 
+    // Search the archive; with `cursor`, append the next (older) page
+    const searchLogs = async (cursor = null) => {
+        try {
+            const params = { limit: recentLogLimit };
+            if (searchQuery) params.q = searchQuery;
+            if (searchLevel) params.level = searchLevel;
+            if (cursor) params.cursor = cursor;
+            const response = await axios.get(`http://127.0.0.1:${centralServerPort}/logs/search`, { params });
+            setSearchResults((prevResults) => (cursor ? [...(prevResults || []), ...response.data] : response.data));
+            setSearchCursor(response.headers['x-next-cursor'] || null);
+        } catch (error) {
+            console.error('Error searching logs:', error);
+        }
+    };
+
     // Function to fetch both nodes and their logs
     const fetchData = async () => {
         setLoadingCentral(true);
         setLoadingNodes(true);
 
         try {
-            const serverLogsResponse = await axios.get(`http://127.0.0.1:${centralServerPort}/logs`);
+            const serverLogsResponse = await axios.get(`http://127.0.0.1:${centralServerPort}/logs/search`, {
+                params: { log_type: 'central', limit: recentLogLimit },
+            });
             setLogs((prevLogs) => ({
                 ...prevLogs,
-                central: serverLogsResponse.data.central_logs, // Assign the central logs correctly
+                // Newest first from the archive; show oldest first, formatted like pushed logs
+                central: serverLogsResponse.data.reverse().map((log) => `${log.time.replace('T', ' ')} - ${log.level} - ${log.log}`),
             }));
         } catch (error) {
             console.error('Error fetching central server logs:', error);
@@ -51,9 +83,8 @@ const Logs = () => {
         }
 
         try {
-            await fetchNodes(); // Fetch nodes first
-            // Wait for nodes to be set before fetching logs
-            await Promise.all(nodes.map(([nodeId]) => fetchLogs(nodeId))); // Fetch logs for each node
+            const registeredNodes = await fetchNodes(); // Fetch nodes first
+            await Promise.all(Object.keys(registeredNodes).map((nodeId) => fetchLogs(nodeId))); // Fetch logs for each node
         } catch (fetchError) {
             console.error('Error fetching nodes or their logs:', fetchError);
         } finally {
@@ -64,6 +95,9 @@ const Logs = () => {
     // Initialize the Socket.IO client
     useEffect(() => {
         const socket = io(`http://127.0.0.1:${centralServerPort}`, {
+            // On reconnect, resume from our cursor instead of taking a new snapshot
+            // (the server sends one anyway if it restarted since)
+            auth: (cb) => cb(cursorRef.current !== null ? { cursor: cursorRef.current, epoch: epochRef.current } : {}),
             reconnection: true,
             reconnectionAttempts: 5,
             reconnectionDelay: 2000,
@@ -78,40 +112,50 @@ const Logs = () => {
             console.error(null); // Clear any connection errors once connected
         });
 
-        // Handle initial logs from the server
+        // Handle the initial snapshot from the server
         const handleInitialLogs = (initialLogs) => {
+            cursorRef.current = initialLogs.cursor;
+            epochRef.current = initialLogs.epoch;
             setLogs((prevLogs) => ({
                 ...prevLogs,
+                ...(initialLogs.node_logs || {}),
                 central: initialLogs.central_logs || [], // Ensure central logs are added
             }));
         };
 
-        // Dynamic event listeners for central server logs
-        const handleServerLogUpdate = (log) => {
-            setLogs((prevLogs) => ({
-                ...prevLogs,
-                central: prevLogs.central ? [...prevLogs.central, log] : [log],
-            }));
-        };
-
-        const handleNodeLogUpdate = (data) => {
-            console.log("Node Log Update: ", data)
-            const { node_id, log } = data;
-            setLogs((prevLogs) => ({
-                ...prevLogs,
-                [node_id]: prevLogs[node_id] ? [...prevLogs[node_id], log] : [log],
-            }));
+        // Coalesced updates: everything logged since our cursor, in one frame
+        const handleLogBatch = (batch, ack) => {
+            // A frame resent after a lost ack can overlap what we already have:
+            // keep only entries after our cursor (any entry if the server restarted)
+            const applied = batch.epoch === epochRef.current ? cursorRef.current : null;
+            const isNew = (seq) => applied === null || seq > applied;
+            cursorRef.current = applied === null ? batch.cursor : Math.max(applied, batch.cursor);
+            epochRef.current = batch.epoch;
+            const centralLogs = batch.central_logs.filter((log, index) => isNew(batch.central_seqs[index]));
+            setLogs((prevLogs) => {
+                const nextLogs = {
+                    ...prevLogs,
+                    central: [...(prevLogs.central || []), ...centralLogs],
+                };
+                Object.entries(batch.node_logs).forEach(([nodeId, nodeLogs]) => {
+                    const newLogs = nodeLogs.filter((log) => isNew(log.seq));
+                    if (newLogs.length > 0) {
+                        nextLogs[nodeId] = [...(prevLogs[nodeId] || []), ...newLogs];
+                    }
+                });
+                return nextLogs;
+            });
+            if (ack) ack(); // Lets the server send the next frame
         };
 
         // Add event listeners
         socket.on('server_logs', handleInitialLogs);
-        socket.on('server_log_update', handleServerLogUpdate);
-        socket.on('node_log_update', handleNodeLogUpdate);
+        socket.on('log_batch', handleLogBatch);
 
         // Cleanup on component unmount
         return () => {
-            socket.off('server_log_update', handleServerLogUpdate);
-            socket.off('node_log_update', handleNodeLogUpdate);
+            socket.off('server_logs', handleInitialLogs);
+            socket.off('log_batch', handleLogBatch);
             socket.close();
         };
     }, [centralServerPort]);
@@ -130,6 +174,41 @@ const Logs = () => {
 
     return (
         <>
+            <div style={{ marginTop: '20px', width: '100%', paddingTop: '10px' }}>
+                <h2>Search Logs:</h2>
+                <form onSubmit={(e) => { e.preventDefault(); searchLogs(); }} style={{ display: 'flex', gap: '10px', marginBottom: '10px' }}>
+                    <input
+                        type="text"
+                        placeholder="Words to find"
+                        value={searchQuery}
+                        onChange={(e) => setSearchQuery(e.target.value)}
+                        style={{ flex: 1, padding: '5px' }}
+                    />
+                    <select value={searchLevel} onChange={(e) => setSearchLevel(e.target.value)}>
+                        <option value="">Any level</option>
+                        <option value="INFO">INFO</option>
+                        <option value="WARNING">WARNING</option>
+                        <option value="ERROR">ERROR</option>
+                    </select>
+                    <button type="submit">Search</button>
+                </form>
+                {searchResults !== null && (
+                    searchResults.length > 0 ? (
+                        <div style={{ maxHeight: '400px', overflowY: 'auto', border: '2px solid #ccc', padding: '20px' }}>
+                            {searchResults.map((log) => (
+                                <div key={log.id} style={{ marginBottom: '10px', padding: '5px', backgroundColor: '#f1f1f1', borderRadius: '4px' }}>
+                                    <p>{log.log}</p>
+                                    <small>{log.time} - {log.level} - {log.node_id !== null ? `Node ${log.node_id}` : 'Server'} ({log.log_type})</small>
+                                </div>
+                            ))}
+                            {searchCursor && <button onClick={() => searchLogs(searchCursor)}>Load older</button>}
+                        </div>
+                    ) : (
+                        <p>No matching logs.</p>
+                    )
+                )}
+            </div>
+
             <div style={{ marginTop: '20px', width: '100%', paddingTop: '10px' }}>
                 <h2>Central Server Logs:</h2>
                 {loadingCentral ? (
@@ -1,32 +1,71 @@
 from flask_cors import CORS
 import requests
-from ecdsa import SigningKey, VerifyingKey, NIST256p, BadSignatureError
+from ecdsa import BadSignatureError
+from key_cache import VerifyingKeyCache
+from blob_cache import BlobCache
+from verify_pool import BatchVerifier
+from broadcast import Broadcaster
+from log_shipper import LogShipper
+from consensus import encode_payload, is_round_number, proposal_message, round_message
+from metrics import round_id
+from node_protocol import (NodeProtocol, PROPOSE_RETRY_DELAY, REGISTRY_POLL_WAIT, REGISTRY_RETRY_DELAY,
+                           BLOB_CACHE_BYTES)
+import wire
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
 import sys
 import threading
 import time
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 
 block_data = ""
 
-class IoTNode:
-    def __init__(self, node_id, central_server_url):
+class IoTNode(NodeProtocol):
+    def __init__(self, node_id, central_server_url, verify_workers=None,
+                 pipeline_window=8, max_block_transactions=100, mempool_size=10000, quorum_f=None,
+                 public_url=None, key_dir='.', wire_format='json', group=None):
         self.node_id = node_id
         self.central_server_url = central_server_url
-        self.public_url = self.get_ngrok_url()
-        self.key_file = f"node_{self.node_id}_key.pem"
+        # Device fleet this node serves; the server maps it to a consensus
+        # group (shard) and the node only exchanges messages with that shard
+        self.group = group
+        self.shard = 0
+        # Keep-alive sessions and concurrent fan-out to peers; wire_format='binary'
+        # sends protocol messages in the compact encoding (JSON for peers that refuse it)
+        self.broadcaster = Broadcaster(wire_format=wire_format)
+        self.log_shipper = LogShipper(node_id, central_server_url, self.broadcaster)
+        # Without an explicit URL (e.g. a loopback address), ask the local ngrok agent
+        self.public_url = public_url or self.get_ngrok_url()
+        self.key_file = os.path.join(key_dir, f"node_{self.node_id}_key.pem")
         self.load_or_generate_keys()
         self.public_keys = {}  # Store public keys of other nodes
         self.public_urls = {}  # Store public URLs of other nodes
+        self.registry_version = None  # Registry version public_keys/public_urls reflect
+        self.key_cache = VerifyingKeyCache()  # Parsed public keys of other nodes
+        self.blob_cache = BlobCache(BLOB_CACHE_BYTES)  # Payloads proposed or fetched, by digest
+        # Prepare bursts are verified in micro-batches on a process pool
+        self.verifier = BatchVerifier(workers=verify_workers, key_cache=self.key_cache)
         self.app = Flask(__name__)
         CORS(self.app, origins="*")
         self.setup_routes()
+        self.quorum_f = quorum_f  # Tolerated faulty nodes; None derives it from the cluster size
         self.received_proposal = None
-        self.prepare_messages = {}
+        self.rounds = {}  # seq: {"view", "primary_id", "prepare_messages", "consensus_sent"}
+        self.rounds_lock = threading.Lock()
         self.consensus_reached = False
         self.is_primary = False
         self.current_primary_id = None
+        # Device readings wait in the mempool and are packed into blocks, up to
+        # pipeline_window rounds being disseminated at once
+        self.mempool = deque()
+        self.mempool_ready = threading.Condition()
+        self.mempool_size = mempool_size
+        self.max_block_transactions = max_block_transactions
+        self.round_executor = ThreadPoolExecutor(max_workers=pipeline_window, thread_name_prefix='round')
+        self.setup_metrics()
+        threading.Thread(target=self.propose_pending_blocks, daemon=True).start()
 
     def get_ngrok_url(self):
         response = requests.get('http://localhost:4040/api/tunnels')
@@ -34,67 +73,72 @@ class IoTNode:
         public_url = data['tunnels'][0]['public_url']
         return public_url
 
-    def log_message(self, message, log_type='node'):
-        log_data = {
-            "node_id": self.node_id,
-            "log": message,
-            "log_type": log_type
-        }
-        try:
-            response = requests.post(f"{self.central_server_url}/node_logs", json=log_data)
-            if response.status_code == 200:
-                print(f"Node {self.node_id}: Log sent successfully.")
-            else:
-                print(f"Node {self.node_id}: Failed to send log. Status code: {response.status_code}")
-        except Exception as e:
-            print(f"Node {self.node_id}: Error sending log: {e}")
-
-    def load_or_generate_keys(self):
-        if os.path.exists(self.key_file):
-            # Load existing key
-            with open(self.key_file, 'rb') as f:
-                self.private_key = SigningKey.from_pem(f.read())
-            self.public_key = self.private_key.verifying_key
-            self.log_message(f"Loaded existing key pair.", log_type='node')
-        else:
-            # Generate new key
-            self.private_key = SigningKey.generate(curve=NIST256p)
-            self.public_key = self.private_key.verifying_key
-            # Save the key to a file
-            with open(self.key_file, 'wb') as f:
-                f.write(self.private_key.to_pem())
-            self.log_message(f"Generated new key pair.", log_type='node')
+    # Messages arrive as JSON or in the binary wire format; None if malformed
+    def read_message(self):
+        if request.mimetype == wire.CONTENT_TYPE:
+            try:
+                return wire.decode(request.get_data())[1]
+            except wire.UnsupportedMessage:
+                raise  # Answered with 415 so the sender falls back to JSON
+            except ValueError:
+                return None
+        return request.json
 
     def setup_routes(self):
+        @self.app.errorhandler(wire.UnsupportedMessage)
+        def unsupported_message(e):
+            return jsonify({"status": "failed", "message": str(e)}), 415
+
         @self.app.route('/receive_proposal', methods=['POST'])
         def receive_proposal():
-            proposal = request.json
+            proposal = self.read_message()
+            if proposal is None:
+                return jsonify({"status": "failed", "message": "Malformed message."}), 400
             primary_node_id = str(proposal["node_id"])
-            block_data = proposal["block_data"]
+            digest = proposal["digest"]
             signature = proposal["signature"]
-            message = f"{primary_node_id}:{block_data}"
+            view, seq = proposal["view"], proposal["seq"]
+            if not is_round_number(view) or not is_round_number(seq):
+                return jsonify({"status": "failed", "message": "View and sequence number must be integers."}), 400
+            message = proposal_message(primary_node_id, view, seq, digest)
             primary_public_key_hex = self.public_keys.get(primary_node_id)
-            if self.verify_signature(message, signature, primary_public_key_hex):
-                self.log_message(f"Verified primary's proposal.", log_type='node')
-                self.received_proposal = proposal
+            with self.telemetry.span('verify', round_id(view, seq)):
+                valid = self.verify_signature(message, signature, primary_public_key_hex)
+            self.messages_received.inc(1, 'proposal', 'valid' if valid else 'invalid')
+            if valid:
+                self.log_message(f"Verified primary's proposal for round {view}/{seq}.", log_type='node')
+                # Only prepare once the payload the digest names is at hand
+                with self.telemetry.span('fetch', round_id(view, seq)):
+                    block_data = self.fetch_payload(digest, primary_node_id)
+                if block_data is None:
+                    self.log_message(f"Payload {digest} for round {view}/{seq} is unavailable.", log_type='node')
+                    return jsonify({"status": "failed", "message": "Payload unavailable."}), 503
+                self.received_proposal = dict(proposal, block_data=block_data)
                 self.current_primary_id = primary_node_id  # Set the current primary
-                self.send_prepare()
+                self.open_round(view, seq, primary_node_id, digest)
+                self.send_prepare(view, seq)
             else:
-                self.log_message(f"Failed to verify primary's proposal.", log_type='node')
+                self.log_message("Failed to verify primary's proposal.", log_type='node')
             return jsonify({"status": "received"}), 200
 
         @self.app.route('/receive_prepare', methods=['POST'])
         def receive_prepare():
-            prepare_message = request.json
+            prepare_message = self.read_message()
+            if prepare_message is None:
+                return jsonify({"status": "failed", "message": "Malformed message."}), 400
             node_id = str(prepare_message['node_id'])
             signature = prepare_message['signature']
+            view, seq, digest = prepare_message['view'], prepare_message['seq'], prepare_message['digest']
+            if not is_round_number(view) or not is_round_number(seq):
+                return jsonify({"status": "failed", "message": "View and sequence number must be integers."}), 400
             public_key_hex = self.public_keys.get(node_id)
-            if self.verify_signature("prepared", signature, public_key_hex):
-                print(f"Node {self.node_id}: Received prepare message from Node {node_id}.")
-                self.prepare_messages[node_id] = prepare_message
-                if len(self.prepare_messages) >= len(self.public_keys) - 1:
-                    print(f"Node {self.node_id}: Received all prepare messages.")
-                    self.send_consensus()
+            with self.telemetry.span('verify', round_id(view, seq)):
+                valid = self.verifier.verify(round_message("prepared", view, seq, digest), signature, public_key_hex)
+            self.messages_received.inc(1, 'prepare', 'valid' if valid else 'invalid')
+            if valid:
+                print(f"Node {self.node_id}: Received prepare message from Node {node_id} for round {view}/{seq}.")
+                if self.record_prepare(view, seq, node_id, prepare_message):
+                    self.send_consensus(view, seq)
             else:
                 print(f"Node {self.node_id}: Invalid prepare message from Node {node_id}.")
             return jsonify({"status": "received"}), 200
@@ -102,24 +146,47 @@ class IoTNode:
         @self.app.route('/propose_block', methods=['POST'])
         def propose_block():
             # Allow any node to propose a block
-            block_data = request.json.get('block_data')
+            message = self.read_message()
+            block_data = message.get('block_data') if message else None
             if block_data:
-                self.is_primary = True
-                self.current_primary_id = str(self.node_id)
-                self.pre_prepare(block_data)
-                self.log_message(f"Block proposal initiated.", log_type='node')
+                with self.mempool_ready:
+                    if len(self.mempool) >= self.mempool_size:
+                        return jsonify({"status": "failed", "message": "Mempool is full."}), 503
+                    self.mempool.append(block_data)
+                    self.mempool_ready.notify()
+                self.log_message("Block proposal initiated.", log_type='node')
                 return jsonify({"status": "success", "message": "Block proposal initiated."}), 200
             else:
-                self.log_message(f"Block data is missing.", log_type='node')
+                self.log_message("Block data is missing.", log_type='node')
                 return jsonify({"status": "failed", "message": "Block data is missing."}), 400
+        @self.app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            return Response(self.telemetry.expose(), mimetype='text/plain; version=0.0.4')
+
+        # Payloads this node proposed or fetched, so replicas can get them
+        # peer-to-peer when the server no longer has one
+        @self.app.route('/blobs/<digest>', methods=['GET'])
+        def get_blob(digest):
+            payload = self.blob_cache.get(digest)
+            if payload is None:
+                return jsonify({"status": "failed", "message": "Unknown payload."}), 404
+            return Response(payload, mimetype='application/json')
+
+        @self.app.route('/traces', methods=['GET'])
+        def get_traces():
+            limit = request.args.get('limit', type=int)
+            return jsonify(self.telemetry.dump_traces(limit)), 200
+
         @self.app.route('/status', methods=['GET'])
         def check_status():
             self.log_message("Status: Running", log_type='node')
-            return jsonify({"Status:" : "Running"}), 200
+            return jsonify({"Status:" : "Running", "key_cache": self.verifier.key_cache_stats(),
+                            "blob_cache": self.blob_cache.stats(),
+                            "log_shipper": self.log_shipper.stats()}), 200
 
-    def run(self):
+    def run(self, port=5000):
         # Start the Flask app in a separate thread
-        threading.Thread(target=lambda: self.app.run(port=5000, debug=False, use_reloader=False)).start()
+        threading.Thread(target=lambda: self.app.run(port=port, debug=False, use_reloader=False)).start()
         time.sleep(1)  # Wait for the server to start
         self.register_node()
         self.get_public_keys()
@@ -129,111 +196,191 @@ class IoTNode:
         while True:
             time.sleep(1)
 
+    # Long-poll the server for registry changes; returns as soon as a node
+    # registers, and an idle cluster sends one small request per REGISTRY_POLL_WAIT
     def update_public_keys_periodically(self):
         while True:
-            self.get_public_keys()
-            time.sleep(5)  # Fetch public keys every 5 seconds
+            if not self.get_public_keys(wait=REGISTRY_POLL_WAIT):
+                time.sleep(REGISTRY_RETRY_DELAY)
 
     def register_node(self):
-        public_key_hex = self.public_key.to_string().hex()
-        response = requests.post(f"{self.central_server_url}/register_node", json={
-            "node_id": self.node_id,
-            "public_key": public_key_hex,
-            "public_url": self.public_url  # Include the public URL in the registration
-        })
-        if response.status_code == 201:
-            print(f"Node {self.node_id}: Registered with server.")
+        result = self.broadcaster.post(self.central_server_url, "/register_node", self.registration())
+        if result["status_code"] == 201:
+            self.shard = result["response"].json().get("shard", 0)
+            print(f"Node {self.node_id}: Registered with server (shard {self.shard}).")
         else:
             print(f"Node {self.node_id}: Registration failed.")
-            print(response.text)
-
-    def get_public_keys(self):
-        response = requests.get(f"{self.central_server_url}/public_keys")
-        if response.status_code == 200:
-            data = response.json()
-            new_public_keys = {k: v['public_key'] for k, v in data.items()}
-            new_public_urls = {k: v['public_url'] for k, v in data.items()}
-            if new_public_keys != self.public_keys or new_public_urls != self.public_urls:
-                self.public_keys = new_public_keys
-                self.public_urls = new_public_urls
-                print(f"Node {self.node_id}: Updated public keys and URLs.")
-        else:
+            print(result["response"].text if "response" in result else result["error"])
+
+    # Fetch the registry: in full the first time, afterwards only the nodes
+    # that changed since self.registry_version. Returns False on failure.
+    def get_public_keys(self, wait=0):
+        session = self.broadcaster.session_for(self.central_server_url)
+        try:
+            if self.registry_version is None:
+                response = session.get(f"{self.central_server_url}/public_keys", timeout=10)
+            else:
+                response = session.get(f"{self.central_server_url}/public_keys",
+                                       params={"since": self.registry_version, "wait": wait},
+                                       timeout=wait + 10)
+        except requests.RequestException as e:
+            print(f"Node {self.node_id}: Failed to get public keys: {e}")
+            return False
+        if response.status_code != 200:
             print(f"Node {self.node_id}: Failed to get public keys.")
+            return False
+        if self.merge_registry(response.json(), int(response.headers.get('X-Registry-Version', 0))):
+            self.broadcaster.retain(list(self.public_urls.values()) + [self.central_server_url])
+        return True
 
-    def sign_message(self, message):
-        signature = self.private_key.sign(message.encode(), hashfunc=hashlib.sha256)
+    def sign_message(self, message, trace=None):
+        with self.telemetry.span('sign', trace):
+            signature = self.private_key.sign(message.encode(), hashfunc=hashlib.sha256)
         return signature.hex()
-    
 
-    def send_consensus(self):
-        consensus_message = {
-                "node_id": self.node_id,
-                "status": "commit",
-                "signature": self.sign_message("commit")
-            }
-        self.log_message(f"Sending consensus message: {consensus_message}", log_type='node')
-        response = requests.post(f"{self.central_server_url}/commit_message", json=consensus_message)
-        if response.status_code == 200:
-                self.log_message(f"Sent consensus message to server.", log_type='node')
+    def send_consensus(self, view, seq):
+        round_state = self.claim_consensus(seq)
+        if round_state is None:
+            return
+        digest = round_state["digest"]
+        with self.telemetry.span('commit', round_id(view, seq)):
+            consensus_message = self.round_vote(
+                "commit", view, seq, digest,
+                self.sign_message(round_message("commit", view, seq, digest), round_id(view, seq)))
+            self.log_message(f"Sending consensus message: {consensus_message}", log_type='node')
+            result = self.broadcaster.post(self.central_server_url, "/commit_message", consensus_message)
+        if result["status_code"] == 200:
+                self.log_message("Sent consensus message to server.", log_type='node')
         else:
-                self.log_message(f"Failed to send consensus message to server. Status code: {response.status_code}", log_type='node')
+                self.log_message(f"Failed to send consensus message to server. Status code: {result['status_code']}", log_type='node')
         self.consensus_reached = True
 
+    # Block data for a proposal's digest; None if no source has it
+    def fetch_payload(self, digest, primary_id):
+        block_data = self.cached_payload(digest)
+        if block_data is not None:
+            return block_data
+        for source, base_url in self.payload_sources(primary_id):
+            try:
+                response = self.broadcaster.session_for(base_url).get(f"{base_url}/blobs/{digest}",
+                                                                      timeout=self.broadcaster.timeout)
+            except requests.RequestException:
+                continue
+            if response.status_code == 200:
+                block_data = self.accept_payload(digest, source, response.content)
+                if block_data is not None:
+                    return block_data
+        self.payload_fetches.inc(1, 'unavailable')
+        return None
+
     def verify_signature(self, message, signature_hex, public_key_hex):
         try:
-            public_key_bytes = bytes.fromhex(public_key_hex)
-            public_key = VerifyingKey.from_string(public_key_bytes, curve=NIST256p)
-            signature_bytes = bytes.fromhex(signature_hex)
-            return public_key.verify(signature_bytes, message.encode(), hashfunc=hashlib.sha256)
+            public_key = self.key_cache.get(public_key_hex)
+            return public_key.verify(wire.signature_bytes(signature_hex), message.encode(), hashfunc=hashlib.sha256)
         except (BadSignatureError, ValueError, TypeError) as e:
             print(f"Node {self.node_id}: Verification error: {e}")
             return False
 
+    # Pack queued readings into blocks and start a round for each. Rounds are
+    # disseminated on round_executor so several can be in flight at once.
+    def propose_pending_blocks(self):
+        while True:
+            with self.mempool_ready:
+                while not self.mempool:
+                    self.mempool_ready.wait()
+                count = min(len(self.mempool), self.max_block_transactions)
+                transactions = [self.mempool.popleft() for _ in range(count)]
+            # Always a list, so a reading that is itself a JSON array stays one transaction
+            block_data = transactions
+            round_info = self.request_round(block_data)
+            if round_info is None:
+                # Window full or server unreachable: put the readings back and retry
+                with self.mempool_ready:
+                    self.mempool.extendleft(reversed(transactions))
+                time.sleep(PROPOSE_RETRY_DELAY)
+                continue
+            self.round_executor.submit(self.disseminate_proposal, round_info["view"], round_info["seq"], block_data)
+
+    # Ask the central server to open a round; it assigns (view, seq)
+    def request_round(self, block_data):
+        result = self.broadcaster.post(self.central_server_url, "/propose_block",
+                                       {"node_id": self.node_id, "block_data": block_data})
+        if result["status_code"] != 200:
+            print(f"Node {self.node_id}: Server did not open a round: {result.get('error', result['status_code'])}")
+            return None
+        round_info = result["response"].json()
+        self.rounds_proposed.inc()
+        self.telemetry.record('request_round', result["latency"], round_id(round_info["view"], round_info["seq"]))
+        return round_info
+
     def pre_prepare(self, block_data):
+        round_info = self.request_round(block_data)
+        if round_info is None:
+            return None
+        return self.disseminate_proposal(round_info["view"], round_info["seq"], block_data)
+
+    def disseminate_proposal(self, view, seq, block_data):
+        with self.telemetry.span('pre_prepare', round_id(view, seq)):
+            return self._disseminate_proposal(view, seq, block_data)
+
+    def _disseminate_proposal(self, view, seq, block_data):
         # Primary node signs the block and sends it to all replicas
-        message = f"{self.node_id}:{block_data}"
-        signature = self.sign_message(message)
+        self.is_primary = True
+        self.current_primary_id = str(self.node_id)
+        # Replicas get the digest and fetch the payload once, not a copy each
+        digest = self.blob_cache.put(encode_payload(block_data))
+        message = proposal_message(self.node_id, view, seq, digest)
+        signature = self.sign_message(message, round_id(view, seq))
         proposal = {
             "node_id": self.node_id,
-            "block_data": block_data,
+            "digest": digest,
+            "view": view,
+            "seq": seq,
             "signature": signature
         }
-        # Send proposal to central server
-        response = requests.post(f"{self.central_server_url}/propose_block", json=proposal)
-        # Send proposal to all replicas
-        for node_id, public_url in self.public_urls.items():
-            if node_id != str(self.node_id):
-                try:
-                    response = requests.post(f"{public_url}/receive_proposal", json=proposal)
-                    if response.status_code == 200:
-                        print(f"Node {self.node_id}: Sent proposal to Node {node_id}.")
-                    else:
-                        print(f"Node {self.node_id}: Failed to send proposal to Node {node_id}.")
-                except Exception as e:
-                    print(f"Node {self.node_id}: Error sending proposal to Node {node_id}: {e}")
-
-    def send_prepare(self):
-        # Send prepare message back to primary
-        prepare_message = {
-            "node_id": self.node_id,
-            "status": "prepared",
-            "signature": self.sign_message("prepared")
-        }
-        primary_url = self.public_urls[self.current_primary_id]
-        try:
-            response = requests.post(f"{primary_url}/receive_prepare", json=prepare_message)
-            if response.status_code == 200:
-                print(f"Node {self.node_id}: Sent prepare message to primary.")
-                self.send_consensus()
+        self.open_round(view, seq, str(self.node_id), digest)
+        if self.prepare_threshold() <= 0:
+            # Quorum without any other node (e.g. a single-node cluster)
+            self.send_consensus(view, seq)
+        # Send proposal to all replicas concurrently
+        with self.telemetry.span('fanout', round_id(view, seq)):
+            results = self.broadcaster.broadcast(self.replicas(), "/receive_proposal", proposal)
+        for node_id, result in results.items():
+            if result["status_code"] == 200:
+                print(f"Node {self.node_id}: Sent proposal to Node {node_id} in {result['latency'] * 1000:.1f} ms.")
+            elif result["status_code"] is not None:
+                print(f"Node {self.node_id}: Failed to send proposal to Node {node_id}.")
             else:
-                print(f"Node {self.node_id}: Failed to send prepare message to primary.")
-        except Exception as e:
-            print(f"Node {self.node_id}: Error sending prepare message to primary: {e}")
+                print(f"Node {self.node_id}: Error sending proposal to Node {node_id}: {result['error']}")
+        return results
+
+    def send_prepare(self, view, seq):
+        # Send prepare message back to primary
+        with self.telemetry.span('prepare', round_id(view, seq)):
+            round_state = self.rounds[seq]
+            digest = round_state["digest"]
+            prepare_message = self.round_vote(
+                "prepared", view, seq, digest,
+                self.sign_message(round_message("prepared", view, seq, digest), round_id(view, seq)))
+            primary_url = self.public_urls[round_state["primary_id"]]
+            result = self.broadcaster.post(primary_url, "/receive_prepare", prepare_message)
+        if result["status_code"] == 200:
+            print(f"Node {self.node_id}: Sent prepare message to primary.")
+            self.send_consensus(view, seq)
+        elif result["status_code"] is not None:
+            print(f"Node {self.node_id}: Failed to send prepare message to primary.")
+        else:
+            print(f"Node {self.node_id}: Error sending prepare message to primary: {result['error']}")
 
     
 
 if __name__ == '__main__':
+        # Usage: python iot_node.py <node_id> [central_server_url] [port]
         node_id = int(sys.argv[1])
-        central_server_url = "https://4795-2409-40f2-2010-4ce8-94a6-4cea-cd7f-cc3c.ngrok-free.app"
-        node = IoTNode(node_id=node_id, central_server_url=central_server_url)
-        node.run()
\ No newline at end of file
+        central_server_url = sys.argv[2] if len(sys.argv) > 2 else os.environ.get(
+            'CENTRAL_SERVER_URL', "https://4795-2409-40f2-2010-4ce8-94a6-4cea-cd7f-cc3c.ngrok-free.app")
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+        node = IoTNode(node_id=node_id, central_server_url=central_server_url,
+                       wire_format=os.environ.get('WIRE_FORMAT', 'json'),
+                       group=os.environ.get('NODE_GROUP'))
+        node.run(port=port)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import threading
+from ecdsa import VerifyingKey, NIST256p, ellipticcurve
+
+# Cache of parsed VerifyingKey objects keyed by their hex encoding.
+#
+# Decoding a public key validates the point on the curve, and precompute()
+# builds the multiplication tables that make every later verify() cheaper.
+# Both only need to happen once per key instead of once per message.
+class VerifyingKeyCache:
+    def __init__(self, curve=NIST256p):
+        self.curve = curve
+        self.keys = {}  # public_key_hex: VerifyingKey
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, public_key_hex):
+        key = self.keys.get(public_key_hex)
+        if key is not None:
+            self.hits += 1
+            return key
+        # Parse outside the lock; two threads racing on a miss just both parse
+        key = VerifyingKey.from_string(bytes.fromhex(public_key_hex), curve=self.curve)
+        # Decoded points don't carry the curve order, which precompute() needs
+        point = key.pubkey.point
+        key = VerifyingKey.from_public_point(
+            ellipticcurve.Point(self.curve.curve, point.x(), point.y(), self.curve.order),
+            curve=self.curve, validate_point=False)
+        key.precompute()
+        with self.lock:
+            self.misses += 1
+            self.keys[public_key_hex] = key
+        return key
+
+    def invalidate(self, public_key_hex):
+        with self.lock:
+            if self.keys.pop(public_key_hex, None) is not None:
+                self.evictions += 1
+
+    # Drop every cached key that is not in `public_key_hexes`
+    def retain(self, public_key_hexes):
+        keep = set(public_key_hexes)
+        with self.lock:
+            for public_key_hex in [k for k in self.keys if k not in keep]:
+                del self.keys[public_key_hex]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.evictions += len(self.keys)
+            self.keys.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,382 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+
+# Persistent, searchable archive of central and node log lines.
+#
+# Lines go to one SQLite file per time bucket (logs-<bucket start>.sqlite,
+# bucket_seconds wide) with B-tree indexes on node id, level and log type
+# and an inverted index of the words in each line, so "ERROR lines from node
+# 17 mentioning timeout" is a few index range scans instead of a pass over
+# every stored line. Ids increase with time across buckets and are the
+# pagination cursor; results come newest first. append() only queues a line;
+# a background thread commits queued lines in batches.
+#
+# Buckets older than compact_after seconds are compacted: their messages are
+# packed into zlib-compressed chunks of CHUNK_ROWS lines and the file is
+# vacuumed, while the indexes stay searchable. Buckets older than retention
+# seconds are deleted (0 keeps everything).
+
+BUCKET_PREFIX = 'logs-'
+BUCKET_SUFFIX = '.sqlite'
+CHUNK_ROWS = 512          # Lines per compressed chunk of a compacted bucket
+CHUNK_CACHE = 8           # Decompressed chunks kept per bucket
+MAX_TERM_LENGTH = 40      # Longer words (hashes, signatures) aren't indexed
+MAINTENANCE_INTERVAL = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    node_id TEXT,
+    level TEXT NOT NULL,
+    log_type TEXT NOT NULL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS logs_by_node ON logs (node_id, id);
+CREATE INDEX IF NOT EXISTS logs_by_level ON logs (level, id);
+CREATE INDEX IF NOT EXISTS logs_by_type ON logs (log_type, id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (term, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chunks (
+    first_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+WORD = re.compile(r'[a-z0-9_]+')
+
+
+# Lowercased words of a line, each once, as indexed and as searched for
+def tokenize(text):
+    return list(dict.fromkeys(word for word in WORD.findall(str(text).lower()) if len(word) <= MAX_TERM_LENGTH))
+
+
+class LogBucket:
+    def __init__(self, path, start):
+        self.path = path
+        self.start = start
+        self.lock = threading.Lock()
+        self.db = None
+        self.compacted = False
+        self.chunk_cache = OrderedDict()  # first_id: {"ids", "messages"}
+        with self.lock:
+            self._connect()
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'compacted'").fetchone()
+            self.compacted = row is not None and row[0] == '1'
+
+    # Called with self.lock held; buckets closed to save file handles reopen on use
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")  # Losing the last batch on power loss is fine for logs
+            self.db.execute("PRAGMA journal_size_limit=16777216")
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+            self.chunk_cache.clear()
+
+    def last_id(self):
+        with self.lock:
+            return self._connect().execute("SELECT MAX(id) FROM logs").fetchone()[0] or 0
+
+    # rows: [(id, time, node_id, level, log_type, message)]
+    def insert(self, rows):
+        with self.lock:
+            db = self._connect()
+            with db:
+                db.executemany("INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?)", rows)
+                db.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)",
+                               [(term, row[0]) for row in rows for term in tokenize(row[5])])
+
+    # First id logged after `moment` (at or after it with inclusive=True).
+    # Ids follow time, so a binary search over the primary key stands in for
+    # an index on time.
+    def _first_id_after(self, db, moment, inclusive, low, high):
+        high += 1
+        while low < high:
+            middle = (low + high) // 2
+            logged_at = db.execute("SELECT time FROM logs WHERE id >= ? ORDER BY id LIMIT 1", (middle,)).fetchone()[0]
+            if logged_at < moment or (logged_at == moment and not inclusive):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Id range [low, high] of the lines logged within [time_from, time_to],
+    # None if there are none
+    def _id_range(self, db, time_from, time_to):
+        if time_from is None and time_to is None:
+            return None, None
+        first, last = db.execute("SELECT MIN(id), MAX(id) FROM logs").fetchone()
+        if first is None:
+            return None
+        low = first if time_from is None else self._first_id_after(db, time_from, True, first, last)
+        high = last if time_to is None else self._first_id_after(db, time_to, False, first, last) - 1
+        return (low, high) if low <= high else None
+
+    def search(self, node_id=None, level=None, log_type=None, terms=(), time_from=None, time_to=None,
+               before=None, limit=100):
+        with self.lock:
+            db = self._connect()
+            id_range = self._id_range(db, time_from, time_to)
+            if id_range is None:
+                return []
+            # With words to match, walk the postings of the longest (likely rarest) one
+            terms = sorted(terms, key=len, reverse=True)
+            key = "t.id" if terms else "l.id"
+            tables = "terms t JOIN logs l ON l.id = t.id" if terms else "logs l"
+            clauses, params = [], []
+            if terms:
+                clauses.append("t.term = ?")
+                params.append(terms[0])
+            for bound, operator in ((before, "<"), (id_range[0], ">="), (id_range[1], "<=")):
+                if bound is not None:
+                    clauses.append(f"{key} {operator} ?")
+                    params.append(bound)
+            for column, value in (("node_id", node_id), ("level", level), ("log_type", log_type)):
+                if value is not None:
+                    clauses.append(f"l.{column} = ?")
+                    params.append(value)
+            for term in terms[1:]:
+                clauses.append("EXISTS (SELECT 1 FROM terms o WHERE o.term = ? AND o.id = l.id)")
+                params.append(term)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            rows = db.execute(f"SELECT l.id, l.time, l.node_id, l.level, l.log_type, l.message FROM {tables} "
+                              f"{where} ORDER BY {key} DESC LIMIT ?", params + [limit]).fetchall()
+            return [{
+                "id": row[0],
+                "time": datetime.fromtimestamp(row[1]).isoformat(),
+                "node_id": row[2],
+                "level": row[3],
+                "log_type": row[4],
+                "log": row[5] if row[5] is not None else self._chunk_message(db, row[0]),
+            } for row in rows]
+
+    # Message of a line in a compacted bucket. Called with self.lock held.
+    def _chunk_message(self, db, line_id):
+        for first_id, chunk in self.chunk_cache.items():
+            if first_id <= line_id <= chunk["ids"][-1]:
+                self.chunk_cache.move_to_end(first_id)
+                break
+        else:
+            row = db.execute("SELECT first_id, data FROM chunks WHERE first_id <= ? ORDER BY first_id DESC LIMIT 1",
+                             (line_id,)).fetchone()
+            if row is None:
+                return None
+            first_id, chunk = row[0], json.loads(zlib.decompress(row[1]))
+            self.chunk_cache[first_id] = chunk
+            while len(self.chunk_cache) > CHUNK_CACHE:
+                self.chunk_cache.popitem(last=False)
+        ids = chunk["ids"]
+        position = line_id - ids[0]
+        if not (0 <= position < len(ids) and ids[position] == line_id):
+            position = ids.index(line_id) if line_id in ids else None
+        return chunk["messages"][position] if position is not None else None
+
+    # Move messages into compressed chunks and reclaim the space they took
+    def compact(self):
+        with self.lock:
+            if self.compacted:
+                return
+            db = self._connect()
+            with db:
+                rows = db.execute("SELECT id, message FROM logs WHERE message IS NOT NULL ORDER BY id")
+                while True:
+                    batch = rows.fetchmany(CHUNK_ROWS)
+                    if not batch:
+                        break
+                    chunk = {"ids": [row[0] for row in batch], "messages": [row[1] for row in batch]}
+                    db.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?)",
+                               (batch[0][0], zlib.compress(json.dumps(chunk, separators=(',', ':')).encode(), 6)))
+                db.execute("UPDATE logs SET message = NULL WHERE message IS NOT NULL")
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('compacted', '1')")
+            db.execute("VACUUM")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # VACUUM went through the WAL
+            self.compacted = True
+
+    def stats(self):
+        with self.lock:
+            db = self._connect()
+            low, high = db.execute("SELECT MIN(id), MAX(id) FROM logs").fetchone()
+        return {
+            "start": datetime.fromtimestamp(self.start).isoformat(),
+            "first_id": low,
+            "last_id": high,
+            "compacted": self.compacted,
+            "bytes": sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal')
+                         if os.path.exists(self.path + suffix)),
+        }
+
+
+class LogArchive:
+    def __init__(self, directory, bucket_seconds=3600, compact_after=86400, retention=0,
+                 flush_interval=0.5, max_pending=100000, max_open=32):
+        self.directory = directory
+        self.bucket_seconds = bucket_seconds
+        self.compact_after = compact_after  # Seconds after its end a bucket is compacted (0: never)
+        self.retention = retention          # Seconds after its end a bucket is deleted (0: never)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_open = max_open            # Buckets kept connected; others reopen on use
+        self.lock = threading.Lock()        # Guards self.buckets and the open-bucket LRU
+        self.buckets = {}                   # start: LogBucket
+        self.open_order = OrderedDict()     # start: None, least recently used first
+        self.pending = deque()              # (time, node_id, level, log_type, message)
+        self.pending_ready = threading.Condition()
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        starts = []
+        for name in os.listdir(directory):
+            if name.startswith(BUCKET_PREFIX) and name.endswith(BUCKET_SUFFIX):
+                number = name[len(BUCKET_PREFIX):-len(BUCKET_SUFFIX)]
+                if number.isdigit():
+                    starts.append(int(number))
+        # The newest bucket can be empty (created just before a crash), so ids
+        # continue after the highest one in any bucket
+        self.next_id = max((self._bucket(start).last_id() for start in sorted(starts)), default=0) + 1
+        threading.Thread(target=self._write_periodically, daemon=True).start()
+
+    def _path(self, start):
+        return os.path.join(self.directory, f"{BUCKET_PREFIX}{start}{BUCKET_SUFFIX}")
+
+    # Get (or create) the bucket starting at `start` and mark it recently used
+    def _bucket(self, start):
+        with self.lock:
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = LogBucket(self._path(start), start)
+            self.open_order[start] = None
+            self.open_order.move_to_end(start)
+            evict = []
+            while len(self.open_order) > self.max_open:
+                evict.append(self.buckets[self.open_order.popitem(last=False)[0]])
+        for old in evict:
+            old.close()
+        return bucket
+
+    def append(self, message, node_id=None, level='INFO', log_type='central'):
+        with self.pending_ready:
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            # Timestamped under the lock so ids (assigned in queue order) follow time
+            self.pending.append((time.time(), None if node_id is None else str(node_id),
+                                 str(level).upper(), str(log_type), str(message)))
+            self.appended += 1
+            self.pending_ready.notify()
+
+    def _write_periodically(self):
+        last_maintenance = time.monotonic()
+        while True:
+            with self.pending_ready:
+                self.pending_ready.wait_for(lambda: self.pending, timeout=self.flush_interval)
+                batch = list(self.pending)
+                self.pending.clear()
+            if batch:
+                try:
+                    self._write(batch)
+                except sqlite3.Error as e:
+                    print(f"Log archive: dropped {len(batch)} lines: {e}")
+                with self.pending_ready:
+                    self.written += len(batch)
+                    self.pending_ready.notify_all()
+            if time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                last_maintenance = time.monotonic()
+                try:
+                    self.maintain()
+                except (sqlite3.Error, OSError) as e:
+                    print(f"Log archive maintenance failed: {e}")
+
+    def _write(self, batch):
+        by_bucket = {}
+        for logged_at, node_id, level, log_type, message in batch:
+            start = int(logged_at // self.bucket_seconds * self.bucket_seconds)
+            by_bucket.setdefault(start, []).append((self.next_id, logged_at, node_id, level, log_type, message))
+            self.next_id += 1
+        for start, rows in sorted(by_bucket.items()):
+            self._bucket(start).insert(rows)
+
+    # Wait until everything appended so far is searchable
+    def flush(self, timeout=None):
+        with self.pending_ready:
+            target = self.appended
+            return self.pending_ready.wait_for(lambda: self.written + self.dropped >= target, timeout=timeout)
+
+    # Newest-first matches; `before` is the cursor (an id) of the next page.
+    # time_from and time_to are epoch seconds, `text` words must all appear.
+    def search(self, node_id=None, level=None, log_type=None, text=None, time_from=None, time_to=None,
+               before=None, limit=100):
+        terms = tokenize(text) if text else []
+        if text and not terms:
+            return []
+        with self.lock:
+            starts = sorted(self.buckets, reverse=True)
+        results = []
+        for start in starts:
+            if time_to is not None and start > time_to:
+                continue
+            if time_from is not None and start + self.bucket_seconds <= time_from:
+                break
+            results += self._bucket(start).search(node_id, None if level is None else level.upper(), log_type,
+                                                  terms, time_from, time_to, before, limit - len(results))
+            if len(results) >= limit:
+                break
+        return results
+
+    # Compact and expire buckets that have aged out
+    def maintain(self, now=None):
+        now = time.time() if now is None else now
+        current = int(now // self.bucket_seconds * self.bucket_seconds)
+        with self.lock:
+            starts = sorted(self.buckets)
+        for start in starts:
+            if start >= current:
+                continue  # Still being written
+            age = now - (start + self.bucket_seconds)
+            if self.retention and age >= self.retention:
+                with self.lock:
+                    bucket = self.buckets.pop(start)
+                    self.open_order.pop(start, None)
+                bucket.close()
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(bucket.path + suffix):
+                        os.remove(bucket.path + suffix)
+            elif self.compact_after and age >= self.compact_after and not self.buckets[start].compacted:
+                self._bucket(start).compact()
+
+    def stats(self):
+        with self.lock:
+            buckets = [self.buckets[start] for start in sorted(self.buckets)]
+        with self.pending_ready:
+            queue = {"pending": len(self.pending), "written": self.written, "dropped": self.dropped}
+        return dict(queue, next_id=self.next_id, bucket_seconds=self.bucket_seconds,
+                    buckets=[bucket.stats() for bucket in buckets])
+
+    def close(self):
+        self.flush(timeout=10)
+        with self.lock:
+            buckets = list(self.buckets.values())
+        for bucket in buckets:
+            bucket.close()
@@ -0,0 +1,146 @@
+import bisect
+import heapq
+import itertools
+import json
+import os
+import threading
+from collections import deque
+
+# Fixed-capacity log buffers with sequence numbers.
+#
+# Every appended entry gets the next number from a shared counter, so one
+# `since` cursor can resume across several buffers. Once a buffer is full the
+# oldest entries are evicted, or appended to a spill file when `spill_path`
+# is set so they can still be read back without staying in RAM. A spill file
+# outlives the process: it is re-indexed on startup, and a torn last record
+# from a crash is cut off.
+
+SPILL_INDEX_EVERY = 256  # One sparse index entry per this many spilled records
+
+
+# Highest seq in the spill files (*.jsonl) of `directory`, 0 if none. Start
+# a shared sequence after it so a restart doesn't reuse spilled numbers.
+def last_spilled_seq(directory):
+    last = 0
+    if not directory or not os.path.isdir(directory):
+        return last
+    for name in os.listdir(directory):
+        if not name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            f.seek(max(0, os.path.getsize(f.name) - 65536))
+            for line in reversed(f.read().split(b'\n')):
+                try:
+                    last = max(last, json.loads(line)[0])
+                    break
+                except (ValueError, IndexError, TypeError):
+                    continue
+    return last
+
+
+class RingLog:
+    def __init__(self, capacity, sequence=None, spill_path=None):
+        self.entries = deque(maxlen=capacity)  # (seq, entry)
+        self.spill_path = spill_path
+        self.spill_index = []    # Sparse [(seq, byte offset)] into the spill file
+        self.spilled = 0
+        self.last_spilled = 0
+        self.spill_file = None   # Append handle, kept open
+        self.lock = threading.Lock()
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+            self._load_spill()
+            self.spill_file = open(spill_path, 'ab')
+        self.sequence = sequence or itertools.count(self.last_spilled + 1)
+
+    # Index a spill file left by a previous run
+    def _load_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    seq = json.loads(line)[0] if line.endswith(b'\n') else None
+                except (ValueError, IndexError, TypeError):
+                    seq = None
+                if seq is None:
+                    # Torn write from a crash: drop it and everything after
+                    with open(self.spill_path, 'r+b') as g:
+                        g.truncate(offset)
+                    break
+                if self.spilled % SPILL_INDEX_EVERY == 0:
+                    self.spill_index.append((seq, offset))
+                self.spilled += 1
+                self.last_spilled = seq
+                offset += len(line)
+
+    def append(self, entry):
+        with self.lock:
+            seq = next(self.sequence)
+            if len(self.entries) == self.entries.maxlen and self.spill_path:
+                self._spill(*self.entries[0])
+            self.entries.append((seq, entry))
+            return seq
+
+    def _spill(self, seq, entry):
+        offset = self.spill_file.tell()
+        self.spill_file.write(json.dumps([seq, entry]).encode() + b'\n')
+        self.spill_file.flush()  # Readers open the file separately
+        if self.spilled % SPILL_INDEX_EVERY == 0:
+            self.spill_index.append((seq, offset))
+        self.spilled += 1
+        self.last_spilled = seq
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def last_seq(self):
+        return self.entries[-1][0] if self.entries else self.last_spilled
+
+    def close(self):
+        with self.lock:
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+
+    def _iter_spill(self, since):
+        position = bisect.bisect_right(self.spill_index, (since, float('inf'))) - 1
+        offset = self.spill_index[position][1] if position >= 0 else 0
+        with open(self.spill_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                seq, entry = json.loads(line)
+                if seq > since:
+                    yield seq, entry
+
+    # Yield (seq, entry) with seq > since, oldest first
+    def iter_since(self, since=0):
+        with self.lock:
+            memory = list(self.entries)
+            first_in_memory = memory[0][0] if memory else None
+            read_spill = self.spilled and (first_in_memory is None or since < first_in_memory - 1)
+        if read_spill:
+            for seq, entry in self._iter_spill(since):
+                if first_in_memory is not None and seq >= first_in_memory:
+                    break
+                yield seq, entry
+        # Entries are in seq order, so skip straight to the first one after `since`
+        start = bisect.bisect_right(memory, since, key=lambda item: item[0])
+        for i in range(start, len(memory)):
+            yield memory[i]
+
+    def query(self, since=0, limit=None, predicate=None):
+        matches = (item for item in self.iter_since(since) if predicate is None or predicate(item[1]))
+        return list(itertools.islice(matches, limit))
+
+
+# Merge several RingLogs in sequence order: yields (name, seq, entry)
+def merge_since(buffers, since=0):
+    def tagged(name, buffer):
+        for seq, entry in buffer.iter_since(since):
+            yield seq, name, entry
+    streams = [tagged(name, buffer) for name, buffer in buffers.items()]
+    for seq, name, entry in heapq.merge(*streams, key=lambda item: item[0]):
+        yield name, seq, entry
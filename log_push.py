@@ -0,0 +1,107 @@
+import threading
+import time
+import uuid
+
+# Coalesced Socket.IO log push with snapshot + delta sync.
+#
+# Log writers never emit directly. Every `window` seconds one loop sends each
+# connected client a single 'log_batch' frame with everything after that
+# client's cursor (at most `max_batch` entries). A client only gets its next
+# frame after acknowledging the previous one, so a slow consumer is throttled
+# to its own pace and simply receives bigger deltas. New clients get a
+# bounded snapshot; reconnecting clients pass their cursor in the connect
+# auth payload and only receive what they missed.
+#
+# A frame whose ack is lost is resent from the last acked cursor and may
+# overlap what the client already applied, so `collect` must give every
+# entry its sequence number and clients drop those at or below their cursor.
+#
+# Sequence numbers restart when the server does, so snapshots and frames
+# carry the server's `epoch`. A client resuming with a cursor from another
+# epoch, or one beyond the newest entry, gets a fresh snapshot instead.
+
+
+class LogPusher:
+    def __init__(self, socketio, collect, latest, window=0.25, snapshot_limit=200,
+                 max_batch=500, ack_timeout=10.0, epoch=None):
+        self.socketio = socketio
+        self.epoch = epoch or uuid.uuid4().hex
+        self.collect = collect      # collect(since, limit) -> frame dict with a "cursor"
+        self.latest = latest        # latest() -> newest sequence number
+        self.window = window
+        self.snapshot_limit = snapshot_limit
+        self.max_batch = max_batch
+        self.ack_timeout = ack_timeout
+        self.clients = {}           # sid: {"cursor", "in_flight", "sent_at"}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.socketio.start_background_task(self._push_loop)
+
+    # Returns the snapshot to send a new client, or None when resuming
+    def connect(self, sid, cursor=None, epoch=None):
+        self.start()
+        snapshot = None
+        if cursor is None or epoch != self.epoch or cursor > self.latest():
+            snapshot = self.snapshot()
+            cursor = snapshot["cursor"]
+        with self.lock:
+            self.clients[sid] = {"cursor": cursor, "in_flight": False, "sent_at": 0.0}
+        return snapshot
+
+    def disconnect(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def snapshot(self):
+        snapshot = self.collect(max(0, self.latest() - self.snapshot_limit), self.snapshot_limit)
+        snapshot["epoch"] = self.epoch
+        return snapshot
+
+    def _acked(self, sid, cursor):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client:
+                client["cursor"] = max(client["cursor"], cursor)
+                client["in_flight"] = False
+
+    def _push_loop(self):
+        while True:
+            self.socketio.sleep(self.window)
+            try:
+                self.push()
+            except Exception as e:
+                print(f"Log push failed: {e}")
+
+    def push(self):
+        latest = self.latest()
+        now = time.monotonic()
+        with self.lock:
+            ready = []
+            for sid, client in self.clients.items():
+                if client["in_flight"] and now - client["sent_at"] > self.ack_timeout:
+                    client["in_flight"] = False  # Ack lost; resend from the last acked cursor
+                if not client["in_flight"] and client["cursor"] < latest:
+                    client["in_flight"] = True
+                    client["sent_at"] = now
+                    ready.append((sid, client["cursor"]))
+        # Clients at the same cursor share one frame
+        frames = {}
+        for sid, cursor in ready:
+            if cursor not in frames:
+                frames[cursor] = self.collect(cursor, self.max_batch)
+                frames[cursor]["epoch"] = self.epoch
+            frame = frames[cursor]
+            self.socketio.emit('log_batch', frame, to=sid,
+                               callback=lambda *args, sid=sid, cursor=frame["cursor"]: self._acked(sid, cursor))
+            self.frames += 1
+
+    def stats(self):
+        with self.lock:
+            return {"clients": len(self.clients), "frames": self.frames}
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Background, batched delivery of node log records to the central server.
+#
+# ship() only enqueues and never blocks, so logging can't add a network round
+# trip to the consensus path. A sender thread flushes batches to
+# /node_logs_batch once `batch_size` records are queued or `flush_interval`
+# seconds have passed. When the queue is full new records are dropped and
+# counted; the next batch carries a summary line for them.
+
+
+class LogShipper:
+    def __init__(self, node_id, central_server_url, broadcaster,
+                 max_queue=10000, batch_size=200, flush_interval=0.5):
+        self.node_id = node_id
+        self.central_server_url = central_server_url
+        self.broadcaster = broadcaster
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records = queue.Queue(maxsize=max_queue)
+        self.dropped = 0         # Dropped since the last summary was sent
+        self.total_dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+
+    def ship(self, message, log_type='node'):
+        record = {"log": message, "log_type": log_type, "time": datetime.now().isoformat()}
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+                self.total_dropped += 1
+
+    def _next_batch(self):
+        batch = [self.records.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.records.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send_loop(self):
+        while True:
+            batch = self._next_batch()
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                batch.append({
+                    "log": f"{dropped} log records dropped under backpressure.",
+                    "log_type": "node",
+                    "time": datetime.now().isoformat(),
+                })
+            result = self.broadcaster.post(self.central_server_url, "/node_logs_batch",
+                                           {"node_id": self.node_id, "logs": batch})
+            if result["status_code"] == 200:
+                self.sent += len(batch)
+            else:
+                # Logs are best effort; don't retry and back up the queue
+                self.failed += len(batch)
+                print(f"Node {self.node_id}: Failed to ship {len(batch)} log records: "
+                      f"{result.get('error', result['status_code'])}")
+
+    def stats(self):
+        return {
+            "queued": self.records.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.total_dropped,
+        }
@@ -0,0 +1,116 @@
+import hashlib
+import json
+
+# Block hashing, Merkle trees and inclusion proofs.
+#
+# Every transaction (device reading) in a block is a Merkle leaf. The block
+# header is every field except "block_data" and "hash"; its SHA-256 is the
+# block hash and the next block stores it as "previous_hash". A device can
+# check a proof from one transaction up to "merkle_root" and from the header
+# to "hash" without downloading the rest of the chain.
+#
+# Leaves and inner nodes are domain-separated (0x00 / 0x01 prefixes) and an
+# odd node is carried up a level unchanged rather than duplicated.
+
+GENESIS_HASH = "0" * 64
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def hash_leaf(transaction):
+    return hashlib.sha256(b'\x00' + canonical_json(transaction).encode()).hexdigest()
+
+
+def hash_node(left, right):
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+# The one rule for a block's transactions, for new, linked and legacy blocks
+# alike: a list block_data is a batch, one transaction per element, and
+# anything else is a single reading. The server stores new blocks' readings
+# as a list even when there is only one, so a reading that is itself a JSON
+# array stays one transaction. Older blocks were hashed under this same
+# rule, so their roots and links still verify.
+def block_transactions(block):
+    block_data = block.get("block_data")
+    return block_data if isinstance(block_data, list) else [block_data]
+
+
+def merkle_levels(leaves):
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(transactions):
+    if not transactions:
+        return GENESIS_HASH
+    return merkle_levels([hash_leaf(tx) for tx in transactions])[-1][0]
+
+
+# Sibling hashes from leaf `index` up to the root
+def merkle_proof(transactions, index):
+    levels = merkle_levels([hash_leaf(tx) for tx in transactions])
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({"hash": level[sibling], "position": "left" if sibling < index else "right"})
+        index //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root):
+    current = hash_leaf(transaction)
+    for step in proof:
+        if step["position"] == "left":
+            current = hash_node(step["hash"], current)
+        else:
+            current = hash_node(current, step["hash"])
+    return current == root
+
+
+def block_header(block):
+    header = {key: value for key, value in block.items() if key not in ("block_data", "hash")}
+    if "merkle_root" not in header:
+        # Blocks committed before hash linking carry no root; derive it
+        header["merkle_root"] = merkle_root(block_transactions(block))
+    return header
+
+
+def block_hash(block):
+    return hashlib.sha256(canonical_json(block_header(block)).encode()).hexdigest()
+
+
+LINK_FIELDS = ("previous_hash", "merkle_root", "hash")
+
+
+# Check blocks that follow a block with hash `previous_hash`. Blocks written
+# before hash linking have none of LINK_FIELDS and are only chained forward,
+# but only as a prefix of the chain: once a hash-linked block has been seen
+# (`linked`), every later block must carry all of them, so stripping the
+# fields can't hide a rewrite. Returns (bad_offset or None, hash of the
+# last good block, linked).
+def verify_blocks(blocks, previous_hash, linked=False):
+    for offset, block in enumerate(blocks):
+        if linked or any(field in block for field in LINK_FIELDS):
+            if not all(field in block for field in LINK_FIELDS):
+                return offset, previous_hash, linked
+            if block["previous_hash"] != previous_hash:
+                return offset, previous_hash, linked
+            if block["merkle_root"] != merkle_root(block_transactions(block)):
+                return offset, previous_hash, linked
+            if block["hash"] != block_hash(block):
+                return offset, previous_hash, linked
+            linked = True
+            previous_hash = block["hash"]
+        else:
+            previous_hash = block_hash(block)
+    return None, previous_hash, linked
@@ -0,0 +1,166 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Low-overhead counters, histograms and per-round traces with Prometheus
+# text exposition.
+#
+# Observing a value is one bisect and a locked increment, so instrumentation
+# can stay on in production. Traces keep the phase spans of the most recent
+# TRACE_HISTORY rounds (round id "view/seq") for dumping on demand.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRACE_HISTORY = 512
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}  # label values: count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    # Read from a callback at scrape time, for values other components already
+    # track (kind='counter' for ones that only go up, e.g. cache hits)
+    def __init__(self, name, help_text, read, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+
+    def expose(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values: [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {key: list(series) for key, series in self.series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                labels = format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.metrics = []
+        self.traces = OrderedDict()  # round id: [(phase, wall clock start, seconds)]
+        self.traces_lock = threading.Lock()
+        self.phase_seconds = self.histogram('phase_seconds', 'Time spent per consensus phase.', ('phase',))
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(f"{self.prefix}_{name}", help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(f"{self.prefix}_{name}", help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, read, kind='gauge'):
+        metric = Gauge(f"{self.prefix}_{name}", help_text, read, kind)
+        self.metrics.append(metric)
+        return metric
+
+    # Record a finished phase: into the phase histogram and, with a round
+    # id, into that round's trace
+    def record(self, phase, seconds, round_id=None, start=None):
+        self.phase_seconds.observe(seconds, phase)
+        if round_id is None:
+            return
+        span = (phase, start if start is not None else time.time() - seconds, seconds)
+        with self.traces_lock:
+            spans = self.traces.get(round_id)
+            if spans is None:
+                spans = self.traces[round_id] = []
+                while len(self.traces) > TRACE_HISTORY:
+                    self.traces.popitem(last=False)
+            spans.append(span)
+
+    @contextmanager
+    def span(self, phase, round_id=None):
+        wall_start = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, round_id, wall_start)
+
+    # Traces as {"round", "started", "spans": [{"phase", "offset", "seconds"}]},
+    # spans ordered by start, offsets relative to the earliest one
+    def dump_traces(self, limit=None, round_id=None):
+        with self.traces_lock:
+            if round_id is not None:
+                traces = [(round_id, list(self.traces[round_id]))] if round_id in self.traces else []
+            else:
+                traces = [(key, list(spans)) for key, spans in self.traces.items()]
+                if limit is not None:
+                    traces = traces[-limit:] if limit > 0 else []
+        dumped = []
+        for key, spans in traces:
+            spans.sort(key=lambda span: span[1])
+            started = spans[0][1]
+            dumped.append({"round": key, "started": started, "spans": [
+                {"phase": phase, "offset": start - started, "seconds": seconds}
+                for phase, start, seconds in spans]})
+        return dumped
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+def round_id(view, seq):
+    return f"{view}/{seq}"
@@ -0,0 +1,181 @@
+import json
+import os
+import time
+from ecdsa import SigningKey, NIST256p
+from consensus import quorum_size
+from metrics import Metrics, round_id
+
+# Protocol state shared by the node runtimes (iot_node.IoTNode on threads,
+# async_node.AsyncIoTNode on asyncio).
+#
+# NodeProtocol holds everything that doesn't do I/O: keys, metrics, the
+# registry merge, round state and prepare quorums, and payload checks. The
+# runtimes inherit it and add the transport, so a protocol change is made
+# once. A runtime provides node_id, public_keys, public_urls, key_cache,
+# blob_cache, verifier, log_shipper, mempool, rounds and rounds_lock.
+
+PROPOSE_RETRY_DELAY = 0.05  # Back-off when the server's pipeline window is full
+ROUND_HISTORY = 1024        # Finished rounds kept per node
+REGISTRY_POLL_WAIT = 30     # Seconds the server holds a registry long-poll open
+REGISTRY_RETRY_DELAY = 5    # Back-off after a failed registry fetch
+BLOB_CACHE_BYTES = 16 * 1024 * 1024  # Payloads kept for peers that fetch them from this node
+
+
+class NodeProtocol:
+    # Phase timings (sign, verify, fetch, pre_prepare, fanout, prepare,
+    # prepare_quorum, commit, request_round) per round, served at /metrics and /traces
+    def setup_metrics(self):
+        self.telemetry = Metrics('iot_node')
+        self.messages_received = self.telemetry.counter(
+            'messages_received_total', 'Proposals and prepares received, by kind and outcome.', ('kind', 'result'))
+        self.rounds_proposed = self.telemetry.counter('rounds_proposed_total', 'Rounds this node opened as primary.')
+        self.payload_fetches = self.telemetry.counter(
+            'payload_fetches_total', 'Proposal payloads resolved, by where they came from.', ('source',))
+        self.telemetry.gauge('mempool_readings', 'Readings waiting to be packed into a block.', lambda: len(self.mempool))
+        self.telemetry.gauge('tracked_rounds', 'Rounds this node holds state for.', lambda: len(self.rounds))
+        self.telemetry.gauge('known_nodes', 'Nodes in the local registry copy.', lambda: len(self.public_keys))
+        self.telemetry.gauge('key_cache_hits_total', 'Verifying key cache hits.', lambda: self.verifier.key_hits, 'counter')
+        self.telemetry.gauge('key_cache_misses_total', 'Verifying key cache misses.', lambda: self.verifier.key_misses, 'counter')
+        self.telemetry.gauge('logs_dropped_total', 'Log records dropped by the shipper.',
+                             lambda: self.log_shipper.total_dropped, 'counter')
+
+    def log_message(self, message, log_type='node'):
+        # Queued and shipped in batches by a background thread; never blocks
+        self.log_shipper.ship(message, log_type)
+
+    def load_or_generate_keys(self):
+        if os.path.exists(self.key_file):
+            # Load existing key
+            with open(self.key_file, 'rb') as f:
+                self.private_key = SigningKey.from_pem(f.read())
+            self.log_message("Loaded existing key pair.", log_type='node')
+        else:
+            # Generate new key and save it to a file
+            self.private_key = SigningKey.generate(curve=NIST256p)
+            with open(self.key_file, 'wb') as f:
+                f.write(self.private_key.to_pem())
+            self.log_message("Generated new key pair.", log_type='node')
+        self.public_key = self.private_key.verifying_key
+
+    def registration(self):
+        registration = {
+            "node_id": self.node_id,
+            "public_key": self.public_key.to_string().hex(),
+            "public_url": self.public_url,
+        }
+        if self.group is not None:
+            registration["group"] = self.group
+        return registration
+
+    # Merge a /public_keys response into public_keys/public_urls. Without a
+    # registry_version it is the full registry (version in the
+    # X-Registry-Version header), afterwards a delta since that version.
+    # Returns True if the registry copy changed.
+    def merge_registry(self, data, header_version):
+        if self.registry_version is None:
+            version, full, nodes = header_version, True, data
+        else:
+            version, full = data["version"], data["full"]
+            nodes = data["nodes"] if full else data["changes"]
+        new_public_keys = {} if full else dict(self.public_keys)
+        new_public_urls = {} if full else dict(self.public_urls)
+        for peer_id, entry in nodes.items():
+            # Only peers in this node's shard take part in its rounds
+            if entry.get('shard', 0) == self.shard:
+                new_public_keys[peer_id] = entry['public_key']
+                new_public_urls[peer_id] = entry['public_url']
+            else:
+                new_public_keys.pop(peer_id, None)
+                new_public_urls.pop(peer_id, None)
+        self.registry_version = version
+        if new_public_keys == self.public_keys and new_public_urls == self.public_urls:
+            return False
+        self.public_keys = new_public_keys
+        self.public_urls = new_public_urls
+        self.key_cache.retain(new_public_keys.values())
+        print(f"Node {self.node_id}: Updated public keys and URLs (registry version {version}).")
+        return True
+
+    # Every peer of the shard but this node, {node_id: base_url}
+    def replicas(self):
+        return {node_id: public_url for node_id, public_url in self.public_urls.items()
+                if node_id != str(self.node_id)}
+
+    # Prepares the primary needs from other nodes: a 2f + 1 quorum including itself
+    def prepare_threshold(self):
+        return quorum_size(len(self.public_keys), self.quorum_f) - 1
+
+    # Get or create the state for round (view, seq), proposing the payload `digest`
+    def open_round(self, view, seq, primary_id, digest):
+        with self.rounds_lock:
+            round_state = self.rounds.get(seq)
+            if round_state is None or round_state["view"] != view:
+                round_state = {"view": view, "primary_id": primary_id, "digest": digest, "prepare_messages": {},
+                               "consensus_sent": False, "opened": time.perf_counter()}
+                self.rounds[seq] = round_state
+                while len(self.rounds) > ROUND_HISTORY:
+                    del self.rounds[next(iter(self.rounds))]
+            return round_state
+
+    # Count a verified prepare. True only for the prepare that completes the
+    # round's quorum; later ones are kept but change nothing. Prepares for a
+    # round this node didn't propose, or for another payload, don't count.
+    def record_prepare(self, view, seq, node_id, prepare_message):
+        with self.rounds_lock:
+            round_state = self.rounds.get(seq)
+            if (round_state is None or round_state["view"] != view
+                    or round_state["digest"] != prepare_message["digest"]):
+                print(f"Node {self.node_id}: Ignored prepare from Node {node_id} for unknown round "
+                      f"or payload {view}/{seq}.")
+                return False
+            round_state["prepare_messages"][node_id] = prepare_message
+            if (round_state["consensus_sent"] or "prepared_at" in round_state
+                    or len(round_state["prepare_messages"]) < self.prepare_threshold()):
+                return False
+            round_state["prepared_at"] = time.perf_counter()
+        self.telemetry.record('prepare_quorum', round_state["prepared_at"] - round_state["opened"],
+                              round_id(view, seq))
+        print(f"Node {self.node_id}: Received a quorum of prepare messages for round {view}/{seq}.")
+        return True
+
+    # Mark the round's commit as sent and return its state; None if it
+    # already was or the round is no longer tracked
+    def claim_consensus(self, seq):
+        with self.rounds_lock:
+            round_state = self.rounds.get(seq)
+            if round_state is None or round_state["consensus_sent"]:
+                return None  # Already committed to this round
+            round_state["consensus_sent"] = True
+            return round_state
+
+    # Signed prepare or commit for round (view, seq) and its payload digest
+    def round_vote(self, status, view, seq, digest, signature):
+        return {
+            "node_id": self.node_id,
+            "status": status,
+            "view": view,
+            "seq": seq,
+            "digest": digest,
+            "signature": signature,
+        }
+
+    # Payloads are resolved from the local cache, else the server's blob
+    # store, else the primary. A fetched payload is only used if it hashes to
+    # the digest.
+    def cached_payload(self, digest):
+        payload = self.blob_cache.get(digest)
+        if payload is None:
+            return None
+        self.payload_fetches.inc(1, 'cache')
+        return json.loads(payload)
+
+    def payload_sources(self, primary_id):
+        sources = (('server', self.central_server_url), ('peer', self.public_urls.get(primary_id)))
+        return [(source, base_url) for source, base_url in sources if base_url is not None]
+
+    # Block data from a fetched payload, or None if it doesn't match the digest
+    def accept_payload(self, digest, source, payload):
+        if not self.blob_cache.put_verified(digest, payload):
+            return None
+        self.payload_fetches.inc(1, source)
+        return json.loads(payload)
@@ -1,49 +1,136 @@
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
-from flask import Flask, request, jsonify, render_template
-from ecdsa import VerifyingKey, NIST256p, BadSignatureError
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from block_store import BlockStore, ChainCache, migrate_from_json
+from block_index import BlockIndex, INDEX_FILE
+from key_cache import VerifyingKeyCache
+from blob_cache import BlobCache
+from verify_pool import BatchVerifier, default_workers
+from log_buffer import RingLog, last_spilled_seq, merge_since
+from log_archive import LogArchive
+from log_push import LogPusher
+from consensus import encode_payload, is_round_number, round_message, quorum_size
+from metrics import Metrics, round_id
+from state_log import StateLog
+import wire
+from merkle import (GENESIS_HASH, block_hash, block_header, block_transactions, hash_leaf, merkle_proof,
+                    merkle_root, verify_blocks)
 import logging
 import hashlib
+import heapq
+import itertools
 import json
 import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack
 from datetime import datetime
 
 app = Flask(__name__)
 
 # Configure CORS for the app
-cors = CORS(app, resources={r"/*": {"origins": "*"}})
+cors = CORS(app, resources={r"/*": {"origins": "*"}},
+            expose_headers=["ETag", "X-Chain-Height", "X-Next-Cursor", "X-Registry-Version"])
 
 # Configure SocketIO with allowed origins
 socketio = SocketIO(app, cors_allowed_origins="*") 
                     # cors_allowed_origins="https://0ac7-2405-201-d02d-48be-20e6-6cdf-2a9d-3440.ngrok-free.app")
 
+# Logs are kept in fixed-size ring buffers (LOG_CAPACITY entries each). With
+# LOG_SPILL_DIR set, evicted entries are written there and stay queryable,
+# also after a restart.
+LOG_CAPACITY = int(os.environ.get('LOG_CAPACITY', '10000'))
+LOG_SPILL_DIR = os.environ.get('LOG_SPILL_DIR')
+# Shared so one cursor works across all buffers; continues after spilled entries
+log_sequence = itertools.count(last_spilled_seq(LOG_SPILL_DIR) + 1)
+
+# Spill file of a buffer: a readable prefix of its name plus a hash of the
+# full name, so names that sanitize alike (e.g. "a b" and "a_b") don't share a file
+def spill_file_name(name):
+    prefix = re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:64]
+    return f"{prefix}-{hashlib.sha256(name.encode()).hexdigest()[:12]}.jsonl"
+
+def new_log_buffer(name):
+    spill_path = None
+    if LOG_SPILL_DIR:
+        spill_path = os.path.join(LOG_SPILL_DIR, spill_file_name(name))
+    return RingLog(LOG_CAPACITY, sequence=log_sequence, spill_path=spill_path)
+
+# Every central and node log line is also kept in a persistent archive with
+# indexes on node, level, log type and words, served by /logs/search. Lines
+# are bucketed by LOG_ARCHIVE_BUCKET seconds; buckets are compressed once they
+# are LOG_ARCHIVE_COMPACT_AFTER seconds old and deleted after
+# LOG_ARCHIVE_RETENTION seconds (0 keeps them).
+LOG_ARCHIVE_DIR = os.environ.get('LOG_ARCHIVE_DIR',
+                                 os.path.join(os.environ.get('BLOCK_STORE_DIR', 'blockchain_data'), 'logs'))
+LOG_ARCHIVE_BUCKET = int(os.environ.get('LOG_ARCHIVE_BUCKET', '3600'))
+LOG_ARCHIVE_COMPACT_AFTER = float(os.environ.get('LOG_ARCHIVE_COMPACT_AFTER', '86400'))
+LOG_ARCHIVE_RETENTION = float(os.environ.get('LOG_ARCHIVE_RETENTION', '0'))
+LOG_SEARCH_LIMIT = 100       # Default page size of /logs/search
+LOG_SEARCH_MAX_LIMIT = 1000
+log_archive = LogArchive(LOG_ARCHIVE_DIR,
+                         bucket_seconds=LOG_ARCHIVE_BUCKET,
+                         compact_after=LOG_ARCHIVE_COMPACT_AFTER,
+                         retention=LOG_ARCHIVE_RETENTION)
+
+# Merge log buffers ('central' or (kind, node_id) keys) into the /logs shape,
+# oldest first, up to `limit` entries in total. With seqs=True central lines
+# (plain strings) get their sequence numbers in "central_seqs"; node entries
+# carry theirs as "seq".
+def group_logs(buffers, since=0, limit=None, seqs=False):
+    logs = {"central_logs": [], "node_logs": {}, "cursor": since}
+    if seqs:
+        logs["central_seqs"] = []
+    for name, seq, entry in itertools.islice(merge_since(buffers, since), limit):
+        if name == 'central':
+            logs["central_logs"].append(entry)
+            if seqs:
+                logs["central_seqs"].append(seq)
+        else:
+            logs["node_logs"].setdefault(name[1], []).append(entry)
+        logs["cursor"] = seq
+    return logs
+
 # Set up logging with an in-memory log storage
 class InMemoryLogHandler(logging.Handler):
     def __init__(self):
         super().__init__()
-        self.central_logs = [] 
+        self.central_logs = new_log_buffer('central')
         self.node_logs = {}
 
     def emit(self, record):
         log_entry = self.format(record)
         log_type = getattr(record, 'log_type', 'central')  # Default to 'central' if log_type is not provided
         node_id = getattr(record, 'node_id', 'unknown')   # Default to 'unknown' if node_id is not provided
+        log_archive.append(record.getMessage(), node_id=getattr(record, 'node_id', None),
+                           level=record.levelname, log_type=log_type)
         
         # If the log is from a node, store it by node_id
         if log_type == 'node':
             if node_id not in self.node_logs:
-                self.node_logs[node_id] = []
+                self.node_logs[node_id] = new_log_buffer(f"handler_node_{node_id}")
             self.node_logs[node_id].append(log_entry)
-            socketio.emit('node_log_update', {'node_id': node_id, 'log': log_entry})  # Emit node-specific log
         else:
             # If it's a central log, store it in the central logs
+            # (dashboards receive it in the next coalesced log_batch frame)
             self.central_logs.append(log_entry)
-            socketio.emit('server_log_update', log_entry)  # Emit central server log
 
-    def get_logs(self, node_id=None):
+    def get_logs(self, node_id=None, since=0, limit=None, log_type=None):
         if node_id:
-            return self.node_logs.get(node_id, [])  # Return logs for the specific node
-        return {"central_logs": self.central_logs, "node_logs": self.node_logs}  # Return all logs
+            # Return logs for the specific node
+            buffer = self.node_logs.get(node_id)
+            return [entry for _, entry in buffer.query(since, limit)] if buffer else []
+        # Return all logs, oldest first, up to `limit` entries in total
+        buffers = {}
+        if log_type in (None, 'central'):
+            buffers['central'] = self.central_logs
+        if log_type in (None, 'node'):
+            buffers.update({('node', node_id): buffer for node_id, buffer in self.node_logs.items()})
+        return group_logs(buffers, since, limit)
 
 # Configure logging
 logger = logging.getLogger('my_app')
@@ -58,27 +145,126 @@ logger.addHandler(memory_handler)
 
 # Global variables
 registered_nodes = {}   # node_id: {public_key: public_key_hex, public_url: public_url}
-proposal = None         # Stores the block proposal
-prepare_messages = {}   # node_id: prepare_message
-consensus_messages = {} # node_id: consensus_message
-node_logs = {}
+node_logs = {}          # node_id: RingLog of logs received from the node
+key_cache = VerifyingKeyCache()  # Parsed public keys of registered nodes
+
+# Payloads of proposed blocks by digest. Proposals to replicas carry only the
+# digest and replicas fetch the payload from /blobs, so the primary uploads
+# it once (with its round request) instead of once per replica.
+BLOB_CACHE_BYTES = int(os.environ.get('BLOB_CACHE_BYTES', str(64 * 1024 * 1024)))
+blob_cache = BlobCache(BLOB_CACHE_BYTES)
+
+# The registry is versioned so nodes can fetch only what changed since the
+# version they hold, or long-poll until something does
+REGISTRY_CHANGE_HISTORY = 10000
+REGISTRY_MAX_WAIT = 60.0
+registry_version = 0
+registry_changes = []   # [(version, node_id)], oldest first
+registry_changed = threading.Condition()
+
+# Consensus rounds are identified by (view, seq) within a shard. Up to
+# PIPELINE_WINDOW rounds per shard can be in flight at once; blocks still
+# commit strictly in seq order. A round that hasn't reached consensus after
+# ROUND_TIMEOUT seconds is abandoned so it can't hold back the rounds behind it.
+PIPELINE_WINDOW = int(os.environ.get('PIPELINE_WINDOW', '8'))
+ROUND_TIMEOUT = float(os.environ.get('ROUND_TIMEOUT', '30'))
+
+# Nodes are partitioned into SHARD_COUNT consensus groups (shards) by the
+# group they register with, their node id if none: numeric groups by modulo,
+# others by CRC32. Each shard has its own rounds, sequence numbers and chain,
+# so device fleets in different shards commit in parallel.
+SHARD_COUNT = max(1, int(os.environ.get('SHARD_COUNT', '1')))
+
+def shard_for_group(group):
+    group = str(group)
+    if group.isdigit():
+        return int(group) % SHARD_COUNT
+    return zlib.crc32(group.encode()) % SHARD_COUNT
+
+# A round is decided once a PBFT quorum of the nodes registered when it opened
+# has sent a commit. QUORUM_F overrides the tolerated number of faulty nodes
+# (default: the largest f with n >= 3f + 1).
+QUORUM_F = int(os.environ['QUORUM_F']) if os.environ.get('QUORUM_F') else None
+ROUND_METRICS_HISTORY = 1024
+
+# Counters, histograms and per-round phase traces served at /metrics and /traces
+telemetry = Metrics('iot_server')
+rounds_opened = telemetry.counter('rounds_opened_total', 'Rounds opened for a proposal.')
+rounds_committed = telemetry.counter('rounds_committed_total', 'Rounds committed to the chain.')
+rounds_expired = telemetry.counter('rounds_expired_total', 'Rounds dropped after ROUND_TIMEOUT.')
+pipeline_full = telemetry.counter('pipeline_full_total', 'Proposals rejected because the pipeline window was full.')
+consensus_messages = telemetry.counter('consensus_messages_total', 'Consensus messages by outcome.', ('result',))
+round_seconds = telemetry.histogram('round_seconds', 'Time from opening a round to committing its block.')
+telemetry.gauge('open_rounds', 'Rounds opened but not yet committed.',
+                lambda: sum(len(shard.rounds) for shard in shards))
+telemetry.gauge('registered_nodes', 'Nodes in the registry.', lambda: len(registered_nodes))
+telemetry.gauge('registry_version', 'Current registry version.', lambda: registry_version)
+telemetry.gauge('key_cache_hits_total', 'Verifying key cache hits.', lambda: batch_verifier.key_hits, 'counter')
+telemetry.gauge('key_cache_misses_total', 'Verifying key cache misses.', lambda: batch_verifier.key_misses, 'counter')
+
+# Consensus signatures are verified in micro-batches on a process pool.
+# VERIFY_WORKERS=0 verifies inline instead (the default on a single CPU).
+VERIFY_WORKERS = int(os.environ.get('VERIFY_WORKERS', default_workers()))
+VERIFY_BATCH_SIZE = int(os.environ.get('VERIFY_BATCH_SIZE', '64'))
+VERIFY_BATCH_DELAY = float(os.environ.get('VERIFY_BATCH_DELAY', '0.002'))
+batch_verifier = BatchVerifier(workers=VERIFY_WORKERS,
+                               max_batch=VERIFY_BATCH_SIZE,
+                               max_delay=VERIFY_BATCH_DELAY,
+                               key_cache=key_cache)
+
+# Everything pushed to dashboards: central logs and logs received from nodes
+def pushed_log_buffers():
+    buffers = {'central': memory_handler.central_logs}
+    buffers.update({('node', node_id): buffer for node_id, buffer in list(node_logs.items())})
+    return buffers
+
+def latest_log_seq():
+    return max((buffer.last_seq for buffer in pushed_log_buffers().values()), default=0)
+
+# Log updates are coalesced into one frame per client every LOG_PUSH_WINDOW seconds
+LOG_PUSH_WINDOW = float(os.environ.get('LOG_PUSH_WINDOW', '0.25'))
+LOG_SNAPSHOT_LIMIT = int(os.environ.get('LOG_SNAPSHOT_LIMIT', '200'))
+log_pusher = LogPusher(socketio,
+                       collect=lambda since, limit: group_logs(pushed_log_buffers(), since, limit, seqs=True),
+                       latest=latest_log_seq,
+                       window=LOG_PUSH_WINDOW,
+                       snapshot_limit=LOG_SNAPSHOT_LIMIT)
 
 @socketio.on('connect')
 def handle_connect(auth):
     print("Client connected")
-    emit('server_logs', get_all_logs())  # Send all logs when the client connects
+    # Reconnecting clients pass {"cursor": N, "epoch": E} and only receive what they missed
+    try:
+        cursor = int(auth['cursor'])
+    except (TypeError, KeyError, ValueError):
+        cursor = None
+    epoch = auth.get('epoch') if isinstance(auth, dict) else None
+    snapshot = log_pusher.connect(request.sid, cursor, epoch)
+    if snapshot is not None:
+        emit('server_logs', snapshot)  # Send a bounded snapshot to new clients
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    log_pusher.disconnect(request.sid)
 
 # Function to get all stored logs
-def get_all_logs():
-    return memory_handler.get_logs()
+def get_all_logs(since=0, limit=None, log_type=None):
+    return memory_handler.get_logs(since=since, limit=limit, log_type=log_type)
 
+# Query logs: ?since=<cursor>&limit=&log_type=central|node. Pass the returned
+# "cursor" back as `since` to fetch only newer entries.
 @app.route('/logs', methods=['GET'])
 def get_logs():
-    return jsonify(get_all_logs())
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({"status": "failed", "message": "since and limit must be integers."}), 400
+    return jsonify(get_all_logs(since, limit, request.args.get('log_type')))
 
 @socketio.on('request_logs')
 def handle_log_request():
-    emit('server_logs', get_all_logs())
+    emit('server_logs', log_pusher.snapshot())
 
 @app.route('/node_logs', methods=['POST'])
 def receive_log():
@@ -91,138 +277,1008 @@ def receive_log():
             logger.error("Invalid log data received.", extra={'log_type': 'central'})
             return jsonify({"status": "failed", "message": "Invalid log data."}), 400
 
-        log_type = data.get("log_type", "node")
-        log_entry = {"log": log_message, "log_type": log_type}
-
-        if node_id not in node_logs:
-            node_logs[node_id] = []
-        node_logs[node_id].append(log_entry)
-
-        # Emit the log entry to all connected clients
-        socketio.emit('node_log_update', {'node_id': node_id, 'log': log_entry})  # Emit node-specific log
+        log_entry = {"log": log_message, "log_type": data.get("log_type", "node")}
+        if data.get("level"):
+            log_entry["level"] = str(data["level"]).upper()
+        store_node_log(node_id, log_entry)
 
         return jsonify({"status": "success"}), 200
     except Exception as e:
         logger.error(f"Error receiving log: {e}", extra={'log_type': 'central'})
         return jsonify({"status": "failed", "message": str(e)}), 500
 
+# Bulk ingestion: {"node_id": ..., "logs": [{"log": ..., "log_type": ..., "level": ..., "time": ...}, ...]}
+@app.route('/node_logs_batch', methods=['POST'])
+def receive_log_batch():
+    try:
+        data = request.json
+        node_id = data.get("node_id")
+        logs = data.get("logs")
+
+        if node_id is None or node_id == '' or not isinstance(logs, list):
+            logger.error("Invalid log batch received.", extra={'log_type': 'central'})
+            return jsonify({"status": "failed", "message": "Invalid log batch."}), 400
+
+        node_id = str(node_id)
+        accepted = 0
+        for record in logs:
+            if not isinstance(record, dict) or not record.get("log"):
+                continue
+            log_entry = {"log": record["log"], "log_type": record.get("log_type", "node")}
+            if record.get("level"):
+                log_entry["level"] = str(record["level"]).upper()
+            if record.get("time"):
+                log_entry["time"] = record["time"]
+            store_node_log(node_id, log_entry)
+            accepted += 1
+
+        return jsonify({"status": "success", "accepted": accepted}), 200
+    except Exception as e:
+        logger.error(f"Error receiving log batch: {e}", extra={'log_type': 'central'})
+        return jsonify({"status": "failed", "message": str(e)}), 500
+
+# Every line goes to the archive. Only registered nodes get a ring buffer
+# (and spill file): /node_logs is unauthenticated, so made-up node ids must
+# not be able to allocate buffers without limit.
+def store_node_log(node_id, log_entry):
+    node_id = str(node_id)
+    if node_id not in node_logs and node_id in registered_nodes:
+        node_logs[node_id] = new_log_buffer(f"node_{node_id}")
+    if node_id in node_logs:
+        log_entry["seq"] = node_logs[node_id].append(log_entry)
+    log_archive.append(log_entry["log"], node_id=node_id, level=log_entry.get("level", "INFO"),
+                       log_type=log_entry["log_type"])
+
+# Fetch logs for a specific node: ?since=<seq>&limit=&log_type= (default "node")
 @app.route('/node_logs/<node_id>', methods=['GET'])
 def get_node_logs(node_id):
-    # Fetch logs for a specific node
-    logs = [log for log in node_logs.get(node_id, []) if log["log_type"] == "node"]
-    return jsonify(logs), 200
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({"status": "failed", "message": "since and limit must be integers."}), 400
+    log_type = request.args.get('log_type', 'node')
+    buffer = node_logs.get(node_id)
+    logs = []
+    if buffer:
+        logs = [entry for _, entry in buffer.query(since, limit, lambda log: log["log_type"] == log_type)]
+    response = jsonify(logs)
+    response.headers['X-Next-Cursor'] = str(logs[-1]["seq"] if logs else since)
+    return response, 200
+
+# Search the log archive, newest first:
+#   ?node_id=&level=&log_type=          exact matches (level is case-insensitive)
+#   ?q=<words>                          lines containing every word
+#   ?from=<ISO time>&to=<ISO time>      when the server received the line
+# ?cursor=<id>&limit=<n> paginate: pass X-Next-Cursor back for older lines.
+@app.route('/logs/search', methods=['GET'])
+def search_logs():
+    try:
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        limit = max(1, min(int(request.args.get('limit', LOG_SEARCH_LIMIT)), LOG_SEARCH_MAX_LIMIT))
+        time_from, time_to = (datetime.fromisoformat(request.args[name]).timestamp() if request.args.get(name)
+                              else None for name in ('from', 'to'))
+    except ValueError:
+        return jsonify({"status": "failed", "message": "cursor and limit must be integers, from and to ISO times."}), 400
+    results = log_archive.search(node_id=request.args.get('node_id') or None,
+                                 level=request.args.get('level') or None,
+                                 log_type=request.args.get('log_type') or None,
+                                 text=request.args.get('q') or None,
+                                 time_from=time_from, time_to=time_to, before=cursor, limit=limit)
+    response = jsonify(results)
+    if len(results) == limit:
+        response.headers['X-Next-Cursor'] = str(results[-1]["id"])
+    return response, 200
+
+# Archive buckets, sizes and ingest queue
+@app.route('/logs/archive', methods=['GET'])
+def log_archive_stats():
+    return jsonify(log_archive.stats()), 200
+
+# Protocol messages arrive as JSON or in the binary wire format (wire.py).
+# Returns None for a malformed binary body.
+def read_message():
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            return wire.decode(request.get_data())[1]
+        except wire.UnsupportedMessage:
+            raise  # Answered by unsupported_message()
+        except ValueError:
+            return None
+    return request.json
+
+def malformed_message():
+    return jsonify({"status": "failed", "message": "Malformed message."}), 400
 
+# A binary message of another wire version or kind gets 415, so the sender
+# falls back to JSON
+@app.errorhandler(wire.UnsupportedMessage)
+def unsupported_message(e):
+    return jsonify({"status": "failed", "message": str(e)}), 415
+
+# Opens a new round and returns its (view, seq) so the primary can sign and
+# disseminate the proposal
 @app.route('/propose_block', methods=['POST'])
 def propose_block():
-    global proposal
-    block_data = request.json['block_data']
-    node_id = request.json['node_id']  # Ensure node_id is included in the log entry
-    proposal = {"block_data": block_data, "node_id": node_id}
-    logger.info(f"Received block proposal '{block_data}' from Node {node_id}.", 
+    message = read_message()
+    if message is None:
+        return malformed_message()
+    block_data = message['block_data']
+    if not isinstance(block_data, list):
+        # Nodes send a list of readings; wrap a single reading from older
+        # clients so every new block holds its transactions as a list
+        block_data = [block_data]
+    node_id = str(message['node_id'])  # Ensure node_id is included in the log entry
+    shard = shard_of(node_id)
+    with shard.round_lock:
+        expire_stalled_rounds(shard)
+        if shard.next_seq - shard.next_commit_seq >= PIPELINE_WINDOW:
+            pipeline_full.inc()
+            return jsonify({"status": "failed", "message": "Pipeline window full."}), 429
+        # Stored only once the round opens, so refused proposals don't fill the cache
+        digest = blob_cache.put(encode_payload(block_data))
+        view = shard.view
+        seq = shard.next_seq
+        shard.next_seq += 1
+        cluster_size = len(shard.members)
+        shard.rounds[seq] = {
+            "view": view,
+            "seq": seq,
+            "block_data": block_data,
+            "digest": digest,
+            "node_id": node_id,
+            "consensus_messages": {},
+            "decided": False,
+            "started": time.monotonic(),
+            "cluster_size": cluster_size,
+            "quorum": quorum_size(cluster_size, QUORUM_F),
+            "quorum_latency": None,
+        }
+        state_log.append("open", shard=shard.id, view=view, seq=seq, block_data=block_data, node_id=node_id,
+                         cluster_size=cluster_size, quorum=shard.rounds[seq]["quorum"])
+    rounds_opened.inc()
+    logger.info(f"Received block proposal '{block_data}' from Node {node_id} for round {shard.round_id(view, seq)}.", 
                 extra={'log_type': 'central', 'node_id': node_id})
-    logger.info(request.json)
-    return jsonify({"status": "received"}), 200
+    logger.info(message)
+    return jsonify({"status": "received", "view": view, "seq": seq, "shard": shard.id, "digest": digest}), 200
+
+# Payload of a proposal by digest, as its canonical JSON encoding. Content
+# never changes for a digest, so clients may cache it indefinitely.
+@app.route('/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    payload = blob_cache.get(digest)
+    if payload is None:
+        return jsonify({"status": "failed", "message": "Unknown payload."}), 404
+    response = Response(payload, mimetype='application/json')
+    response.headers['ETag'] = f'"{digest}"'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/blob_cache', methods=['GET'])
+def blob_cache_stats():
+    return jsonify(blob_cache.stats()), 200
+
+# Chain and round reads take ?shard=<id> (default 0). Returns None for a
+# shard that doesn't exist.
+def shard_arg():
+    try:
+        shard_id = int(request.args.get('shard', 0))
+    except ValueError:
+        return None
+    return shards[shard_id] if 0 <= shard_id < len(shards) else None
+
+def unknown_shard():
+    return jsonify({"status": "failed", "message": "Unknown shard."}), 404
+
+@app.route('/rounds', methods=['GET'])
+def get_rounds():
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    with shard.round_lock:
+        open_rounds = [{
+            "view": round_state["view"],
+            "seq": seq,
+            "node_id": round_state["node_id"],
+            "votes": len(round_state["consensus_messages"]),
+            "quorum": round_state["quorum"],
+            "decided": round_state["decided"],
+        } for seq, round_state in sorted(shard.rounds.items())]
+        next_commit_seq = shard.next_commit_seq
+    return jsonify({"shard": shard.id, "next_commit_seq": next_commit_seq, "window": PIPELINE_WINDOW,
+                    "rounds": open_rounds}), 200
+
+@app.route('/shards', methods=['GET'])
+def get_shards():
+    return jsonify([{
+        "shard": shard.id,
+        "nodes": sorted(shard.members),
+        "height": len(shard.chain_cache),
+        "tip_hash": shard.chain_tip_hash,
+        "open_rounds": len(shard.rounds),
+        "next_seq": shard.next_seq,
+        "next_commit_seq": shard.next_commit_seq,
+    } for shard in shards]), 200
+
+# Move a node into the shard its registry entry names. Called with
+# registry_changed held.
+def join_shard(node_id, shard_id):
+    for shard in shards:
+        shard.members.discard(node_id)
+    shards[shard_id].members.add(node_id)
+
+# Shard a node's proposals and votes are routed to; unregistered nodes go to shard 0
+def shard_of(node_id):
+    entry = registered_nodes.get(node_id)
+    return shards[entry.get('shard', 0)] if entry else shards[0]
 
 @app.route('/register_node', methods=['POST'])
 def register_node():
-    node_id = str(request.json['node_id'])
-    public_key_hex = request.json['public_key']
-    public_url = request.json['public_url']  # Get the public URL from the request
-    registered_nodes[node_id] = {
+    message = read_message()
+    if message is None:
+        return malformed_message()
+    node_id = str(message['node_id'])
+    public_key_hex = message['public_key']
+    if isinstance(public_key_hex, bytes):
+        public_key_hex = public_key_hex.hex()  # The registry serves keys as hex
+    public_url = message['public_url']  # Get the public URL from the request
+    group = str(message.get('group', node_id))  # Device fleet the node serves
+    global registry_version
+    entry = {
         'public_key': public_key_hex,
-        'public_url': public_url
+        'public_url': public_url,
+        'group': group,
+        'shard': shard_for_group(group),
     }
-    logger.info(f"Node {node_id}: Registered with server.", 
+    with registry_changed:
+        previous = registered_nodes.get(node_id)
+        if previous != entry:
+            if previous and previous['public_key'] != public_key_hex:
+                key_cache.invalidate(previous['public_key'])
+            registered_nodes[node_id] = entry
+            join_shard(node_id, entry['shard'])
+            registry_version += 1
+            registry_changes.append((registry_version, node_id))
+            del registry_changes[:-REGISTRY_CHANGE_HISTORY]
+            state_log.append("register", node_id=node_id, entry=entry, version=registry_version)
+            registry_changed.notify_all()
+            socketio.emit('registry_update', {"version": registry_version, "changes": {node_id: entry}})
+    logger.info(f"Node {node_id}: Registered with server in shard {entry['shard']}.", 
                 extra={'log_type': 'central', 'node_id': node_id})
-    logger.info(request.json)
-    return jsonify({'node_id': node_id, 'public_key': public_key_hex, 'public_url': public_url}), 201
+    logger.info(message)
+    return jsonify({'node_id': node_id, 'public_key': public_key_hex, 'public_url': public_url,
+                    'group': group, 'shard': entry['shard']}), 201
 
+# Without parameters: the full registry (ETag / If-None-Match supported).
+# ?since=<version>: only nodes changed after that version, as
+#   {"version", "full": false, "changes": {...}}, or the whole registry with
+#   "full": true when the version is too old to diff against.
+# &wait=<seconds>: long-poll until the registry moves past `since`.
 @app.route('/public_keys', methods=['GET'])
 def public_keys():
-    return jsonify(registered_nodes), 200
+    if request.args.get('since') is None:
+        etag = f'"registry-{registry_version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=304)
+        else:
+            response = jsonify(registered_nodes)
+        response.headers['ETag'] = etag
+        response.headers['X-Registry-Version'] = str(registry_version)
+        return response
+    try:
+        since = int(request.args['since'])
+        wait = min(float(request.args.get('wait', 0)), REGISTRY_MAX_WAIT)
+    except ValueError:
+        return jsonify({"status": "failed", "message": "since and wait must be numbers."}), 400
+    with registry_changed:
+        if wait > 0:
+            registry_changed.wait_for(lambda: registry_version != since, timeout=wait)
+        oldest_known = registry_changes[0][0] - 1 if registry_changes else registry_version
+        if since < oldest_known or since > registry_version:
+            return jsonify({"version": registry_version, "full": True, "nodes": dict(registered_nodes)}), 200
+        # Versions in registry_changes are consecutive, so index straight to `since`
+        changed = {node_id for _, node_id in registry_changes[since - oldest_known:]}
+        changes = {node_id: registered_nodes[node_id] for node_id in changed}
+    return jsonify({"version": registry_version, "full": False, "changes": changes}), 200
+
+@app.route('/key_cache', methods=['GET'])
+def key_cache_stats():
+    return jsonify(batch_verifier.key_cache_stats()), 200
+
+@app.route('/verifier', methods=['GET'])
+def verifier_stats():
+    return jsonify(batch_verifier.stats()), 200
 
 @app.route('/commit_message', methods=['POST'])
 def commit_message():
-    consensus_message = request.json
+    consensus_message = read_message()
+    if consensus_message is None:
+        return malformed_message()
     node_id = str(consensus_message['node_id'])
     status = consensus_message['status']
     signature = consensus_message['signature']
+    msg_view = consensus_message.get('view')
+    seq = consensus_message.get('seq')
+    digest = consensus_message.get('digest')
+    if msg_view is None or seq is None or digest is None:
+        return jsonify({"status": "failed", "message": "Missing view, sequence number or digest."}), 400
+    if not is_round_number(msg_view) or not is_round_number(seq):
+        return jsonify({"status": "failed", "message": "View and sequence number must be integers."}), 400
     public_key_hex = registered_nodes.get(node_id, {}).get('public_key')
+    shard = shard_of(node_id)  # Nodes only vote on their own shard's rounds
 
     # Verify the consensus message signature
-    if not verify_signature(status, signature, public_key_hex):
+    with telemetry.span('verify', shard.round_id(msg_view, seq)):
+        valid = verify_signature(round_message(status, msg_view, seq, digest), signature, public_key_hex)
+    if not valid:
+        consensus_messages.inc(1, 'invalid')
         return jsonify({"status": "failed", "message": "Invalid consensus message signature."}), 400
 
-    consensus_messages[node_id] = consensus_message
-    logger.info(f"Received consensus message from Node {node_id}.", 
-                extra={'log_type': 'central', 'node_id': node_id})
-    logger.info(request.json)
-
-    # Check if consensus is reached
-    if len(consensus_messages) == len(registered_nodes):
-        logger.info("Consensus reached. Committing the block.", 
-                    extra={'log_type': 'central'})
-        commit_block()
-        return jsonify({"status": "success", "message": "Block committed."}), 200
-    else:
+    with shard.round_lock:
+        round_state = shard.rounds.get(seq)
+        if round_state is None or round_state["view"] != msg_view:
+            if seq < shard.next_commit_seq:
+                # Late vote for a round that already committed (or timed out)
+                record_late_vote(shard, seq, node_id)
+                consensus_messages.inc(1, 'late')
+                return jsonify({"status": "success", "message": "Round already finished."}), 200
+            consensus_messages.inc(1, 'unknown_round')
+            return jsonify({"status": "failed", "message": "Unknown round."}), 400
+        if digest != round_state["digest"]:
+            # Signed for another payload than the one this round opened with
+            consensus_messages.inc(1, 'wrong_digest')
+            return jsonify({"status": "failed", "message": "Vote is for a different payload."}), 400
+        round_state["consensus_messages"][node_id] = consensus_message
+        state_log.append("vote", shard=shard.id, view=msg_view, seq=seq, node_id=node_id,
+                         message=json_safe(consensus_message))
+        consensus_messages.inc(1, 'accepted')
+        logger.info(f"Received consensus message from Node {node_id} for round {shard.round_id(msg_view, seq)}.", 
+                    extra={'log_type': 'central', 'node_id': node_id})
+        logger.info(consensus_message)
+
+        # Check if consensus is reached
+        if not round_state["decided"] and len(round_state["consensus_messages"]) >= round_state["quorum"]:
+            logger.info(f"Consensus reached for round {shard.round_id(msg_view, seq)} "
+                        f"({len(round_state['consensus_messages'])}/{round_state['cluster_size']} votes).", 
+                        extra={'log_type': 'central'})
+            round_state["decided"] = True
+            round_state["quorum_latency"] = time.monotonic() - round_state["started"]
+            telemetry.record('commit', round_state["quorum_latency"], shard.round_id(msg_view, seq))
+        if commit_ready_rounds(shard):
+            return jsonify({"status": "success", "message": "Block committed."}), 200
+        if round_state["decided"]:
+            return jsonify({"status": "success", "message": "Consensus reached, waiting for earlier rounds."}), 200
         return jsonify({"status": "success", "message": "Consensus message received."}), 200
 
+# Commit decided rounds in seq order; stops at the first undecided round.
+# Called with the shard's round_lock held. Returns the number of blocks committed.
+def commit_ready_rounds(shard):
+    committed = 0
+    while True:
+        expire_stalled_rounds(shard)
+        round_state = shard.rounds.get(shard.next_commit_seq)
+        if round_state is None or not round_state["decided"]:
+            return committed
+        seq = shard.next_commit_seq
+        commit_block(shard, round_state)
+        # The block is in the store: close the round before anything else can
+        # fail, so a later vote can't commit it a second time
+        del shard.rounds[seq]
+        shard.next_commit_seq += 1
+        committed += 1
+        finish_round_metrics(shard, round_state)
+        rounds_committed.inc()
+        round_seconds.observe(time.monotonic() - round_state["started"])
+        try:
+            state_log.append("commit", shard=shard.id, seq=seq)
+        except OSError as e:
+            # Recovery also advances past rounds whose block is in the store
+            logger.error(f"Could not log the commit of round {shard.round_id(round_state['view'], seq)}: {e}",
+                         extra={'log_type': 'central'})
+
+# Keep vote timings after commit so late votes show what waiting for every
+# node would have cost. Called with the shard's round_lock held.
+def finish_round_metrics(shard, round_state):
+    metrics = {
+        "view": round_state["view"],
+        "seq": round_state["seq"],
+        "cluster_size": round_state["cluster_size"],
+        "quorum": round_state["quorum"],
+        "quorum_latency": round_state["quorum_latency"],
+        "all_latency": None,
+        "late_votes": 0,
+        "started": round_state["started"],
+        "voters": set(round_state["consensus_messages"]),
+    }
+    if len(metrics["voters"]) >= metrics["cluster_size"]:
+        metrics["all_latency"] = metrics["quorum_latency"]
+    shard.round_metrics[round_state["seq"]] = metrics
+    while len(shard.round_metrics) > ROUND_METRICS_HISTORY:
+        shard.round_metrics.popitem(last=False)
+
+def record_late_vote(shard, seq, node_id):
+    metrics = shard.round_metrics.get(seq)
+    if metrics is None or node_id in metrics["voters"]:
+        return
+    metrics["voters"].add(node_id)
+    metrics["late_votes"] += 1
+    if len(metrics["voters"]) >= metrics["cluster_size"]:
+        metrics["all_latency"] = time.monotonic() - metrics["started"]
+
+# Per-round quorum vs wait-for-everyone latency, plus averages over rounds
+# where every node eventually voted
+@app.route('/round_metrics', methods=['GET'])
+def get_round_metrics():
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    with shard.round_lock:
+        finished = [{key: value for key, value in metrics.items() if key not in ("voters", "started")}
+                    for metrics in shard.round_metrics.values()]
+    complete = [m for m in finished if m["all_latency"] is not None and m["quorum_latency"] is not None]
+    summary = {"rounds": len(finished), "complete_rounds": len(complete)}
+    if complete:
+        summary["mean_quorum_latency"] = sum(m["quorum_latency"] for m in complete) / len(complete)
+        summary["mean_all_latency"] = sum(m["all_latency"] for m in complete) / len(complete)
+        summary["mean_latency_saved"] = summary["mean_all_latency"] - summary["mean_quorum_latency"]
+    return jsonify({"summary": summary, "rounds": finished}), 200
+
+# Skip rounds at the head of the shard's pipeline that timed out. Called
+# with the shard's round_lock held.
+def expire_stalled_rounds(shard):
+    first = shard.next_commit_seq
+    while shard.next_commit_seq < shard.next_seq:
+        round_state = shard.rounds.get(shard.next_commit_seq)
+        if round_state is not None:
+            if round_state["decided"] or time.monotonic() - round_state["started"] < ROUND_TIMEOUT:
+                break
+            logger.warning(f"Round {shard.round_id(round_state['view'], shard.next_commit_seq)} "
+                           f"timed out without consensus.", extra={'log_type': 'central'})
+            rounds_expired.inc()
+            del shard.rounds[shard.next_commit_seq]
+        shard.next_commit_seq += 1
+    if shard.next_commit_seq != first:
+        state_log.append("advance", shard=shard.id, next_commit_seq=shard.next_commit_seq)
+
 def verify_signature(message, signature_hex, public_key_hex):
     try:
-        public_key_bytes = bytes.fromhex(public_key_hex)
-        public_key = VerifyingKey.from_string(public_key_bytes, curve=NIST256p)
-        signature_bytes = bytes.fromhex(signature_hex)
-        return public_key.verify(signature_bytes, message.encode(), hashfunc=hashlib.sha256)
-    except BadSignatureError:
-        return False
+        # Blocks this request thread until the signature's batch is verified
+        return batch_verifier.verify(message, signature_hex, public_key_hex)
     except Exception as e:
         logger.error(f"Verification error: {e}", extra={'log_type': 'central'})
         return False
 
-# Function to load the blockchain from a JSON file
-def load_blockchain():
-    if os.path.exists('blockchain.json'):
-        with open('blockchain.json', 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                # If JSON is invalid, return an empty list
-                return []
-    return []
-
-# Function to save a new block to the blockchain
-def save_block_to_chain(block):
-    blockchain = load_blockchain()
-    blockchain.append(block)
-    with open('blockchain.json', 'w') as f:
-        json.dump(blockchain, f, indent=4)
+# Append-only block storage, one store per shard. Blocks are fsynced in groups
+# of BLOCK_STORE_SYNC_EVERY or every BLOCK_STORE_SYNC_INTERVAL seconds,
+# whichever comes first. Shard 0 keeps its blocks in BLOCK_STORE_DIR itself,
+# shard N in BLOCK_STORE_DIR/shard-N.
+LEGACY_BLOCKCHAIN_FILE = 'blockchain.json'
+BLOCK_STORE_DIR = os.environ.get('BLOCK_STORE_DIR', 'blockchain_data')
+BLOCK_STORE_SYNC_EVERY = int(os.environ.get('BLOCK_STORE_SYNC_EVERY', '1'))
+BLOCK_STORE_SYNC_INTERVAL = float(os.environ.get('BLOCK_STORE_SYNC_INTERVAL', '0'))
+
+# Each shard's chain is read through a view that keeps the newest
+# CHAIN_CACHE_SIZE blocks in memory, so recent reads never touch disk and
+# startup doesn't parse the whole chain. The chain is append-only, so a
+# height always refers to the same block.
+CHAIN_CACHE_SIZE = int(os.environ.get('CHAIN_CACHE_SIZE', '10000'))
+
+# Secondary indexes (proposer, commit time, reading hash) for /blocks/search,
+# one SQLite file per shard. BLOCK_INDEX_FILE only moves shard 0's.
+BLOCK_INDEX_FILE = os.environ.get('BLOCK_INDEX_FILE', os.path.join(BLOCK_STORE_DIR, INDEX_FILE))
+
+# Chain verification re-reads blocks from disk but only those appended since
+# the last verified checkpoint, which is persisted next to the shard's blocks
+CHECKPOINT_FILE = 'verified_checkpoint.json'
+
+# Round state and chain of one consensus group
+class Shard:
+    def __init__(self, shard_id, directory, index_file):
+        self.id = shard_id
+        self.members = set()    # node_ids registered in this shard
+        self.view = 0           # Bumped on a view change (there are none yet)
+        self.rounds = {}        # seq: {view, seq, block_data, node_id, consensus_messages, decided, started, ...}
+        self.round_lock = threading.Lock()
+        self.round_metrics = OrderedDict()  # seq: vote timings of finished rounds, updated by late votes
+        self.block_store = BlockStore(directory,
+                                      sync_every=BLOCK_STORE_SYNC_EVERY,
+                                      sync_interval=BLOCK_STORE_SYNC_INTERVAL)
+        if shard_id == 0:
+            migrate_legacy_chain(self.block_store)
+        self.chain_cache = ChainCache(self.block_store, CHAIN_CACHE_SIZE)
+        self.chain_lock = threading.Lock()
+        self.chain_tip_hash = block_hash(self.chain_cache[-1]) if self.chain_cache else GENESIS_HASH
+        # Blocks the index missed, e.g. on first start, are indexed from the store
+        self.block_index = BlockIndex(index_file)
+        indexed = self.block_index.catch_up(self.block_store)
+        if indexed:
+            logger.info(f"Indexed {indexed} blocks into {index_file}.", extra={'log_type': 'central'})
+        self.checkpoint_file = os.path.join(directory, CHECKPOINT_FILE)
+        self.verify_lock = threading.Lock()
+        # Sequence numbers continue from the chain height across restarts
+        self.next_seq = len(self.chain_cache)         # Next sequence number to hand out
+        self.next_commit_seq = len(self.chain_cache)  # Next sequence number to commit
+
+    # Rounds of shard 0 keep the plain "view/seq" id; others are prefixed
+    def round_id(self, view_number, seq):
+        return round_id(view_number, seq) if self.id == 0 else f"{self.id}:{round_id(view_number, seq)}"
+
+# Import an existing blockchain.json the first time the store is opened
+def migrate_legacy_chain(store):
+    if len(store) == 0 and os.path.exists(LEGACY_BLOCKCHAIN_FILE):
+        try:
+            migrated = migrate_from_json(LEGACY_BLOCKCHAIN_FILE, store)
+            logger.info(f"Migrated {migrated} blocks from {LEGACY_BLOCKCHAIN_FILE}.",
+                        extra={'log_type': 'central'})
+        except (ValueError, OSError) as e:
+            logger.error(f"Could not migrate {LEGACY_BLOCKCHAIN_FILE}: {e}", extra={'log_type': 'central'})
+
+def open_shard(shard_id):
+    if shard_id == 0:
+        return Shard(0, BLOCK_STORE_DIR, BLOCK_INDEX_FILE)
+    directory = os.path.join(BLOCK_STORE_DIR, f'shard-{shard_id}')
+    return Shard(shard_id, directory, os.path.join(directory, INDEX_FILE))
+
+shards = [open_shard(shard_id) for shard_id in range(SHARD_COUNT)]
+
+# Shard 0 under the names it had before sharding, for tools that read them
+block_store = shards[0].block_store
+chain_cache = shards[0].chain_cache
+block_index = shards[0].block_index
+
+# Function to save a new block to the shard's chain
+def save_block_to_chain(shard, block):
+    with shard.chain_lock:
+        height = shard.block_store.append(block)
+        shard.chain_cache.append(block)
+        shard.chain_tip_hash = block.get("hash") or block_hash(block)
+    return height
 
 # Modify the commit_block function to save the block with additional information
-def commit_block():
-    global proposal, prepare_messages, consensus_messages
-    logger.info(f"Block data '{proposal['block_data']}' has been committed.", 
+def commit_block(shard, round_state):
+    logger.info(f"Block data '{round_state['block_data']}' has been committed.", 
                 extra={'log_type': 'central'})
     
     # Create a block with additional information
     block = {
-        "block_data": proposal['block_data'],
-        "committed_by": proposal.get('node_id', 'unknown'),  # Node that initiated the commit
+        "block_data": round_state['block_data'],
+        "committed_by": round_state.get('node_id', 'unknown'),  # Node that initiated the commit
         "commit_time": datetime.now().isoformat(),  # Current date and time in ISO format
+        "view": round_state['view'],
+        "seq": round_state['seq'],
+        "previous_hash": shard.chain_tip_hash,  # Links the block to the one before it
+        "merkle_root": merkle_root(block_transactions({"block_data": round_state['block_data']})),
     }
+    block["hash"] = block_hash(block)
     
     # Save the block to the blockchain
-    save_block_to_chain(block)  # Save the entire proposal as a block
+    trace = shard.round_id(block["view"], block["seq"])
+    with telemetry.span('persist', trace):
+        height = save_block_to_chain(shard, block)  # Save the entire proposal as a block
+    with telemetry.span('index', trace):
+        try:
+            shard.block_index.add(height, block)
+        except sqlite3.Error as e:
+            # The index is derived data; `python block_index.py rebuild` restores it
+            logger.error(f"Could not index block {height} of shard {shard.id}: {e}", extra={'log_type': 'central'})
+
+telemetry.gauge('chain_height', 'Blocks in the chains of all shards.',
+                lambda: sum(len(shard.chain_cache) for shard in shards))
+
+# Prometheus text exposition of the counters and histograms above
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(telemetry.expose(), mimetype='text/plain; version=0.0.4')
+
+# Phase spans of recent rounds, newest last: ?limit=<n>, or one round by
+# view/seq (&shard=<id> for rounds outside shard 0)
+@app.route('/traces', methods=['GET'])
+def get_traces():
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"status": "failed", "message": "limit must be a number."}), 400
+    return jsonify(telemetry.dump_traces(limit)), 200
+
+@app.route('/traces/<int:trace_view>/<int:seq>', methods=['GET'])
+def get_round_trace(trace_view, seq):
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    traces = telemetry.dump_traces(round_id=shard.round_id(trace_view, seq))
+    if not traces:
+        return jsonify({"status": "failed", "message": "No trace for that round."}), 404
+    return jsonify(traces[0]), 200
+
+# Registry and round changes go to a write-ahead log in STATE_DIR; a snapshot
+# of the whole state is written every STATE_SNAPSHOT_EVERY records or
+# STATE_SNAPSHOT_INTERVAL seconds. Startup loads the snapshot and replays only
+# the records after it, so devices don't re-register and open rounds survive.
+STATE_DIR = os.environ.get('STATE_DIR', os.path.join(BLOCK_STORE_DIR, 'state'))
+STATE_WAL_SYNC_EVERY = int(os.environ.get('STATE_WAL_SYNC_EVERY', '1'))
+STATE_SNAPSHOT_EVERY = int(os.environ.get('STATE_SNAPSHOT_EVERY', '10000'))
+STATE_SNAPSHOT_INTERVAL = float(os.environ.get('STATE_SNAPSHOT_INTERVAL', '60'))
+state_log = StateLog(STATE_DIR, sync_every=STATE_WAL_SYNC_EVERY, snapshot_every=STATE_SNAPSHOT_EVERY)
+
+# Consensus messages in the binary wire format carry raw signature bytes
+def json_safe(message):
+    return {key: value.hex() if isinstance(value, bytes) else value for key, value in message.items()}
+
+def restore_round(shard, view_number, seq, block_data, node_id, cluster_size, quorum):
+    digest = blob_cache.put(encode_payload(block_data))  # Replicas may still need to fetch it
+    shard.rounds[seq] = {
+        "view": view_number,
+        "seq": seq,
+        "block_data": block_data,
+        "digest": digest,
+        "node_id": node_id,
+        "consensus_messages": {},
+        "decided": False,
+        "started": time.monotonic(),  # The timeout restarts with the server
+        "cluster_size": cluster_size,
+        "quorum": quorum,
+        "quorum_latency": None,
+    }
+
+def restore_vote(shard, view_number, seq, node_id, message):
+    round_state = shard.rounds.get(seq)
+    if round_state is None or round_state["view"] != view_number:
+        return
+    round_state["consensus_messages"][node_id] = message
+    if len(round_state["consensus_messages"]) >= round_state["quorum"]:
+        round_state["decided"] = True
+
+# The shard is recomputed from the group in case SHARD_COUNT changed
+def restore_registration(node_id, entry):
+    entry['shard'] = shard_for_group(entry.get('group', node_id))
+    registered_nodes[node_id] = entry
+    join_shard(node_id, entry['shard'])
+
+# Round records name their shard; those from before sharding belong to shard 0
+def record_shard(record):
+    shard_id = record.get("shard", 0)
+    return shards[shard_id] if shard_id < len(shards) else None
+
+def replay_record(record):
+    global registry_version
+    op = record["op"]
+    if op == "register":
+        restore_registration(record["node_id"], record["entry"])
+        registry_version = record["version"]
+        registry_changes.append((record["version"], record["node_id"]))
+        del registry_changes[:-REGISTRY_CHANGE_HISTORY]
+        return
+    shard = record_shard(record)
+    if shard is None:
+        return  # The shard was dropped by lowering SHARD_COUNT
+    if op == "open":
+        restore_round(shard, record["view"], record["seq"], record["block_data"], record["node_id"],
+                      record["cluster_size"], record["quorum"])
+        shard.next_seq = max(shard.next_seq, record["seq"] + 1)
+    elif op == "vote":
+        restore_vote(shard, record["view"], record["seq"], record["node_id"], record["message"])
+    elif op == "commit":
+        shard.rounds.pop(record["seq"], None)
+        shard.next_commit_seq = max(shard.next_commit_seq, record["seq"] + 1)
+    elif op == "advance":
+        for seq in [seq for seq in shard.rounds if seq < record["next_commit_seq"]]:
+            del shard.rounds[seq]
+        shard.next_commit_seq = max(shard.next_commit_seq, record["next_commit_seq"])
+
+def restore_shard(shard, saved):
+    shard.view = saved["view"]
+    shard.next_seq = max(shard.next_seq, saved["next_seq"])
+    shard.next_commit_seq = max(shard.next_commit_seq, saved["next_commit_seq"])
+    for saved_round in saved["rounds"]:
+        restore_round(shard, saved_round["view"], saved_round["seq"], saved_round["block_data"],
+                      saved_round["node_id"], saved_round["cluster_size"], saved_round["quorum"])
+        for node_id, message in saved_round["votes"].items():
+            restore_vote(shard, saved_round["view"], saved_round["seq"], node_id, message)
+    if saved["chain_height"] > len(shard.chain_cache):
+        logger.warning(f"Shard {shard.id} block store has {len(shard.chain_cache)} blocks but the state "
+                       f"snapshot saw {saved['chain_height']}.", extra={'log_type': 'central'})
+
+def recover_state():
+    global registry_version
+    start = time.perf_counter()
+    snapshot, records = state_log.recover()
+    if snapshot is not None:
+        for node_id, entry in snapshot["registered_nodes"].items():
+            restore_registration(node_id, entry)
+        registry_version = snapshot["registry_version"]
+        registry_changes.extend((version, node_id) for version, node_id in snapshot["registry_changes"])
+        # Snapshots from before sharding hold shard 0's state at the top level
+        for saved in snapshot.get("shards", [dict(snapshot, shard=0)]):
+            shard = record_shard(saved)
+            if shard is not None:
+                restore_shard(shard, saved)
+    for record in records:
+        replay_record(record)
+    for shard in shards:
+        # A block can reach the store before its commit record does
+        last_block = shard.chain_cache[-1] if len(shard.chain_cache) else None
+        if last_block is not None and isinstance(last_block.get("seq"), int):
+            for seq in [seq for seq in shard.rounds if seq <= last_block["seq"]]:
+                del shard.rounds[seq]
+            shard.next_commit_seq = max(shard.next_commit_seq, last_block["seq"] + 1)
+        shard.next_seq = max(shard.next_seq, shard.next_commit_seq)
+        with shard.round_lock:
+            commit_ready_rounds(shard)
+    logger.info(f"Recovered state in {time.perf_counter() - start:.3f}s: registry version {registry_version}, "
+                f"{sum(len(shard.rounds) for shard in shards)} open rounds in {len(shards)} shards, "
+                f"{len(records)} WAL records replayed.",
+                extra={'log_type': 'central'})
 
-    # Clear variables for the next consensus round
-    proposal = None
-    prepare_messages.clear()
-    consensus_messages.clear()
+# Called with registry_changed and every shard's round_lock held
+def capture_state():
+    return {
+        "registry_version": registry_version,
+        "registered_nodes": dict(registered_nodes),
+        "registry_changes": list(registry_changes),
+        "shards": [capture_shard(shard) for shard in shards],
+    }
+
+def capture_shard(shard):
+    return {
+        "shard": shard.id,
+        "chain_height": len(shard.chain_cache),
+        "tip_hash": shard.chain_tip_hash,
+        "view": shard.view,
+        "next_seq": shard.next_seq,
+        "next_commit_seq": shard.next_commit_seq,
+        "rounds": [{
+            "view": round_state["view"],
+            "seq": round_state["seq"],
+            "block_data": round_state["block_data"],
+            "node_id": round_state["node_id"],
+            "cluster_size": round_state["cluster_size"],
+            "quorum": round_state["quorum"],
+            "votes": {node_id: json_safe(message) for node_id, message in round_state["consensus_messages"].items()},
+        } for round_state in shard.rounds.values()],
+    }
+
+# The state is captured under the locks; writing it out happens after
+def take_snapshot():
+    with ExitStack() as locks:
+        locks.enter_context(registry_changed)
+        for shard in shards:
+            locks.enter_context(shard.round_lock)
+        lsn = state_log.begin_snapshot()
+        state = capture_state()
+    state_log.write_snapshot(state, lsn)
+
+def snapshot_periodically():
+    while True:
+        state_log.snapshot_due.wait(STATE_SNAPSHOT_INTERVAL)
+        if state_log.lsn == state_log.snapshot_lsn:
+            continue
+        try:
+            take_snapshot()
+        except OSError as e:
+            logger.error(f"State snapshot failed: {e}", extra={'log_type': 'central'})
+            time.sleep(1)
+
+recover_state()
+threading.Thread(target=snapshot_periodically, daemon=True).start()
+
+@app.route('/state', methods=['GET'])
+def state_stats():
+    return jsonify(state_log.stats()), 200
+
+# Blocks are streamed to NDJSON clients in chunks of this many lines
+BLOCKCHAIN_STREAM_CHUNK = 256
+
+def parse_height_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    return int(value)
 
 # Endpoint to get the blockchain data
+#   ?start=&end=     height range [start, end)
+#   ?since=N         only blocks above height N
+#   ?cursor=&limit=  paginate; the next cursor is returned in X-Next-Cursor
+#   ?format=ndjson   (or Accept: application/x-ndjson) stream one block per line
+#   ?shard=<id>      that shard's chain (default 0); ?shard=all for every shard
 @app.route('/blockchain', methods=['GET'])
 def get_blockchain():
-    blockchain = load_blockchain()
-    return jsonify(blockchain), 200
+    if request.args.get('shard') == 'all':
+        return get_cross_shard_blockchain()
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    chain_cache = shard.chain_cache
+    height = len(chain_cache)
+    try:
+        start = parse_height_arg('start', 0)
+        cursor = parse_height_arg('cursor')
+        since = parse_height_arg('since')
+        end = parse_height_arg('end', height)
+        limit = parse_height_arg('limit')
+    except ValueError:
+        return jsonify({"status": "failed", "message": "Heights and limits must be integers."}), 400
+    if cursor is not None:
+        start = cursor
+    if since is not None:
+        start = max(start, since + 1)
+    start = max(0, start)
+    end = min(max(start, end), height)
+    if limit is not None:
+        end = min(end, start + max(0, limit))
+
+    # Content only depends on the chain height and the query, and ETags are per URL
+    etag = f'"chain-{height}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+    else:
+        wants_ndjson = (request.args.get('format') == 'ndjson' or
+                        request.accept_mimetypes.best == 'application/x-ndjson')
+        if wants_ndjson:
+            def generate():
+                # One contiguous read per chunk, not one lookup per block
+                for chunk_start in range(start, end, BLOCKCHAIN_STREAM_CHUNK):
+                    chunk = chain_cache[chunk_start:min(chunk_start + BLOCKCHAIN_STREAM_CHUNK, end)]
+                    yield ''.join(json.dumps(block) + '\n' for block in chunk)
+            response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        else:
+            response = jsonify(chain_cache[start:end])
+    response.headers['ETag'] = etag
+    response.headers['X-Chain-Height'] = str(height)
+    if end < height:
+        response.headers['X-Next-Cursor'] = str(end)
+    return response
+
+CROSS_SHARD_LIMIT = 1000
+
+# Blocks of every shard merged into one stream in commit_time order, as
+# [{"shard", "height", "block"}]. The cursor is one height per shard
+# ("h0,h1,..."); ?limit=<n> caps a page (default and max CROSS_SHARD_LIMIT)
+# and the next cursor is returned in X-Next-Cursor.
+def get_cross_shard_blockchain():
+    try:
+        cursor = request.args.get('cursor')
+        heights = [int(height) for height in cursor.split(',')] if cursor else [0] * len(shards)
+        limit = max(1, min(parse_height_arg('limit', CROSS_SHARD_LIMIT), CROSS_SHARD_LIMIT))
+    except ValueError:
+        return jsonify({"status": "failed", "message": "cursor must be comma-separated heights, limit an integer."}), 400
+    if len(heights) != len(shards):
+        return jsonify({"status": "failed", "message": f"cursor must have one height per shard ({len(shards)})."}), 400
+    tips = [len(shard.chain_cache) for shard in shards]
+
+    # Each shard's chain is already in commit_time order
+    def shard_blocks(shard, start, end):
+        for chunk_start in range(start, end, BLOCKCHAIN_STREAM_CHUNK):
+            chunk = shard.chain_cache[chunk_start:min(chunk_start + BLOCKCHAIN_STREAM_CHUNK, end)]
+            for offset, block in enumerate(chunk):
+                yield block.get("commit_time") or "", shard.id, chunk_start + offset, block
+
+    merged = heapq.merge(*[shard_blocks(shard, min(max(0, height), tip), tip)
+                           for shard, height, tip in zip(shards, heights, tips)])
+    results = []
+    for _, shard_id, height, block in itertools.islice(merged, limit):
+        results.append({"shard": shard_id, "height": height, "block": block})
+        heights[shard_id] = height + 1
+    response = jsonify(results)
+    response.headers['X-Chain-Height'] = ','.join(str(tip) for tip in tips)
+    if any(height < tip for height, tip in zip(heights, tips)):
+        response.headers['X-Next-Cursor'] = ','.join(str(height) for height in heights)
+    return response
+
+def load_checkpoint(shard):
+    try:
+        with open(shard.checkpoint_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"height": 0, "hash": GENESIS_HASH, "linked": False}
+
+def save_checkpoint(shard, checkpoint):
+    temp_file = shard.checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_file, shard.checkpoint_file)
+
+# Verify hash links and Merkle roots of new blocks; ?full=1 starts from genesis
+@app.route('/verify_chain', methods=['GET'])
+def verify_chain():
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    with shard.verify_lock:
+        checkpoint = load_checkpoint(shard)
+        # Checkpoints from before legacy blocks were limited to a prefix don't say
+        # whether a hash-linked block was seen; verify those chains again
+        if (request.args.get('full') == '1' or checkpoint["height"] > len(shard.block_store)
+                or (checkpoint["height"] and "linked" not in checkpoint)):
+            checkpoint = {"height": 0, "hash": GENESIS_HASH, "linked": False}
+        start = checkpoint["height"]
+        blocks = shard.block_store.read_range(start)
+        bad_offset, last_hash, linked = verify_blocks(blocks, checkpoint["hash"], checkpoint.get("linked", False))
+        checked = len(blocks) if bad_offset is None else bad_offset
+        checkpoint = {"height": start + checked, "hash": last_hash, "linked": linked}
+        save_checkpoint(shard, checkpoint)
+    result = {"shard": shard.id, "valid": bad_offset is None, "verified_height": checkpoint["height"],
+              "checked": checked, "tip_hash": checkpoint["hash"]}
+    if bad_offset is not None:
+        result["invalid_height"] = start + bad_offset
+        logger.error(f"Chain verification failed at height {start + bad_offset} of shard {shard.id}.",
+                     extra={'log_type': 'central'})
+    return jsonify(result), 200 if bad_offset is None else 409
+
+BLOCK_SEARCH_LIMIT = 100
+BLOCK_SEARCH_MAX_LIMIT = 1000
+
+def parse_time_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    return datetime.fromisoformat(value).isoformat()  # Same format as commit_time
+
+# Block lookups answered from the secondary indexes instead of a chain scan:
+#   ?committed_by=<node>&from=<ISO time>&to=<ISO time>   by proposer and/or commit time
+#   ?data=<reading> or ?hash=<Merkle leaf hash>          blocks holding a reading,
+#                                                        with its index for /proof
+# Results are in height order; ?cursor=<height>&limit=<n> paginate and the next
+# cursor is returned in X-Next-Cursor. ?shard=<id> searches that shard's chain.
+@app.route('/blocks/search', methods=['GET'])
+def search_blocks():
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    chain_cache, block_index = shard.chain_cache, shard.block_index
+    try:
+        cursor = parse_height_arg('cursor', 0)
+        limit = max(1, min(parse_height_arg('limit', BLOCK_SEARCH_LIMIT), BLOCK_SEARCH_MAX_LIMIT))
+        time_from = parse_time_arg('from')
+        time_to = parse_time_arg('to')
+    except ValueError:
+        return jsonify({"status": "failed", "message": "cursor and limit must be integers, from and to ISO times."}), 400
+    committed_by = request.args.get('committed_by')
+    leaf_hash = hash_leaf(request.args['data']) if request.args.get('data') is not None else request.args.get('hash')
+    if leaf_hash is not None:
+        matches = block_index.find_transaction(leaf_hash, after=cursor - 1, limit=limit)
+        results = [{"height": height, "index": position, "block": chain_cache[height]}
+                   for height, position in matches]
+    elif committed_by is not None or time_from is not None or time_to is not None:
+        heights = block_index.heights(committed_by, time_from, time_to, after=cursor - 1, limit=limit)
+        results = [{"height": height, "block": chain_cache[height]} for height in heights]
+    else:
+        return jsonify({"status": "failed", "message": "Give committed_by, from/to, data or hash."}), 400
+    response = jsonify(results)
+    if len(results) == limit:
+        response.headers['X-Next-Cursor'] = str(results[-1]["height"] + 1)
+    return response, 200
+
+# Inclusion proof for one transaction of a block: ?index=<i> or ?data=<reading>
+# (&shard=<id> for blocks outside shard 0)
+@app.route('/blocks/<int:height>/proof', methods=['GET'])
+def get_inclusion_proof(height):
+    shard = shard_arg()
+    if shard is None:
+        return unknown_shard()
+    chain_cache = shard.chain_cache
+    if not 0 <= height < len(chain_cache):
+        return jsonify({"status": "failed", "message": "No block at that height."}), 404
+    block = chain_cache[height]
+    transactions = block_transactions(block)
+    if request.args.get('data') is not None:
+        if request.args['data'] not in transactions:
+            return jsonify({"status": "failed", "message": "Reading is not in this block."}), 404
+        index = transactions.index(request.args['data'])
+    else:
+        try:
+            index = int(request.args.get('index', 0))
+        except ValueError:
+            return jsonify({"status": "failed", "message": "index must be an integer."}), 400
+        if not 0 <= index < len(transactions):
+            return jsonify({"status": "failed", "message": "No transaction at that index."}), 404
+    return jsonify({
+        "height": height,
+        "index": index,
+        "transaction": transactions[index],
+        "proof": merkle_proof(transactions, index),
+        "header": block_header(block),
+        "block_hash": block_hash(block),
+    }), 200
 
 if __name__ == '__main__':
     socketio.run(app, port=5000, debug=True)
\ No newline at end of file
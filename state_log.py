@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+
+# Write-ahead log and snapshots for the central server's in-memory state.
+#
+# Every registry or round change is appended as one JSON line with a
+# log sequence number (lsn) before the request returns. Now and then the
+# server writes a compact snapshot of the whole state tagged with the lsn it
+# covers; the WAL is split into segments (wal-<first lsn>.log) at that point
+# so segments the snapshot covers can be deleted. On startup recover()
+# returns the latest snapshot and only the records after it, so restart cost
+# is bounded by the snapshot size plus `snapshot_every` records.
+
+SNAPSHOT_FILE = 'snapshot.json'
+WAL_PREFIX = 'wal-'
+WAL_SUFFIX = '.log'
+
+
+class StateLog:
+    def __init__(self, directory, sync_every=1, snapshot_every=10000):
+        self.directory = directory
+        self.sync_every = max(1, sync_every)  # fsync after this many records
+        self.snapshot_every = snapshot_every   # Records after which a snapshot is due
+        self.lock = threading.Lock()
+        self.lsn = 0            # Last record written
+        self.snapshot_lsn = 0   # Last record covered by the snapshot on disk
+        self.unsynced = 0
+        self.wal_file = None
+        self.snapshot_due = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, first_lsn):
+        return os.path.join(self.directory, f"{WAL_PREFIX}{first_lsn:020d}{WAL_SUFFIX}")
+
+    def _segments(self):
+        firsts = []
+        for name in os.listdir(self.directory):
+            if name.startswith(WAL_PREFIX) and name.endswith(WAL_SUFFIX):
+                number = name[len(WAL_PREFIX):-len(WAL_SUFFIX)]
+                if number.isdigit():
+                    firsts.append(int(number))
+        return sorted(firsts)
+
+    def _fsync_directory(self):
+        if os.name == 'nt':
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read_segment(self, first_lsn, is_last):
+        records = []
+        path = self._segment_path(first_lsn)
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b'\n'):
+                    if not is_last:
+                        raise ValueError(f"Corrupt record in {path} at byte {offset}.")
+                    # Torn write from a crash: drop it and everything after
+                    with open(path, 'r+b') as g:
+                        g.truncate(offset)
+                    break
+                records.append(record)
+                offset += len(line)
+        return records
+
+    # Load the snapshot and the WAL records after it, then open the log for
+    # appending. Returns (snapshot or None, [records]).
+    def recover(self):
+        snapshot = None
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self.snapshot_lsn = self.lsn = snapshot["lsn"]
+        records = []
+        segments = self._segments()
+        for i, first_lsn in enumerate(segments):
+            for record in self._read_segment(first_lsn, i == len(segments) - 1):
+                if record["lsn"] > self.snapshot_lsn:
+                    records.append(record)
+                self.lsn = max(self.lsn, record["lsn"])
+        # Keep appending to the last segment; a new one only starts at a snapshot
+        self._open_segment(segments[-1] if segments else self.lsn + 1)
+        if self.lsn - self.snapshot_lsn >= self.snapshot_every:
+            self.snapshot_due.set()
+        return snapshot, records
+
+    def _open_segment(self, first_lsn):
+        if self.wal_file is not None:
+            self._sync()
+            self.wal_file.close()
+        self.wal_file = open(self._segment_path(first_lsn), 'ab')
+        self._fsync_directory()
+
+    def _sync(self):
+        self.wal_file.flush()
+        os.fsync(self.wal_file.fileno())
+        self.unsynced = 0
+
+    def append(self, op, **fields):
+        with self.lock:
+            self.lsn += 1
+            record = {"lsn": self.lsn, "op": op, "time": time.time()}
+            record.update(fields)
+            self.wal_file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+            else:
+                self.wal_file.flush()
+            if self.lsn - self.snapshot_lsn >= self.snapshot_every:
+                self.snapshot_due.set()
+            return self.lsn
+
+    # Start a new WAL segment and return the lsn a snapshot taken now covers.
+    # Call while holding whatever locks make the captured state consistent.
+    def begin_snapshot(self):
+        with self.lock:
+            self._open_segment(self.lsn + 1)
+            return self.lsn
+
+    # Atomically replace the snapshot, then delete WAL segments it covers
+    def write_snapshot(self, state, lsn):
+        state = dict(state, lsn=lsn)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        self._fsync_directory()
+        with self.lock:
+            self.snapshot_lsn = lsn
+            segments = self._segments()
+            # A segment is covered when the next one starts at or before lsn + 1
+            for first_lsn, next_first in zip(segments, segments[1:]):
+                if next_first <= lsn + 1:
+                    os.remove(self._segment_path(first_lsn))
+            if self.lsn - self.snapshot_lsn < self.snapshot_every:
+                self.snapshot_due.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lsn": self.lsn,
+                "snapshot_lsn": self.snapshot_lsn,
+                "records_since_snapshot": self.lsn - self.snapshot_lsn,
+                "segments": len(self._segments()),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.wal_file is not None:
+                self._sync()
+                self.wal_file.close()
+                self.wal_file = None
@@ -0,0 +1,48 @@
+import os
+import sys
+import pytest
+from ecdsa import SigningKey, NIST256p
+
+# The modules under test live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CLUSTER_SIZE = 4
+
+
+# The server keeps its state in module globals and reads its configuration
+# at import time, so one instance (in a temporary directory) serves every
+# test. Its registry holds the same CLUSTER_SIZE nodes throughout; tests
+# must not register others, or quorums change under them.
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('server')
+    os.environ['BLOCK_STORE_DIR'] = str(data_dir)
+    os.environ['LOG_SPILL_DIR'] = str(data_dir / 'spill')
+    os.environ['VERIFY_WORKERS'] = '0'
+    import server
+    yield server
+    for shard in server.shards:
+        shard.block_store.close()
+    server.log_archive.close()
+
+
+# {node_id: SigningKey} of the registered nodes
+@pytest.fixture(scope='session')
+def node_keys(server):
+    client = server.app.test_client()
+    keys = {}
+    for i in range(CLUSTER_SIZE):
+        node_id = f"test-{i}"
+        keys[node_id] = SigningKey.generate(curve=NIST256p)
+        response = client.post('/register_node', json={
+            "node_id": node_id,
+            "public_key": keys[node_id].verifying_key.to_string().hex(),
+            "public_url": f"http://127.0.0.1:{9000 + i}",
+        })
+        assert response.status_code == 201
+    return keys
+
+
+@pytest.fixture
+def client(server, node_keys):
+    return server.app.test_client()
@@ -0,0 +1,73 @@
+import os
+from block_store import BlockStore, ChainCache, INDEX_ENTRY, INDEX_SUFFIX, LOG_SUFFIX
+
+
+def blocks(count, start=0):
+    return [{"seq": i, "block_data": f"reading-{i}"} for i in range(start, start + count)]
+
+
+def fill(directory, count, segment_size=3):
+    store = BlockStore(str(directory), segment_size=segment_size)
+    for block in blocks(count):
+        store.append(block)
+    store.close()
+
+
+def tail_paths(directory):
+    base = max(name[:-len(LOG_SUFFIX)] for name in os.listdir(directory) if name.endswith(LOG_SUFFIX))
+    return os.path.join(directory, base + LOG_SUFFIX), os.path.join(directory, base + INDEX_SUFFIX)
+
+
+def test_reopen_reads_every_segment(tmp_path):
+    fill(tmp_path, 8)
+    store = BlockStore(str(tmp_path), segment_size=3)
+    assert len(store) == 8
+    assert store.read_all() == blocks(8)
+    assert store.get(4) == blocks(8)[4]
+    assert store.get(-1) == blocks(8)[7]
+    assert store.read_range(2, 7) == blocks(8)[2:7]
+    store.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    fill(tmp_path, 5)
+    log_path, index_path = tail_paths(tmp_path)
+    log_size = os.path.getsize(log_path)
+    # Crash halfway through a record, after its index entry was written
+    with open(log_path, 'ab') as f:
+        f.write(b'{"seq":5,"block_da')
+    with open(index_path, 'ab') as f:
+        f.write(INDEX_ENTRY.pack(log_size))
+    store = BlockStore(str(tmp_path), segment_size=3)
+    assert len(store) == 5
+    assert os.path.getsize(log_path) == log_size
+    assert store.read_all() == blocks(5)
+    assert store.append(blocks(1, 5)[0]) == 5
+    store.close()
+    store = BlockStore(str(tmp_path), segment_size=3)
+    assert store.read_all() == blocks(6)
+    store.close()
+
+
+def test_index_behind_log_is_rebuilt(tmp_path):
+    fill(tmp_path, 5)
+    _, index_path = tail_paths(tmp_path)
+    # The last block reached the log but not its index entry
+    with open(index_path, 'r+b') as f:
+        f.truncate(INDEX_ENTRY.size)
+    store = BlockStore(str(tmp_path), segment_size=3)
+    assert len(store) == 5
+    assert store.get(4) == blocks(5)[4]
+    store.close()
+    assert os.path.getsize(index_path) == 2 * INDEX_ENTRY.size
+
+
+def test_chain_cache_reads_through_to_the_store(tmp_path):
+    fill(tmp_path, 8)
+    store = BlockStore(str(tmp_path), segment_size=3)
+    cache = ChainCache(store, capacity=2)
+    assert len(cache) == 8
+    assert cache[0] == blocks(8)[0]
+    assert cache[-1] == blocks(8)[7]
+    assert cache[3:8] == blocks(8)[3:8]
+    store.close()
@@ -0,0 +1,109 @@
+import hashlib
+import sqlite3
+from consensus import round_message
+from merkle import verify_proof
+
+QUORUM = 3  # Of the four registered test nodes
+
+
+def sign(key, message):
+    return key.sign(message.encode(), hashfunc=hashlib.sha256).hex()
+
+
+def open_round(client, block_data, node_id="test-0"):
+    response = client.post('/propose_block', json={"node_id": node_id, "block_data": block_data})
+    assert response.status_code == 200
+    return response.json
+
+
+def commit_vote(client, node_keys, node_id, round_info, digest=None):
+    digest = digest or round_info["digest"]
+    return client.post('/commit_message', json={
+        "node_id": node_id, "status": "commit", "view": round_info["view"], "seq": round_info["seq"],
+        "digest": digest, "signature": sign(node_keys[node_id], round_message(
+            "commit", round_info["view"], round_info["seq"], digest)),
+    })
+
+
+def commit(client, node_keys, block_data):
+    round_info = open_round(client, block_data)
+    for node_id in list(node_keys)[:QUORUM]:
+        assert commit_vote(client, node_keys, node_id, round_info).status_code == 200
+    return round_info
+
+
+def block_at_seq(server, seq):
+    return next(block for block in server.chain_cache[0:len(server.chain_cache)] if block.get("seq") == seq)
+
+
+def test_single_array_reading_is_one_transaction(server, client, node_keys):
+    reading = ["sensor-17", 21.4]
+    round_info = commit(client, node_keys, [reading])
+    block = block_at_seq(server, round_info["seq"])
+    assert block["block_data"] == [reading]
+    height = server.chain_cache[0:len(server.chain_cache)].index(block)
+    assert client.get(f'/blocks/{height}/proof?index=1').status_code == 404
+    proof = client.get(f'/blocks/{height}/proof?index=0').json
+    assert proof["transaction"] == reading
+    assert verify_proof(reading, proof["proof"], block["merkle_root"])
+
+
+def test_unwrapped_reading_is_stored_as_a_list(server, client, node_keys):
+    round_info = commit(client, node_keys, "plain reading")
+    assert block_at_seq(server, round_info["seq"])["block_data"] == ["plain reading"]
+
+
+def test_non_integer_round_numbers_are_rejected(server, client, node_keys):
+    round_info = open_round(client, ["reading"])
+    for bad in ({"seq": str(round_info["seq"])}, {"view": float(round_info["view"])}, {"seq": True}):
+        vote = dict(round_info, **bad)
+        response = client.post('/commit_message', json={
+            "node_id": "test-1", "status": "commit", "view": vote["view"], "seq": vote["seq"],
+            "digest": vote["digest"], "signature": sign(node_keys["test-1"], round_message(
+                "commit", vote["view"], vote["seq"], vote["digest"])),
+        })
+        assert response.status_code == 400
+    for node_id in list(node_keys)[:QUORUM]:
+        assert commit_vote(client, node_keys, node_id, round_info).status_code == 200
+    assert block_at_seq(server, round_info["seq"])["block_data"] == ["reading"]
+
+
+def test_vote_only_counts_for_the_signed_digest(server, client, node_keys):
+    round_info = open_round(client, ["reading A"])
+    other_digest = hashlib.sha256(b"reading B").hexdigest()
+    # Validly signed, but for another payload than the round's
+    response = commit_vote(client, node_keys, "test-1", round_info, digest=other_digest)
+    assert response.status_code == 400
+    # Signed for the round's digest, sent as if for the other one
+    forged = {"node_id": "test-2", "status": "commit", "view": round_info["view"], "seq": round_info["seq"],
+              "digest": other_digest, "signature": sign(node_keys["test-2"], round_message(
+                  "commit", round_info["view"], round_info["seq"], round_info["digest"]))}
+    assert client.post('/commit_message', json=forged).status_code == 400
+    shard = server.shard_of("test-0")
+    assert shard.rounds[round_info["seq"]]["consensus_messages"] == {}
+    for node_id in list(node_keys)[:QUORUM]:
+        assert commit_vote(client, node_keys, node_id, round_info).status_code == 200
+
+
+def test_round_closes_even_if_index_and_wal_writes_fail(server, client, node_keys, monkeypatch):
+    shard = server.shard_of("test-0")
+    append = server.state_log.append
+
+    def failing_index(height, block):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def failing_commit_record(op, **record):
+        if op == "commit":
+            raise OSError("disk full")
+        return append(op, **record)
+
+    monkeypatch.setattr(shard.block_index, "add", failing_index)
+    monkeypatch.setattr(server.state_log, "append", failing_commit_record)
+    height = len(shard.chain_cache)
+    round_info = commit(client, node_keys, ["reading"])
+    assert round_info["seq"] not in shard.rounds
+    assert shard.next_commit_seq == round_info["seq"] + 1
+    # The remaining vote arrives late and must not commit the block again
+    response = commit_vote(client, node_keys, list(node_keys)[QUORUM], round_info)
+    assert response.json["message"] == "Round already finished."
+    assert len(shard.chain_cache) == height + 1
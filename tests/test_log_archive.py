@@ -0,0 +1,30 @@
+import os
+from log_archive import LogArchive, LogBucket
+
+
+def archive_lines(directory, messages, **options):
+    archive = LogArchive(str(directory), **options)
+    for message in messages:
+        archive.append(message)
+    archive.close()
+
+
+def test_ids_continue_after_restart(tmp_path):
+    archive_lines(tmp_path, ["first", "second"])
+    archive = LogArchive(str(tmp_path))
+    assert archive.next_id == 3
+    archive.append("third")
+    archive.flush()
+    assert [line["log"] for line in archive.search()] == ["third", "second", "first"]
+    assert [line["id"] for line in archive.search()] == [3, 2, 1]
+    archive.close()
+
+
+def test_empty_newest_bucket_does_not_reset_ids(tmp_path):
+    archive_lines(tmp_path, ["first", "second"], bucket_seconds=3600)
+    # A bucket created just before a crash, with nothing written to it yet
+    future = LogBucket(os.path.join(tmp_path, f"logs-{10 ** 10}.sqlite"), 10 ** 10)
+    future.close()
+    archive = LogArchive(str(tmp_path), bucket_seconds=3600)
+    assert archive.next_id == 3
+    archive.close()
@@ -0,0 +1,47 @@
+import itertools
+from log_buffer import RingLog
+from log_push import LogPusher
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.sent = []
+
+    def start_background_task(self, target):
+        pass
+
+    def emit(self, event, frame, to=None, callback=None):
+        self.sent.append(frame)
+
+
+# What the dashboard keeps of a frame: entries after its cursor
+def apply_frame(shown, cursor, frame):
+    for line, seq in zip(frame["central_logs"], frame["central_seqs"]):
+        if seq > cursor:
+            shown.append(line)
+    for entries in frame["node_logs"].values():
+        shown.extend(entry["log"] for entry in entries if entry["seq"] > cursor)
+    return max(cursor, frame["cursor"])
+
+
+def test_resent_frame_is_not_applied_twice(server):
+    sequence = itertools.count(1)
+    central, node = RingLog(10, sequence), RingLog(10, sequence)
+    buffers = {'central': central, ('node', 'n1'): node}
+    socketio = FakeSocketIO()
+    pusher = LogPusher(socketio, collect=lambda since, limit: server.group_logs(buffers, since, limit, seqs=True),
+                       latest=lambda: max(buffer.last_seq for buffer in buffers.values()), ack_timeout=0)
+    pusher.connect('sid', cursor=0, epoch=pusher.epoch)
+
+    central.append("central-1")
+    seq = node.append({"log": "node-2"})
+    node.entries[-1][1]["seq"] = seq
+    pusher.push()
+    shown, cursor = [], 0
+    cursor = apply_frame(shown, cursor, socketio.sent[-1])  # Applied, but the ack is lost
+
+    central.append("central-3")
+    pusher.push()  # Ack timed out: resent from cursor 0 with the new line
+    assert socketio.sent[-1]["central_seqs"] == [1, 3]
+    apply_frame(shown, cursor, socketio.sent[-1])
+    assert shown == ["central-1", "node-2", "central-3"]
@@ -0,0 +1,87 @@
+import copy
+from merkle import (GENESIS_HASH, block_hash, block_transactions, merkle_proof, merkle_root, verify_blocks,
+                    verify_proof)
+
+
+def make_chain(batches, previous_hash=GENESIS_HASH):
+    chain = []
+    for seq, block_data in enumerate(batches):
+        block = {
+            "block_data": block_data,
+            "committed_by": "1",
+            "seq": seq,
+            "previous_hash": previous_hash,
+            "merkle_root": merkle_root(block_transactions({"block_data": block_data})),
+        }
+        block["hash"] = previous_hash = block_hash(block)
+        chain.append(block)
+    return chain
+
+
+def legacy_block(block_data):
+    return {"block_data": block_data, "committed_by": "1", "commit_time": "2024-01-01T00:00:00"}
+
+
+def test_proof_verifies_every_leaf():
+    for size in (1, 2, 3, 7, 8, 33):
+        transactions = [{"device": "sensor", "n": i} for i in range(size)]
+        root = merkle_root(transactions)
+        for index, transaction in enumerate(transactions):
+            assert verify_proof(transaction, merkle_proof(transactions, index), root)
+
+
+def test_proof_rejects_tampering():
+    transactions = [f"reading-{i}" for i in range(5)]
+    root = merkle_root(transactions)
+    proof = merkle_proof(transactions, 2)
+    assert not verify_proof("reading-x", proof, root)
+    assert not verify_proof(transactions[2], merkle_proof(transactions, 3), root)
+    bad_proof = copy.deepcopy(proof)
+    bad_proof[0]["hash"] = "0" * 64
+    assert not verify_proof(transactions[2], bad_proof, root)
+    assert not verify_proof(transactions[2], proof, merkle_root(transactions[:4]))
+
+
+def test_verify_blocks_accepts_valid_chain():
+    chain = make_chain(["a", ["b", "c"], "d"])
+    assert verify_blocks(chain, GENESIS_HASH) == (None, chain[-1]["hash"], True)
+
+
+def test_verify_blocks_detects_tampering():
+    chain = make_chain(["a", ["b", "c"], "d", "e"])
+    changed_data = copy.deepcopy(chain)
+    changed_data[1]["block_data"] = ["b", "x"]
+    assert verify_blocks(changed_data, GENESIS_HASH)[0] == 1
+    changed_header = copy.deepcopy(chain)
+    changed_header[2]["committed_by"] = "2"
+    assert verify_blocks(changed_header, GENESIS_HASH)[0] == 2
+    # Rewriting a block and its own hash still breaks the next block's link
+    rehashed = copy.deepcopy(chain)
+    rehashed[2]["block_data"] = "z"
+    rehashed[2]["merkle_root"] = merkle_root(["z"])
+    rehashed[2]["hash"] = block_hash(rehashed[2])
+    assert verify_blocks(rehashed, GENESIS_HASH)[0] == 3
+
+
+def test_legacy_prefix_is_accepted():
+    prefix = [legacy_block("old-1"), legacy_block("old-2")]
+    _, prefix_hash, linked = verify_blocks(prefix, GENESIS_HASH)
+    assert not linked
+    chain = prefix + make_chain(["new-1", "new-2"], previous_hash=prefix_hash)
+    assert verify_blocks(chain, GENESIS_HASH)[0] is None
+
+
+def test_stripped_link_fields_after_linked_block_are_rejected():
+    chain = make_chain(["a", "b", "c"])
+    # Rewrite the tip and drop its link fields so it looks like a legacy block
+    chain[2] = legacy_block("forged")
+    assert verify_blocks(chain, GENESIS_HASH)[0] == 2
+    # Also when verification resumes from a checkpoint after the linked prefix
+    _, last_hash, linked = verify_blocks(chain[:2], GENESIS_HASH)
+    assert verify_blocks(chain[2:], last_hash, linked)[0] == 0
+
+
+def test_partial_link_fields_are_rejected():
+    chain = make_chain(["a", "b"])
+    del chain[1]["merkle_root"]
+    assert verify_blocks(chain, GENESIS_HASH)[0] == 1
@@ -0,0 +1,31 @@
+import threading
+from node_protocol import NodeProtocol
+from metrics import Metrics
+
+DIGEST_A = "aa" * 32
+DIGEST_B = "bb" * 32
+
+
+class Protocol(NodeProtocol):
+    def __init__(self):
+        self.node_id = "0"
+        self.public_keys = {str(i): None for i in range(4)}
+        self.quorum_f = None
+        self.rounds = {}
+        self.rounds_lock = threading.Lock()
+        self.telemetry = Metrics('test_node')
+
+
+def prepare(node_id, digest, view=0, seq=1):
+    return {"node_id": node_id, "status": "prepared", "view": view, "seq": seq, "digest": digest}
+
+
+def test_prepares_for_another_digest_do_not_count():
+    protocol = Protocol()
+    protocol.open_round(0, 1, "0", DIGEST_A)
+    assert protocol.prepare_threshold() == 2
+    assert not protocol.record_prepare(0, 1, "1", prepare("1", DIGEST_B))
+    assert not protocol.record_prepare(0, 1, "2", prepare("2", DIGEST_B))
+    assert protocol.rounds[1]["prepare_messages"] == {}
+    assert not protocol.record_prepare(0, 1, "1", prepare("1", DIGEST_A))
+    assert protocol.record_prepare(0, 1, "2", prepare("2", DIGEST_A))
@@ -0,0 +1,19 @@
+import os
+
+
+def test_spill_files_do_not_collide(server):
+    names = ["node_a b", "node_a_b", "node_a/b", "central"]
+    files = [server.spill_file_name(name) for name in names]
+    assert len(set(files)) == len(names)
+    assert all(os.path.basename(name) == name and name.endswith('.jsonl') for name in files)
+
+
+def test_only_registered_nodes_get_log_buffers(server, client):
+    response = client.post('/node_logs_batch', json={"node_id": "made-up", "logs": [{"log": "hello"}]})
+    assert response.status_code == 200
+    assert "made-up" not in server.node_logs
+    assert client.get('/node_logs/made-up').json == []
+
+    response = client.post('/node_logs_batch', json={"node_id": "test-0", "logs": [{"log": "hello"}]})
+    assert response.status_code == 200
+    assert [log["log"] for log in client.get('/node_logs/test-0').json] == ["hello"]
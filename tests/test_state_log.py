@@ -0,0 +1,72 @@
+import os
+import pytest
+from state_log import StateLog
+
+
+def write_records(log, count, start=0):
+    return [log.append("vote", seq=i) for i in range(start, start + count)]
+
+
+def wal_segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.log'))
+
+
+def test_replay_after_restart(tmp_path):
+    log = StateLog(str(tmp_path))
+    assert log.recover() == (None, [])
+    write_records(log, 3)
+    log.close()
+    log = StateLog(str(tmp_path))
+    snapshot, records = log.recover()
+    assert snapshot is None
+    assert [(record["lsn"], record["seq"]) for record in records] == [(1, 0), (2, 1), (3, 2)]
+    # Numbering continues after the replayed records
+    assert log.append("commit", seq=2) == 4
+    log.close()
+
+
+def test_snapshot_bounds_replay(tmp_path):
+    log = StateLog(str(tmp_path))
+    log.recover()
+    write_records(log, 3)
+    lsn = log.begin_snapshot()
+    write_records(log, 2, start=3)
+    log.write_snapshot({"next_seq": 3}, lsn)
+    log.close()
+    assert len(wal_segments(tmp_path)) == 1  # The covered segment is gone
+    log = StateLog(str(tmp_path))
+    snapshot, records = log.recover()
+    assert snapshot == {"next_seq": 3, "lsn": 3}
+    assert [record["seq"] for record in records] == [3, 4]
+    log.close()
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    log = StateLog(str(tmp_path))
+    log.recover()
+    write_records(log, 2)
+    log.close()
+    path = os.path.join(tmp_path, wal_segments(tmp_path)[-1])
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'{"lsn":3,"op":"vo')
+    log = StateLog(str(tmp_path))
+    _, records = log.recover()
+    assert [record["lsn"] for record in records] == [1, 2]
+    assert os.path.getsize(path) == size
+    assert log.append("vote", seq=2) == 3
+    log.close()
+
+
+def test_corrupt_record_before_the_tail_is_an_error(tmp_path):
+    log = StateLog(str(tmp_path))
+    log.recover()
+    write_records(log, 2)
+    log.begin_snapshot()  # Starts a second segment
+    write_records(log, 1, start=2)
+    log.close()
+    first = os.path.join(tmp_path, wal_segments(tmp_path)[0])
+    with open(first, 'ab') as f:
+        f.write(b'not json\n')
+    with pytest.raises(ValueError):
+        StateLog(str(tmp_path)).recover()
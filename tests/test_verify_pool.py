@@ -0,0 +1,45 @@
+import hashlib
+from ecdsa import SigningKey, NIST256p
+import verify_pool
+from verify_pool import BatchVerifier, default_workers
+
+MESSAGE = "commit:0:1:" + "ab" * 32
+
+
+def signed(message=MESSAGE):
+    key = SigningKey.generate(curve=NIST256p)
+    signature = key.sign(message.encode(), hashfunc=hashlib.sha256).hex()
+    return signature, key.verifying_key.to_string().hex()
+
+
+def test_single_cpu_verifies_inline(monkeypatch):
+    monkeypatch.setattr(verify_pool.os, "cpu_count", lambda: 1)
+    assert default_workers() == 0
+    monkeypatch.setattr(verify_pool.os, "cpu_count", lambda: 4)
+    assert default_workers() == 4
+
+
+def test_inline_verifier_uses_its_key_cache():
+    signature, public_key = signed()
+    verifier = BatchVerifier(workers=0)
+    try:
+        assert verifier.verify(MESSAGE, signature, public_key, timeout=10)
+        assert verifier.verify(MESSAGE, signature, public_key, timeout=10)
+        assert not verifier.verify(MESSAGE + "x", signature, public_key, timeout=10)
+        assert not verifier.verify(MESSAGE, signature, None, timeout=10)
+        assert verifier.executor is None
+        assert (verifier.key_hits, verifier.key_misses) == (2, 1)
+    finally:
+        verifier.shutdown()
+
+
+def test_pool_reports_worker_key_cache():
+    signature, public_key = signed()
+    verifier = BatchVerifier(workers=1)
+    try:
+        assert verifier.verify(MESSAGE, signature, public_key, timeout=60)
+        assert not verifier.verify(MESSAGE + "x", signature, public_key, timeout=60)
+        assert verifier.key_cache_stats()["workers"] == {"hits": 1, "misses": 1}
+        assert (verifier.key_hits, verifier.key_misses) == (1, 1)
+    finally:
+        verifier.shutdown()
@@ -0,0 +1,61 @@
+import json
+import pytest
+import wire
+
+SIGNATURE = bytes(range(64))
+KEY = bytes(range(64, 128))
+DIGEST = "ab" * 32
+
+
+def round_trip(path, message):
+    kind, decoded = wire.decode(wire.encode_message(path, message))
+    assert kind == wire.MESSAGE_KINDS[path]
+    return decoded
+
+
+def test_round_messages_round_trip():
+    proposal = {"node_id": "3", "view": 2, "seq": 1234, "digest": DIGEST, "signature": SIGNATURE.hex()}
+    assert round_trip('/receive_proposal', proposal) == dict(proposal, signature=SIGNATURE)
+    for path, status in (('/receive_prepare', "prepared"), ('/commit_message', "commit")):
+        vote = {"node_id": "3", "status": status, "view": 2, "seq": 1234, "digest": DIGEST, "signature": SIGNATURE}
+        assert round_trip(path, vote) == vote
+
+
+def test_register_and_round_request_round_trip():
+    registration = {"node_id": "7", "public_key": KEY.hex(), "public_url": "https://example.ngrok-free.app"}
+    assert round_trip('/register_node', registration) == dict(registration, public_key=KEY)
+    assert round_trip('/register_node', dict(registration, group="greenhouse")) == dict(
+        registration, public_key=KEY, group="greenhouse")
+    block_data = [{"device": "sensor-17", "temperature": 21.4}, "reading"]
+    request = {"node_id": "7", "block_data": block_data}
+    assert round_trip('/propose_block', request) == request
+
+
+def test_read_body_accepts_both_formats():
+    request = {"node_id": "7", "block_data": "reading"}
+    assert wire.read_body(wire.CONTENT_TYPE, wire.encode_message('/propose_block', request)) == request
+    assert wire.read_body('application/json', json.dumps(request).encode()) == request
+
+
+def test_unsupported_version_and_kind():
+    body = wire.encode_message('/propose_block', {"node_id": "7", "block_data": "reading"})
+    with pytest.raises(wire.UnsupportedMessage):
+        wire.decode(bytes((wire.VERSION + 1,)) + body[1:])
+    with pytest.raises(wire.UnsupportedMessage):
+        wire.decode(body[:1] + bytes((99,)) + body[2:])
+
+
+def test_malformed_body_is_not_unsupported():
+    body = wire.encode_message('/commit_message', {"node_id": "3", "status": "commit", "view": 0, "seq": 1,
+                                                   "digest": DIGEST, "signature": SIGNATURE})
+    for broken in (b'', body[:1], body[:-1]):
+        with pytest.raises(ValueError) as error:
+            wire.decode(broken)
+        assert not isinstance(error.value, wire.UnsupportedMessage)
+
+
+def test_messages_without_binary_form():
+    assert wire.encode_message('/status', {"node_id": "3"}) is None
+    assert wire.encode_message('/propose_block', {"node_id": "x" * 300, "block_data": "reading"}) is None
+    with pytest.raises(ValueError):
+        wire.encode(wire.PROPOSAL, {"node_id": "3", "view": 0, "seq": 1, "digest": DIGEST, "signature": b"short"})
@@ -0,0 +1,189 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from key_cache import VerifyingKeyCache
+from wire import signature_bytes
+
+# Batched, multi-process ECDSA verification.
+#
+# The pure-Python ecdsa package holds the GIL for the whole verify(), so
+# request threads can't verify in parallel. Callers submit (message,
+# signature, key) triples and wait on a Future; a collector thread groups
+# them into micro-batches and runs each batch on a process pool.
+#
+# Workers are started from a fresh interpreter (forkserver, or spawn where
+# that isn't available): forking the server, which by then runs request, log
+# and WAL threads, can copy a lock another thread holds and hang the worker.
+# On a single CPU a pool only adds IPC, so verification runs inline there.
+
+WORKER_KEY_CACHE_SIZE = 4096
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+worker_key_cache = None  # Per-process cache, created lazily in each worker
+
+
+def default_workers():
+    cpus = os.cpu_count() or 1
+    return cpus if cpus > 1 else 0
+
+
+# Fresh interpreters re-run the parent's __main__ script before unpickling
+# tasks. The server's script opens the block store and the WAL, so workers
+# are started with an empty __main__ and only import this module.
+@contextmanager
+def bare_main():
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+# The signature is hex (JSON messages) or raw bytes (binary wire format)
+def verify_one(key_cache, message, signature, public_key_hex):
+    try:
+        public_key = key_cache.get(public_key_hex)
+        return public_key.verify(signature_bytes(signature), message.encode(), hashfunc=hashlib.sha256)
+    except Exception:
+        # BadSignatureError, malformed hex or an unknown (None) key
+        return False
+
+
+# Runs inside a worker process. Returns the results and the batch's key cache
+# hits and misses, so the parent can report the workers' caches.
+def verify_batch(items):
+    global worker_key_cache
+    if worker_key_cache is None:
+        worker_key_cache = VerifyingKeyCache()
+    elif len(worker_key_cache.keys) > WORKER_KEY_CACHE_SIZE:
+        # Workers can't see registry changes, so just bound the cache
+        worker_key_cache.clear()
+    hits, misses = worker_key_cache.hits, worker_key_cache.misses
+    results = [verify_one(worker_key_cache, *item) for item in items]
+    return results, worker_key_cache.hits - hits, worker_key_cache.misses - misses
+
+
+# Runs inside a worker process; used to start every worker up front
+def start_worker():
+    return os.getpid()
+
+
+class BatchVerifier:
+    # workers=0 verifies inline on the collector thread (no process pool)
+    def __init__(self, workers=None, max_batch=64, max_delay=0.002, key_cache=None):
+        self.workers = default_workers() if workers is None else workers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.key_cache = key_cache or VerifyingKeyCache()
+        self.pending = queue.Queue()
+        self.executor = None
+        self.batches = 0
+        self.verified = 0
+        self.worker_key_hits = 0    # Key cache hits and misses inside worker processes
+        self.worker_key_misses = 0
+        self.lock = threading.Lock()
+        self.collector = None
+
+    def _start(self):
+        with self.lock:
+            if self.collector is not None:
+                return
+            if self.workers > 0:
+                with bare_main():
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context(START_METHOD))
+                    # The pool adds a worker per submit until it is full, so
+                    # start them all here, under bare_main()
+                    started = [self.executor.submit(start_worker) for _ in range(self.workers)]
+                for done in started:
+                    done.result()
+            self.collector = threading.Thread(target=self._collect, daemon=True)
+            self.collector.start()
+
+    def submit(self, message, signature_hex, public_key_hex):
+        if self.collector is None:
+            self._start()
+        future = Future()
+        self.pending.put(((message, signature_hex, public_key_hex), future))
+        return future
+
+    def verify(self, message, signature_hex, public_key_hex, timeout=None):
+        return self.submit(message, signature_hex, public_key_hex).result(timeout)
+
+    def _collect(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        self.batches += 1
+        self.verified += len(batch)
+        if self.executor is None:
+            self._resolve(futures, [verify_one(self.key_cache, *item) for item in items])
+            return
+        # Split the batch so every worker gets a share of a burst
+        chunk = max(1, -(-len(items) // self.workers))
+        for start in range(0, len(items), chunk):
+            done = self.executor.submit(verify_batch, items[start:start + chunk])
+            done.add_done_callback(
+                lambda done, futures=futures[start:start + chunk]: self._resolve_from(futures, done))
+
+    def _resolve_from(self, futures, done):
+        try:
+            results, hits, misses = done.result()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        with self.lock:
+            self.worker_key_hits += hits
+            self.worker_key_misses += misses
+        self._resolve(futures, results)
+
+    def _resolve(self, futures, results):
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "verified": self.verified,
+            "average_batch": self.verified / self.batches if self.batches else 0,
+        }
+
+    # Hits and misses of the parent's key cache and the workers' caches
+    @property
+    def key_hits(self):
+        return self.key_cache.hits + self.worker_key_hits
+
+    @property
+    def key_misses(self):
+        return self.key_cache.misses + self.worker_key_misses
+
+    def key_cache_stats(self):
+        return dict(self.key_cache.stats(),
+                    workers={"hits": self.worker_key_hits, "misses": self.worker_key_misses})
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
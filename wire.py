@@ -0,0 +1,158 @@
+import json
+import struct
+
+# Compact binary encoding of the protocol messages.
+#
+# JSON messages carry 64-byte signatures and public keys as 128-character hex
+# strings plus field names. The binary form sends them raw behind a fixed
+# header. A sender opts in per message with Content-Type CONTENT_TYPE; a
+# receiver that doesn't know it answers 415 (Flask's request.json does) and
+# the sender falls back to JSON for that peer.
+#
+# Layout (big-endian):
+#   header      version:u8 kind:u8
+#   proposal    view:u64 seq:u64 node_id:str8 signature:64 digest:32
+#   prepare     view:u64 seq:u64 node_id:str8 signature:64 digest:32
+#   commit      view:u64 seq:u64 node_id:str8 signature:64 digest:32
+#   register    node_id:str8 public_key:64 group:str8 public_url:utf8
+#   round       node_id:str8 block_data:json
+# str8 is a u8 length then UTF-8. The last field runs to the end of the body.
+# An empty group means the node didn't give one.
+# Decoded messages have the same keys as the JSON form, with "signature" and
+# "public_key" as raw bytes and node_id as a string. The payload digest is
+# decoded back to hex, as it names the payload in /blobs URLs.
+#
+# A body from another wire version or of an unknown kind raises
+# UnsupportedMessage, which receivers answer with 415 like an unknown content
+# type, so the sender falls back to JSON. Other decode errors are malformed
+# messages (400).
+
+CONTENT_TYPE = 'application/x-iot-consensus'
+VERSION = 4
+
+PROPOSAL, PREPARE, COMMIT, REGISTER, ROUND_REQUEST = 1, 2, 3, 4, 5
+
+# Endpoint each message kind is posted to
+MESSAGE_KINDS = {
+    '/receive_proposal': PROPOSAL,
+    '/receive_prepare': PREPARE,
+    '/commit_message': COMMIT,
+    '/register_node': REGISTER,
+    '/propose_block': ROUND_REQUEST,
+}
+
+HEADER = struct.Struct('>BB')
+ROUND = struct.Struct('>QQ')
+SIGNATURE_SIZE = 64
+KEY_SIZE = 64
+DIGEST_SIZE = 32
+ROUND_STATUS = {PREPARE: "prepared", COMMIT: "commit"}
+
+
+class UnsupportedMessage(ValueError):
+    pass
+
+
+# Signatures and keys may be given as hex (as built for JSON) or raw bytes
+def raw(value, size):
+    value = value if isinstance(value, bytes) else bytes.fromhex(value)
+    if len(value) != size:
+        raise ValueError(f"Expected {size} bytes, got {len(value)}.")
+    return value
+
+
+def encode_str(value):
+    data = str(value).encode()
+    if len(data) > 255:
+        raise ValueError("String field longer than 255 bytes.")
+    return bytes((len(data),)) + data
+
+
+def encode_json(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def encode(kind, message):
+    parts = [HEADER.pack(VERSION, kind)]
+    if kind in (PROPOSAL, PREPARE, COMMIT):
+        parts.append(ROUND.pack(message["view"], message["seq"]))
+        parts.append(encode_str(message["node_id"]))
+        parts.append(raw(message["signature"], SIGNATURE_SIZE))
+        parts.append(raw(message["digest"], DIGEST_SIZE))
+    elif kind == REGISTER:
+        parts.append(encode_str(message["node_id"]))
+        parts.append(raw(message["public_key"], KEY_SIZE))
+        group = message.get("group")
+        parts.append(encode_str("" if group is None else group))
+        parts.append(message["public_url"].encode())
+    elif kind == ROUND_REQUEST:
+        parts.append(encode_str(message["node_id"]))
+        parts.append(encode_json(message["block_data"]))
+    else:
+        raise ValueError(f"Unknown message kind {kind}.")
+    return b''.join(parts)
+
+
+# Binary body for a message posted to `path`, or None when it has no binary
+# form (not a protocol endpoint, or e.g. a node id too long for the header)
+def encode_message(path, message):
+    kind = MESSAGE_KINDS.get(path)
+    if kind is None:
+        return None
+    try:
+        return encode(kind, message)
+    except (ValueError, KeyError, struct.error):
+        return None
+
+
+# Returns (kind, message); raises UnsupportedMessage for another version or
+# kind and ValueError on a malformed body
+def decode(body):
+    try:
+        version, kind = HEADER.unpack_from(body, 0)
+        if version != VERSION:
+            raise UnsupportedMessage(f"Unsupported wire version {version}.")
+        offset = HEADER.size
+        message = {}
+        if kind in (PROPOSAL, PREPARE, COMMIT):
+            message["view"], message["seq"] = ROUND.unpack_from(body, offset)
+            offset += ROUND.size
+        if kind not in (PROPOSAL, PREPARE, COMMIT, REGISTER, ROUND_REQUEST):
+            raise UnsupportedMessage(f"Unknown message kind {kind}.")
+        length = body[offset]
+        message["node_id"] = body[offset + 1:offset + 1 + length].decode()
+        offset += 1 + length
+        if kind == REGISTER:
+            message["public_key"] = body[offset:offset + KEY_SIZE]
+            offset += KEY_SIZE
+            length = body[offset]
+            if length:
+                message["group"] = body[offset + 1:offset + 1 + length].decode()
+            offset += 1 + length
+            message["public_url"] = body[offset:].decode()
+        elif kind != ROUND_REQUEST:
+            message["signature"] = body[offset:offset + SIGNATURE_SIZE]
+            offset += SIGNATURE_SIZE
+            if kind in ROUND_STATUS:
+                message["status"] = ROUND_STATUS[kind]
+            message["digest"] = body[offset:offset + DIGEST_SIZE].hex()
+            offset += DIGEST_SIZE
+        else:
+            message["block_data"] = json.loads(body[offset:])
+        if len(body) < offset:
+            raise ValueError("Truncated message.")
+        return kind, message
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed message: {e}")
+
+
+# Parse a request body of either format into the JSON message shape
+def read_body(content_type, body):
+    if content_type == CONTENT_TYPE:
+        return decode(body)[1]
+    return json.loads(body)
+
+
+# Signatures as raw bytes, whichever format they arrived in
+def signature_bytes(signature):
+    return signature if isinstance(signature, bytes) else bytes.fromhex(signature)